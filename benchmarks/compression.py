@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+'''
+Compare reading, writing and translating each template in
+retractiontower/tests/data uncompressed and compressed with each codec
+that retractiontower.compressedfile supports (including .bgcode), to
+show the tradeoff between the time saved reading and writing less and
+the time spent compressing.
+
+Usage:
+benchmarks/compression.py [<repeat> [<MB/s,...>]]
+
+The default repeat is 3 (the best time is shown). For each disk speed
+in MB/s (default: 10,100), the time of translating is shown plus the
+time it would take that disk to read the template and write the output
+(such as an SD card or network mount at 10 MB/s).
+'''
+import contextlib
+import glob
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower import Program  # noqa: E402
+from retractiontower.compressedfile import open_file, zstd  # noqa: E402
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+TEMPLATES = sorted(glob.glob(os.path.join(TESTS_DATA_DIR,
+                                          "RetractionTestTemplate-*.gcode")))
+DEFAULT_REPEAT = 3
+DEFAULT_DISK_SPEEDS = (10.0, 100.0)
+CURVE_ARGS = ["/startwith", "2", "/interpolate", "3"]
+HEADER_FORMAT = "{:<36} {:<7} {:>6} {:>8} {:>8} {:>9}"
+ROW_FORMAT = "{:<36} {:<7} {:>6.2f} {:>8.3f} {:>8.3f} {:>9.3f}"
+CODECS = ["", ".gz", ".xz"]
+if zstd is not None:
+    CODECS.append(".zst")
+CODECS.append(".bgcode")
+
+
+def best_seconds(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+
+def read_all(path):
+    with open_file(path, 'r') as stream:
+        while stream.readline():
+            pass
+
+
+def copy_text(sourcePath, destinationPath):
+    with open(sourcePath, 'r') as ins, open_file(destinationPath,
+                                                 'w') as outs:
+        shutil.copyfileobj(ins, outs)
+
+
+def translate(templatePath, outputPath):
+    with open_file(templatePath, 'r') as reader, \
+            open_file(outputPath, 'w') as writer:
+        Program.TranslateGCode(reader, writer, Program.get_FirstTowerZ(),
+                               0.0, 0.0, Program.ParseCurveArgs(CURVE_ARGS))
+
+
+def main():
+    repeat = DEFAULT_REPEAT
+    diskSpeeds = DEFAULT_DISK_SPEEDS
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        diskSpeeds = [float(speed) for speed in sys.argv[2].split(",")]
+    header = HEADER_FORMAT.format(
+        "template", "codec", "ratio", "read (s)", "write", "translate",
+    )
+    for speed in diskSpeeds:
+        header += " {:>9}".format("@{:g}MB/s".format(speed))
+    print(header)
+    with tempfile.TemporaryDirectory() as tmp:
+        for templatePath in TEMPLATES:
+            size = os.path.getsize(templatePath)
+            for dotExt in CODECS:
+                name = os.path.basename(templatePath) + dotExt
+                compressedPath = os.path.join(tmp, name)
+                outputPath = os.path.join(tmp, "output.gcode" + dotExt)
+                writeSeconds = best_seconds(
+                    lambda: copy_text(templatePath, compressedPath),
+                    repeat,
+                )
+                readSeconds = best_seconds(
+                    lambda: read_all(compressedPath),
+                    repeat,
+                )
+                translateSeconds = best_seconds(
+                    lambda: translate(compressedPath, outputPath),
+                    repeat,
+                )
+                ioBytes = (os.path.getsize(compressedPath)
+                           + os.path.getsize(outputPath))
+                row = ROW_FORMAT.format(
+                    os.path.basename(templatePath)[:36],
+                    dotExt or "none",
+                    size / os.path.getsize(compressedPath),
+                    readSeconds,
+                    writeSeconds,
+                    translateSeconds,
+                )
+                for speed in diskSpeeds:
+                    row += " {:>9.3f}".format(
+                        translateSeconds + ioBytes / (speed * 1000000)
+                    )
+                print(row)
+                os.remove(compressedPath)
+                os.remove(outputPath)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
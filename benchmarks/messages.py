@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+Compare the size of the output of each template in
+retractiontower/tests/data with each message policy (See /messages),
+both changing E and with /firmware-retraction, to show how many
+characters and lines each saves compared to the default (a message
+before every retraction).
+
+Usage:
+benchmarks/messages.py [<curve option> ...]
+
+The curve options are the same as those of retractiontower (default:
+/startwith 2 /interpolate 3). The time is the best of 3 runs.
+'''
+import contextlib
+import glob
+import io
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower import MessagePolicy, Program  # noqa: E402
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+TEMPLATES = sorted(glob.glob(os.path.join(TESTS_DATA_DIR,
+                                          "RetractionTestTemplate-*.gcode")))
+DEFAULT_CURVE_ARGS = ["/startwith", "2", "/interpolate", "3"]
+REPEAT = 3
+MODES = [("E", False), ("G10", True)]
+HEADER_FORMAT = "{:<36} {:<4} {:<10} {:>10} {:>7} {:>8} {:>7} {:>8}"
+ROW_FORMAT = "{:<36} {:<4} {:<10} {:>10} {:>7} {:>8} {:>7.1%} {:>8.3f}"
+
+
+def count_messages(text):
+    count = 0
+    for line in text.splitlines():
+        if line.startswith("M117 ") or line.startswith("M118 "):
+            count += 1
+    return count
+
+
+def translate(text, curvePoints, policy, firmware_retraction):
+    '''
+    Get the (output, stats, seconds) tuple of translating text, where
+    seconds is the best of REPEAT runs.
+    '''
+    best = None
+    for _ in range(REPEAT):
+        output = io.StringIO()
+        stats = []
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            Program.TranslateVariants(
+                Program.ReadCommands(io.StringIO(text)),
+                [output],
+                Program.get_FirstTowerZ(),
+                0.0,
+                0.0,
+                [list(curvePoints)],
+                stats=stats,
+                firmware_retraction=firmware_retraction,
+                message_policy=policy,
+            )
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return output.getvalue(), stats[0], best
+
+
+def main():
+    curveArgs = sys.argv[1:] or DEFAULT_CURVE_ARGS
+    curvePoints = Program.ParseCurveArgs(curveArgs)
+    print(HEADER_FORMAT.format(
+        "template", "mode", "policy", "characters", "lines", "messages",
+        "saved", "time (s)",
+    ))
+    for templatePath in TEMPLATES:
+        with open(templatePath, 'r') as stream:
+            text = stream.read()
+        templateMessages = count_messages(text)
+        defaultCharacters = None
+        for mode, firmware_retraction in MODES:
+            for name, policy in MessagePolicy.NAMES.items():
+                output, stats, seconds = translate(
+                    text, curvePoints, policy, firmware_retraction
+                )
+                if defaultCharacters is None:
+                    defaultCharacters = stats['characters']
+                    # ^ The first row is the default (E, retraction).
+                print(ROW_FORMAT.format(
+                    os.path.basename(templatePath)[:36],
+                    mode,
+                    name,
+                    stats['characters'],
+                    stats['lines'],
+                    count_messages(output) - templateMessages,
+                    1.0 - stats['characters'] / defaultCharacters,
+                    seconds,
+                ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
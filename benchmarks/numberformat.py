@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+'''
+Compare coordinates per second of NumberFormatter.Coordinate with
+building a format string for each number using fxshim.optionalD (as
+GCodeCommandPart.ToString did), and check that the text is the same.
+
+Usage:
+benchmarks/numberformat.py [<count> [random]]
+
+The default count is 1000000 coordinates, which are the X and Y values
+of RetractionTestTemplate-C_CR-10.gcode from retractiontower/tests/data
+repeated, or random values like those of a bed up to 300 mm (with up to
+3 decimal places) if "random" is specified.
+'''
+import os
+import random
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower.fxshim import optionalD  # noqa: E402
+from retractiontower.gcodecommand import GCodeCommand  # noqa: E402
+from retractiontower.numberformat import NumberFormatter  # noqa: E402
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+DEFAULT_PATH = os.path.join(TESTS_DATA_DIR,
+                            "RetractionTestTemplate-C_CR-10.gcode")
+DEFAULT_COUNT = 1000000
+
+
+def read_coordinates(count, path=DEFAULT_PATH):
+    '''
+    Get count X and Y values from the G0 and G1 commands in path
+    (repeated if there are fewer).
+    '''
+    values = []
+    with open(path, 'r') as stream:
+        for line in stream:
+            command = GCodeCommand(line.rstrip("\n\r"), lazy=True)
+            if command.Command not in ("G0", "G1"):
+                continue
+            for character in "XY":
+                if command.HasParameter(character):
+                    values.append(command.GetParameter(character))
+    return (values * (count // len(values) + 1))[:count]
+
+
+def make_coordinates(count, seed=0):
+    generator = random.Random(seed)
+    return [round(generator.uniform(0.0, 300.0), generator.randint(0, 3))
+            for _ in range(count)]
+
+
+def format_with_optionalD(values):
+    return [optionalD(float(value), 3).format(float(value))
+            for value in values]
+
+
+def format_with_formatter(values):
+    coordinate = NumberFormatter(3).Coordinate
+    # ^ new each time so every run starts without cached text
+    return [coordinate(value) for value in values]
+
+
+def best_seconds(function, values, repeat=3):
+    '''
+    Get the best time out of repeat runs, and the result of the last.
+    '''
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(values)
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best, result
+
+
+def main():
+    count = DEFAULT_COUNT
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    if (len(sys.argv) > 2) and (sys.argv[2] == "random"):
+        values = make_coordinates(count)
+        print("{} random coordinates".format(count))
+    else:
+        values = read_coordinates(count)
+        print('{} coordinates from "{}"'.format(count, DEFAULT_PATH))
+    oldSeconds, oldText = best_seconds(format_with_optionalD, values)
+    print("optionalD:       {:>10.0f} coordinates/sec"
+          "".format(count / oldSeconds))
+    newSeconds, newText = best_seconds(format_with_formatter, values)
+    print("NumberFormatter: {:>10.0f} coordinates/sec"
+          "".format(count / newSeconds))
+    print("speedup: {:.1f}x".format(oldSeconds / newSeconds))
+    if newText != oldText:
+        print("Error: The text differs.")
+        return 1
+    print("The text is the same.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+'''
+Compare the wall-clock time of translating each template in
+retractiontower/tests/data with the usual loop (reading, translating
+and writing in one thread) and with LineReader and ThreadedWriter
+(See retractiontower/pipeline.py), and check that the output is the
+same.
+
+Usage:
+benchmarks/pipeline.py [<repeat> [<MB/s>]]
+
+The default repeat is 3 (the best time is shown). If MB/s is specified,
+writing the output is slowed to that rate to simulate a slow disk such
+as an SD card or network mount.
+'''
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower import Program  # noqa: E402
+from retractiontower.pipeline import (  # noqa: E402
+    LineReader,
+    ThreadedWriter,
+)
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+TEMPLATES = sorted(glob.glob(os.path.join(TESTS_DATA_DIR,
+                                          "RetractionTestTemplate-*.gcode")))
+DEFAULT_REPEAT = 3
+CURVE_ARGS = ["/startwith", "2", "/interpolate", "3"]
+
+
+class ThrottledFile(io.RawIOBase):
+    '''
+    A file that takes at least as long to write as a disk that writes
+    bytes_per_second (or as long as the real disk if None).
+    '''
+    def __init__(self, path, bytes_per_second=None):
+        self._file = open(path, 'wb', buffering=0)
+        self._bytesPerSecond = bytes_per_second
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._bytesPerSecond:
+            time.sleep(len(data) / self._bytesPerSecond)
+        return self._file.write(data)
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def translate_serial(templatePath, outputPath, bytes_per_second):
+    writer = io.TextIOWrapper(
+        io.BufferedWriter(ThrottledFile(outputPath, bytes_per_second))
+    )
+    with open(templatePath, 'r') as reader, writer:
+        Program.TranslateGCode(reader, writer, Program.get_FirstTowerZ(),
+                               0.0, 0.0, Program.ParseCurveArgs(CURVE_ARGS))
+
+
+def translate_pipelined(templatePath, outputPath, bytes_per_second):
+    reader = LineReader(open(templatePath, 'r'))
+    writer = ThreadedWriter(
+        io.BufferedWriter(ThrottledFile(outputPath, bytes_per_second))
+    )
+    try:
+        Program.TranslateGCode(reader, writer, Program.get_FirstTowerZ(),
+                               0.0, 0.0, Program.ParseCurveArgs(CURVE_ARGS))
+    finally:
+        reader.close()
+        writer.close()
+
+
+def best_seconds(function, templatePath, outputPath, bytes_per_second,
+                 repeat=DEFAULT_REPEAT):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(templatePath, outputPath, bytes_per_second)
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+
+def main():
+    repeat = DEFAULT_REPEAT
+    bytes_per_second = None
+    if len(sys.argv) > 1:
+        repeat = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        bytes_per_second = float(sys.argv[2]) * 1000000
+        print("writing at {} MB/s".format(sys.argv[2]))
+    print("{:<40} {:>8} {:>10} {:>8}".format(
+        "template", "loop (s)", "pipeline", "speedup",
+    ))
+    status = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        serialPath = os.path.join(tmp, "serial.gcode")
+        pipelinedPath = os.path.join(tmp, "pipelined.gcode")
+        for templatePath in TEMPLATES:
+            serialSeconds = best_seconds(translate_serial, templatePath,
+                                         serialPath, bytes_per_second,
+                                         repeat=repeat)
+            pipelinedSeconds = best_seconds(translate_pipelined,
+                                            templatePath, pipelinedPath,
+                                            bytes_per_second,
+                                            repeat=repeat)
+            print("{:<40} {:>8.3f} {:>10.3f} {:>7.2f}x".format(
+                os.path.basename(templatePath),
+                serialSeconds,
+                pipelinedSeconds,
+                serialSeconds / pipelinedSeconds,
+            ))
+            with open(serialPath, 'rb') as serial, \
+                    open(pipelinedPath, 'rb') as pipelined:
+                if serial.read() != pipelined.read():
+                    print("Error: The output differs.")
+                    status = 1
+    if status == 0:
+        print("The output is the same.")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+'''
+Time the main stages of retractiontower on every G-code file in
+retractiontower/tests/data and on copies of each concatenated several
+times, then show lines/sec, MB/sec and peak memory (RSS) for each.
+
+Usage:
+benchmarks/suite.py [options]
+
+Options:
+--scales <n,...>     how many times to concatenate each file
+                     (default: 1,10,100)
+--repeat <n>         how many times to run each benchmark (The best is
+                     shown, default: 3).
+--only <name,...>    Only run these benchmarks (See BENCHMARKS).
+--synthetic <size,...>
+                     Also run them on templates of these sizes (such
+                     as 100M,1G) from retractiontower.templategenerator.
+--json <path>        Save the results as JSON ("-" for stdout) so they
+                     can be compared with those of another commit.
+--compare <path>     Show how much faster each result is than those in
+                     a JSON file from --json.
+
+Each benchmark runs in its own process so that its peak RSS doesn't
+include the others (RSS is only available where the resource module
+is). The 100x copies take most of the time, so use something like
+"--scales 1,10 --repeat 1" for a quick run.
+'''
+import contextlib
+import datetime
+import glob
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower import Program  # noqa: E402
+from retractiontower.gcodecommand import GCodeCommand  # noqa: E402
+from retractiontower.gcodecommandpart import GCodeCommandPart  # noqa: E402
+from retractiontower.templategenerator import (  # noqa: E402
+    TemplateGenerator,
+    parse_size,
+)
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+DEFAULT_SCALES = (1, 10, 100)
+DEFAULT_REPEAT = 3
+CURVE_ARGS = ["/startwith", "2", "/interpolate", "3"]
+
+
+def read_lines(path):
+    with open(path, 'r') as stream:
+        for line in stream:
+            yield line.rstrip("\n\r")
+
+
+def run_parse_parts(path):
+    for line in read_lines(path):
+        for part in GCodeCommandPart.ParseStringToParts(line):
+            pass
+
+
+def run_command(path):
+    for line in read_lines(path):
+        GCodeCommand(line)
+
+
+def run_measure(path):
+    with open(path, 'r') as stream:
+        Program.MeasureGCode(stream)
+
+
+def run_translate(path):
+    with open(path, 'r') as reader, open(os.devnull, 'w') as writer:
+        Program.TranslateGCode(reader, writer, Program.get_FirstTowerZ(),
+                               0.0, 0.0, Program.ParseCurveArgs(CURVE_ARGS))
+
+
+def run_analyze(path):
+    Program.AnalyzeFile(path)
+
+
+def run_retraction_for_z(path):
+    '''
+    Get the retraction at the Z of every line (the most that
+    TranslateGCode could need).
+    '''
+    curvePoints = Program.ParseCurveArgs(CURVE_ARGS)
+    z = Program.get_FirstTowerZ()
+    for line in read_lines(path):
+        if " Z" in line:
+            command = GCodeCommand(line, lazy=True)
+            if command.HasParameter('Z'):
+                z = float(command.GetParameter('Z'))
+        Program.GetRetractionForZ(z, curvePoints)
+
+
+# The name of each benchmark and what it runs on a file
+BENCHMARKS = {
+    'parse_parts': run_parse_parts,
+    'command': run_command,
+    'measure': run_measure,
+    'translate': run_translate,
+    'analyze': run_analyze,
+    'retraction_for_z': run_retraction_for_z,
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)  # bytes on macOS
+    return peak / 1024  # KiB on Linux
+
+
+def run_one(name, path, repeat):
+    '''
+    Run one benchmark in this process (See run_isolated).
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            BENCHMARKS[name](path)
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return {'seconds': best, 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_isolated(name, path, repeat):
+    '''
+    Run one benchmark in a new process so its memory is measured
+    alone.
+    '''
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--run", name, path,
+         str(repeat)],
+    )
+    return json.loads(output)
+
+
+def count_lines(path):
+    count = 0
+    with open(path, 'rb') as stream:
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            count += chunk.count(b"\n")
+    return count
+
+
+def make_scaled(path, scale, directory):
+    '''
+    Write path concatenated scale times to directory.
+    '''
+    left, dotExt = os.path.splitext(os.path.basename(path))
+    scaledPath = os.path.join(directory,
+                              "{}-x{}{}".format(left, scale, dotExt))
+    with open(scaledPath, 'wb') as outs:
+        for _ in range(scale):
+            with open(path, 'rb') as ins:
+                shutil.copyfileobj(ins, outs)
+    return scaledPath
+
+
+def make_synthetic(size, directory):
+    '''
+    Write a template of about size (such as "100M") to directory.
+    '''
+    syntheticPath = os.path.join(directory,
+                                 "synthetic-{}.gcode".format(size))
+    with open(syntheticPath, 'w') as stream:
+        TemplateGenerator(target_bytes=parse_size(size)).Write(stream)
+    return syntheticPath
+
+
+def measure_file(names, path, name, scale, repeat):
+    '''
+    Run each benchmark in names on path.
+
+    Sequential arguments:
+    name -- the name of the file to show (such as before scaling it)
+    '''
+    results = []
+    lines = count_lines(path)
+    size = os.path.getsize(path)
+    for benchmark in names:
+        measured = run_isolated(benchmark, path, repeat)
+        seconds = measured['seconds']
+        results.append({
+            'benchmark': benchmark,
+            'file': name,
+            'scale': scale,
+            'lines': lines,
+            'bytes': size,
+            'seconds': seconds,
+            'lines_per_second': lines / seconds,
+            'mb_per_second': size / seconds / 1000000,
+            'peak_rss_mb': measured['peak_rss_mb'],
+        })
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+            stderr=subprocess.DEVNULL,
+        ).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result_key(result):
+    return (result['benchmark'], result['file'], result['scale'])
+
+
+def print_result(result, old=None):
+    row = "{:<16} {:<40} {:>4}x {:>10.0f} {:>8.2f} {:>8}".format(
+        result['benchmark'],
+        result['file'][:40],
+        result['scale'],
+        result['lines_per_second'],
+        result['mb_per_second'],
+        "" if result['peak_rss_mb'] is None
+        else "{:.0f}".format(result['peak_rss_mb']),
+    )
+    if old is not None:
+        row += " {:>7.2f}x".format(result['lines_per_second']
+                                   / old['lines_per_second'])
+    print(row)
+
+
+def main():
+    scales = DEFAULT_SCALES
+    repeat = DEFAULT_REPEAT
+    names = list(BENCHMARKS)
+    jsonPath = None
+    comparePath = None
+    syntheticSizes = []
+    args = sys.argv[1:]
+    if (len(args) == 4) and (args[0] == "--run"):
+        print(json.dumps(run_one(args[1], args[2], int(args[3]))))
+        return 0
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if index + 1 >= len(args):
+            print(__doc__)
+            print("Error: {} needs a value.".format(arg))
+            return 1
+        value = args[index + 1]
+        if arg == "--scales":
+            scales = [int(scale) for scale in value.split(",")]
+        elif arg == "--repeat":
+            repeat = int(value)
+        elif arg == "--only":
+            names = value.split(",")
+            for name in names:
+                if name not in BENCHMARKS:
+                    print("Error: {} is not one of {}."
+                          "".format(name, ", ".join(BENCHMARKS)))
+                    return 1
+        elif arg == "--synthetic":
+            syntheticSizes = value.split(",")
+            for size in syntheticSizes:
+                parse_size(size)
+                # ^ Show a bad size now instead of after the others.
+        elif arg == "--json":
+            jsonPath = value
+        elif arg == "--compare":
+            comparePath = value
+        else:
+            print(__doc__)
+            print("Error: {} is not a valid option.".format(arg))
+            return 1
+        index += 2
+
+    oldResults = {}
+    if comparePath is not None:
+        with open(comparePath, 'r') as stream:
+            for result in json.load(stream)['results']:
+                oldResults[result_key(result)] = result
+
+    out = sys.stdout
+    if jsonPath == "-":
+        out = sys.stderr
+        # ^ so stdout only has the JSON
+    paths = sorted(glob.glob(os.path.join(TESTS_DATA_DIR, "*.gcode")))
+    results = []
+    with contextlib.redirect_stdout(out):
+        print("{:<16} {:<40} {:>5} {:>10} {:>8} {:>8}{}".format(
+            "benchmark", "file", "scale", "lines/sec", "MB/sec",
+            "RSS (MB)", "" if comparePath is None else "  speedup",
+        ))
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [(path, scale) for scale in scales for path in paths]
+            jobs += [(size, None) for size in syntheticSizes]
+            for path, scale in jobs:
+                if scale is None:
+                    filePath = make_synthetic(path, tmp)
+                    name = os.path.basename(filePath)
+                    scale = 1
+                else:
+                    filePath = path
+                    if scale != 1:
+                        filePath = make_scaled(path, scale, tmp)
+                    name = os.path.basename(path)
+                for result in measure_file(names, filePath, name, scale,
+                                           repeat):
+                    results.append(result)
+                    print_result(result,
+                                 old=oldResults.get(result_key(result)))
+                if filePath != path:
+                    os.remove(filePath)
+    if jsonPath is not None:
+        data = {
+            'commit': git_commit(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'results': results,
+        }
+        if jsonPath == "-":
+            json.dump(data, sys.stdout, indent=2)
+            print("")
+        else:
+            with open(jsonPath, 'w') as stream:
+                json.dump(data, stream, indent=2)
+                stream.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
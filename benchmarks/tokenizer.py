@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''
+Compare lines per second of GCodeCommandPart.ParseStringToParts with
+the original character-by-character tokenizer
+(GCodeCommandPart.ParseStringToPartsPerChar).
+
+Usage:
+benchmarks/tokenizer.py [<gcode path>]
+
+The default path is RetractionTestTemplate-C_CR-10.gcode from
+retractiontower/tests/data.
+'''
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from retractiontower.gcodecommandpart import GCodeCommandPart  # noqa: E402
+
+TESTS_DATA_DIR = os.path.join(REPO_DIR, "retractiontower", "tests", "data")
+DEFAULT_PATH = os.path.join(TESTS_DATA_DIR,
+                            "RetractionTestTemplate-C_CR-10.gcode")
+
+
+def read_lines(path):
+    with open(path, 'r') as stream:
+        return [line.rstrip("\n\r") for line in stream]
+
+
+def lines_per_second(parse, lines, repeat=5):
+    '''
+    Get the best lines per second out of repeat runs of parse over all
+    lines.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            for part in parse(line):
+                pass
+        elapsed = time.perf_counter() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return len(lines) / best
+
+
+def main():
+    path = DEFAULT_PATH
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    lines = read_lines(path)
+    print('{} lines in "{}"'.format(len(lines), path))
+    perChar = lines_per_second(GCodeCommandPart.ParseStringToPartsPerChar,
+                               lines)
+    print("ParseStringToPartsPerChar: {:>10.0f} lines/sec".format(perChar))
+    compiled = lines_per_second(GCodeCommandPart.ParseStringToParts, lines)
+    print("ParseStringToParts:        {:>10.0f} lines/sec".format(compiled))
+    print("speedup: {:.1f}x".format(compiled / perChar))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,6 +13,13 @@ If path is specified, the output file will be named the same except
 with "RetractionTest " prepended (or replacing the word "Template" if
 present in the name).
 
+Templates compressed with gzip, xz or Zstandard (such as
+Template.gcode.gz) are read without extracting them, and the output is
+compressed the same way if the template's name ends with .gz, .xz or
+.zst (Zstandard requires Python 3.14 or the zstandard package). The
+same goes for Prusa's binary G-code (.bgcode), where the output also
+gets the template's metadata and thumbnails.
+
 Options:
 /output  <path>            Specify where to save the gcode
                            (default: RetractionTower.gcode).
@@ -28,7 +35,73 @@ Options:
                            default retraction startwith + .5 per mm).
 /interpolate <retr.>       Interpolate up to this retraction
                            (to z=32).
-/checkfile                 Check the file only.
+/variants <path>           Write one output file for each variant in a
+                           JSON list such as
+                           ["/startwith 1 /interpolate 4",
+                            "/startwith 2 /setat 10 /interpolate 5"]
+                           while only reading the template once.
+/batch <glob or manifest>  Generate towers for every template matching
+                           the glob (or listed in a JSON manifest) in
+                           parallel processes then show a summary.
+/jobs <n>                  Use this many processes for /batch or
+                           /parallel (default: the number of CPUs).
+/parallel                  Split the template at layers and translate
+                           the parts in parallel processes (only
+                           faster for large templates).
+/pipeline                  Read the template and write the output in
+                           separate threads while translating (faster
+                           if the disk is slow).
+/mmap                      Map the template into memory and only decode
+                           the lines that may change (G0, G1, G90 and
+                           G91), copying the rest to the output as
+                           bytes.
+/no-cache                  Parse the template even if it is in the
+                           cache (~/.cache/retractiontower) and don't
+                           store it there. The cache is only used if
+                           NumPy is installed and every line must be
+                           measured (the header has no extents, or with
+                           /verify-extents, /columnar or /checkfile).
+/checkfile                 Check the file only (Put /no-cache first to
+                           skip the cache).
+/verify-extents            Measure the template by reading every line
+                           even if its header (such as Cura's ;MINX:)
+                           has the extents.
+/columnar                  Load the motion commands into NumPy arrays to
+                           measure the template and find retractions
+                           (requires NumPy).
+/metrics <path>            Save the counts shown for each output plus
+                           the bytes read and written, time taken,
+                           lines per second, peak memory and curve
+                           (pairs) to a JSON file.
+/trace <path>              Save how long each step (and each layer
+                           while translating) took to a JSON file for
+                           chrome://tracing or https://ui.perfetto.dev.
+/profile                   Show the functions that took the most time
+                           (to stderr).
+/messages <policy>         Choose when to write the M117 (LCD) and M118
+                           (serial) messages that show the retraction:
+                           "retraction" (default: M117 before every
+                           retraction and M118 when it changes),
+                           "layer" (both at the first retraction of
+                           each layer), "value" (both when the
+                           retraction changes) or "off".
+/firmware-retraction       Write each retraction as G10 and the move
+                           after it as G11, with an M207 that sets the
+                           length from the curve when it changes (at
+                           most once per layer), instead of changing E
+                           and adding messages to every retraction. The
+                           printer's firmware must support firmware
+                           retraction (such as Marlin with
+                           FWRETRACT).
+/compact                   Remove comments, parameters that only repeat
+                           the modal state (such as the same F again)
+                           and moves that then do nothing from the
+                           output, and round the numbers of absolute
+                           moves (See retractiontower.compact).
+/compact-decimals <n>      Round to this many decimal places with
+                           /compact (default 5).
+/verify-compact            Check that /compact didn't change where or
+                           how fast any line moves (slower).
 --debug or /debug          Show every retraction at every height.
 '''
 # Processed by pycodetool https://github.com/poikilos/pycodetool
@@ -39,15 +112,47 @@ Options:
 # from System.Linq import *
 import sys
 import os
+import io
+import glob
+import json
 import shutil
+import contextlib
+import cProfile
+import mmap
+import pstats
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left
 from retractiontower.fxshim import (
     IsWhiteSpace,
     decimal_Parse,
-    IsNullOrWhiteSpace,
     IsDigit,
 )
 from retractiontower.gcodecommand import GCodeCommand
 from retractiontower.gcodecommandpart import GCodeCommandPart
+from retractiontower.gcodecolumns import GCodeColumns
+from retractiontower.templatecache import TemplateCache
+from retractiontower.bytestemplate import BytesTemplate, RawLines
+from retractiontower.pipeline import LineReader, ThreadedWriter
+from retractiontower.compact import CompactWriter
+from retractiontower.tracer import Tracer
+from retractiontower.progress import Progress
+from retractiontower.compressedfile import (
+    compression_of,
+    open_file,
+    split_compression,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 verbosity = 0
@@ -179,24 +284,189 @@ class CurvePoint:
         return CurvePoint.compare(self, other) != 0
 
 
+class RetractionCurve:
+    '''
+    Get the retraction for any Z from CurvePoint objects the same way
+    as Program.GetRetractionForZ, but find the segment using a bisect
+    of the sorted points and remember the result for each Z (each
+    layer usually has many retractions).
+    '''
+    def __init__(self, curvePoints):
+        if not isinstance(curvePoints, list):
+            raise ValueError("The curvePoints must be a list but"
+                             " is \"{}\".".format(curvePoints))
+        if len(curvePoints) < 1:
+            raise ValueError("There must be at least one curve point.")
+        self.Points = sorted(curvePoints)
+        self._zs = [point.Z for point in self.Points]
+        self._cache = {}
+
+    def CountFrom(self, z):
+        '''
+        Count how many points are at or above z.
+        '''
+        return len(self._zs) - bisect_left(self._zs, z)
+
+    def Get(self, z):
+        result = self._cache.get(z)
+        if result is None:
+            result = self._calculate(float(z))
+            self._cache[z] = result
+        return result
+
+    def _calculate(self, z):
+        index = bisect_left(self._zs, z)
+        if index >= len(self.Points):
+            return self.Points[-1].Retraction
+        point = self.Points[index]
+        previousPoint = self.Points[max(index - 1, 0)]
+        if point.PointType == CurvePointType.SameValueUntil:
+            return previousPoint.Retraction
+
+        interpolateFrom = previousPoint.Retraction
+        interpolateTo = point.Retraction
+        interpolateRange = point.Z - previousPoint.Z
+
+        weightTo = (z - previousPoint.Z) / interpolateRange
+        weightFrom = (point.Z - z) / interpolateRange
+
+        result = interpolateFrom * weightFrom + interpolateTo * weightTo
+        if result > interpolateTo:
+            print(
+                'Warning: result {} > interpolateTo {}'
+                ' (interpolateRange={}, interpolateToZ={}, z={},'
+                ' weightFrom={}, weightTo={})'
+                ''.format(result, interpolateTo, interpolateRange,
+                          point.Z, z, weightFrom, weightTo)
+            )
+        return result
+
+    def GetMany(self, zValues):
+        '''
+        Get the retraction for each Z in zValues (as a NumPy array if
+        NumPy is installed, otherwise as a list).
+        '''
+        if np is None:
+            return [self.Get(z) for z in zValues]
+        z = np.asarray(zValues, dtype=np.float64)
+        zs = np.array(self._zs, dtype=np.float64)
+        retractions = np.array([point.Retraction for point in self.Points],
+                               dtype=np.float64)
+        interpolates = np.array(
+            [point.PointType == CurvePointType.InterpolateUpTo
+             for point in self.Points],
+        )
+        index = np.searchsorted(zs, z, side='left')
+        beyond = index >= len(zs)
+        index = np.minimum(index, len(zs) - 1)
+        previous = np.maximum(index - 1, 0)
+        interpolateRange = zs[index] - zs[previous]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weightTo = (z - zs[previous]) / interpolateRange
+            weightFrom = (zs[index] - z) / interpolateRange
+            interpolated = (retractions[previous] * weightFrom
+                            + retractions[index] * weightTo)
+        result = np.where(interpolates[index], interpolated,
+                          retractions[previous])
+        return np.where(beyond, retractions[-1], result)
+
+
 class GCodeWriter:
-    def __init__(self, underlying):
+    '''
+    Write lines to underlying and count them. Lines are joined and
+    written in chunks of about BUFFER_CHARACTERS, so call Flush after
+    the last line.
+
+    Keyword arguments:
+    binary -- underlying is a binary stream, so encode the lines as
+              BytesTemplate.ENCODING (RawLines are written as they are).
+    '''
+    BUFFER_CHARACTERS = 65536
+    COMMAND_TYPES = ('G', 'M')
+    MOVEMENT_COMMANDS = ("G0", "G1")
+
+    def __init__(self, underlying, binary=False):
         self._underlying = underlying
+        self._binary = binary
+        self._newline = b"\n" if binary else "\n"
+        self._buffer = []
+        self._bufferedCharacters = 0
         self.NumLines = 0
         self.NumCommands = 0
         self.NumMovementCommands = 0
         self.NumCharactersWritten = 0
 
-    def WriteLine(self, command):
+    def WriteLine(self, command, text=None):
+        '''
+        Sequential arguments:
+        command -- a GCodeCommand (counted using its parsed Command) or
+                   a string (counted by scanning it, so only use strings
+                   for lines that aren't from the template, such as
+                   messages).
+
+        Keyword arguments:
+        text -- command already converted to a string (so that it is
+                only converted once when writing it to several
+                writers).
+        '''
         if isinstance(command, GCodeCommand):
-            command = command.ToString()
+            if text is None:
+                text = command.ToString()
+            if command.CommandType in GCodeWriter.COMMAND_TYPES:
+                self.NumCommands += 1
+                if command.Command in GCodeWriter.MOVEMENT_COMMANDS:
+                    self.NumMovementCommands += 1
+        else:
+            text = command
+            if GCodeWriter.IsCommand(text):
+                self.NumCommands += 1
+                if GCodeWriter.IsMovementCommand(text):
+                    self.NumMovementCommands += 1
         self.NumLines += 1
-        if GCodeWriter.IsCommand(command):
-            self.NumCommands += 1
-            if GCodeWriter.IsMovementCommand(command):
-                self.NumMovementCommands += 1
-        self.NumCharactersWritten += len(command) + len(os.linesep)
-        self._underlying.write(command + "\n")
+        if self._binary:
+            self._buffer.append(text.encode(BytesTemplate.ENCODING))
+        else:
+            self._buffer.append(text)
+        self._bufferedCharacters += len(text) + 1
+        if self._bufferedCharacters >= GCodeWriter.BUFFER_CHARACTERS:
+            self.Flush()
+
+    def WriteRaw(self, lines):
+        '''
+        Write a RawLines (from BytesTemplate or Program.TranslateChunk)
+        without changing it.
+        '''
+        self.NumLines += lines.LineCount
+        self.NumCommands += lines.NumCommands
+        self.NumMovementCommands += lines.NumMovementCommands
+        if not self._binary:
+            self._buffer.append(
+                str(lines.Data, BytesTemplate.ENCODING)[:-1]
+            )
+            # ^ without the last newline, since Flush adds it
+        elif len(lines.Data) >= GCodeWriter.BUFFER_CHARACTERS:
+            self.Flush()
+            self._underlying.write(lines.Data)
+            self.NumCharactersWritten += lines.NumCharacters
+            return
+        else:
+            self._buffer.append(lines.Data[:-1])
+        self._bufferedCharacters += lines.NumCharacters
+        if self._bufferedCharacters >= GCodeWriter.BUFFER_CHARACTERS:
+            self.Flush()
+
+    def Flush(self):
+        '''
+        Write the buffered lines to underlying.
+        '''
+        if not self._buffer:
+            return
+        self._buffer.append(self._newline[:0])
+        # ^ so join adds the last newline
+        self._underlying.write(self._newline.join(self._buffer))
+        self.NumCharactersWritten += self._bufferedCharacters
+        self._buffer = []
+        self._bufferedCharacters = 0
 
     @staticmethod
     def IsCommand(line):
@@ -234,9 +504,326 @@ class GCodeWriter:
         return False
 
 
+# enum MessagePolicy
+class MessagePolicy:
+    '''
+    When to write the messages that show the retraction (See
+    StatusMessages).
+    '''
+    EveryRetraction = 0
+    LayerChange = 1
+    ValueChange = 2
+    Off = 3
+    NAMES = {
+        "retraction": EveryRetraction,
+        "layer": LayerChange,
+        "value": ValueChange,
+        "off": Off,
+    }
+
+    @staticmethod
+    def Parse(name):
+        '''
+        Get the MessagePolicy for a name in NAMES (See /messages).
+        '''
+        policy = MessagePolicy.NAMES.get(name.lower())
+        if policy is None:
+            raise ValueError(
+                "The message policy must be one of {} but is \"{}\"."
+                "".format(", ".join(MessagePolicy.NAMES), name)
+            )
+        return policy
+
+
+class StatusMessages:
+    '''
+    Decide which M117 (LCD) and M118 (serial) messages to write before
+    each retraction of each variant.
+
+    Sequential arguments:
+    variants -- the number of writers.
+
+    Keyword arguments:
+    policy -- a MessagePolicy (default: EveryRetraction, which writes
+              M117 every time and M118 when the message changes).
+    '''
+    def __init__(self, variants, policy=None):
+        if policy is None:
+            policy = MessagePolicy.EveryRetraction
+        if policy not in MessagePolicy.NAMES.values():
+            raise ValueError("The policy must be a MessagePolicy but is"
+                             " \"{}\".".format(policy))
+        self.Policy = policy
+        self._lastSerialMessages = [""] * variants
+        self._lastShown = [None] * variants  # (z, retraction)
+
+    @staticmethod
+    def Format(retraction, z):
+        '''
+        Get the (lcdScreenMessage, serialMessage) tuple for M117 and
+        M118 that show the retraction at z.
+        '''
+        lcdScreenMessage = (
+            "dE {retraction:.3f} at Z {z:.1f}"
+        ).format(retraction=retraction, z=z)
+        serialMessage = (
+            "Retraction {retraction:.5f}"
+            " at Z {z:.1f}"
+        ).format(retraction=retraction, z=z)
+        return lcdScreenMessage, serialMessage
+
+    def Lines(self, variant, z, retraction):
+        '''
+        Get the list of message lines to write before a retraction.
+        '''
+        if self.Policy == MessagePolicy.Off:
+            return []
+        lcdScreenMessage, serialMessage = StatusMessages.Format(
+            retraction, z
+        )
+        if self.Policy == MessagePolicy.EveryRetraction:
+            lines = ["M117 " + lcdScreenMessage]
+            if serialMessage != self._lastSerialMessages[variant]:
+                lines.append("M118 " + serialMessage)
+                self._lastSerialMessages[variant] = serialMessage
+            return lines
+        last = self._lastShown[variant]
+        if last is not None:
+            if ((self.Policy == MessagePolicy.LayerChange)
+                    and (z == last[0])):
+                return []
+            if ((self.Policy == MessagePolicy.ValueChange)
+                    and (retraction == last[1])):
+                return []
+        self._lastShown[variant] = (z, retraction)
+        return ["M117 " + lcdScreenMessage, "M118 " + serialMessage]
+
+
+class FirmwareRetraction:
+    '''
+    Write retractions as G10 and the first move that extrudes after
+    each one as G11 (See /firmware-retraction), so the firmware retracts
+    by the length that the last M207 set. M207 (and an M117 that shows
+    it) is only written when the length or speed changes.
+
+    Only a retraction that moves E alone in absolute mode (not a wipe or
+    relative end G-code) is converted (See CanConvert), and
+    Program._writeRetraction changes E of the others as usual. G10 and
+    G11 don't change the speed of the moves after them, so if a line
+    that is replaced sets F, F is added to the next move that doesn't
+    set it (See RestoreFeedrate).
+
+    Sequential arguments:
+    variants -- the number of writers.
+    '''
+    AXES = ('X', 'Y', 'Z')
+
+    def __init__(self, variants):
+        self.RetractedE = None
+        # ^ E before the retraction while retracted (G11 restores it)
+        self.Feedrate = None  # F of a replaced line, for the next move
+        self.Settings = [None] * variants  # (length, F) of the last M207
+        self.CharactersSaved = [0] * variants
+        self.LinesSaved = [0] * variants
+
+    @staticmethod
+    def CanConvert(command, is_relative):
+        if is_relative:
+            return False
+        for axis in FirmwareRetraction.AXES:
+            if command.HasParameter(axis):
+                return False
+        return True
+
+    def Retract(self, command, lastE, z, curves, gcodeWriters, pairsSets,
+                messages):
+        '''
+        Write G10 (after M207 if the length changed) instead of command
+        to each writer, and count what Program._writeRetraction would
+        have written instead.
+
+        Sequential arguments:
+        command -- the G0 or G1 command that retracts
+        lastE -- E before command
+        messages -- the StatusMessages that Program._writeRetraction
+                    would use (They are only counted as savings, and
+                    the M117 with M207 is only written unless its
+                    Policy is Off).
+        '''
+        if command.HasParameter('F'):
+            self.Feedrate = command.GetParameter('F')
+        feedrate = self.Feedrate
+        if self.RetractedE is None:
+            self.RetractedE = lastE
+        for variant, gcodeWriter in enumerate(gcodeWriters):
+            retraction = curves[variant].Get(z)
+            echo2("* z={:.2f},r={:.4f}".format(z, retraction))
+            Program._addPair(pairsSets[variant], z, retraction)
+            # Count the lines that would have been written.
+            standardLines = messages.Lines(variant, z, retraction)
+            command.SetParameter('E', lastE - retraction)
+            standardLines.append(command.ToString())
+
+            lines = []
+            previous = self.Settings[variant]
+            setting = (retraction, feedrate)
+            if (feedrate is None) and (previous is not None):
+                setting = (retraction, previous[1])
+                # ^ M207 without F keeps the speed.
+            if setting != previous:
+                m207 = "M207 S{:.5f}".format(retraction)
+                if ((feedrate is not None)
+                        and ((previous is None)
+                             or (feedrate != previous[1]))):
+                    m207 += " F" + limited_f(feedrate)
+                if messages.Policy != MessagePolicy.Off:
+                    lines.append("M117 " + StatusMessages.Format(
+                        retraction, z
+                    )[0])
+                lines.append(m207)
+                self.Settings[variant] = setting
+            lines.append("G10")
+            for line in lines:
+                gcodeWriter.WriteLine(line)
+            self._count(variant, standardLines, lines)
+
+    def Unretract(self, command, is_relative, gcodeWriters):
+        '''
+        Write G11 to each writer, then command unless all it did was
+        restore the E from before the retraction.
+        '''
+        restoredE = self.RetractedE
+        self.RetractedE = None
+        keep = is_relative or (command.GetParameter('E') != restoredE)
+        for axis in FirmwareRetraction.AXES:
+            if command.HasParameter(axis):
+                keep = True
+        standardLine = command.ToString()
+        lines = ["G11"]
+        if keep:
+            if (self.Feedrate is not None) and not command.HasParameter('F'):
+                command.AddParameter('F', self.Feedrate)
+            self.Feedrate = None
+            lines.append(command.ToString())
+        elif command.HasParameter('F'):
+            self.Feedrate = command.GetParameter('F')
+        for variant, gcodeWriter in enumerate(gcodeWriters):
+            gcodeWriter.WriteLine("G11")
+            if keep:
+                gcodeWriter.WriteLine(command, text=lines[1])
+            self._count(variant, [standardLine], lines)
+
+    def RestoreFeedrate(self, command):
+        '''
+        Add F from the last line that was replaced to command if it
+        doesn't set F (Call this before writing each G0 or G1).
+        '''
+        if self.Feedrate is None:
+            return
+        if not command.HasParameter('F'):
+            standardLine = command.ToString()
+            command.AddParameter('F', self.Feedrate)
+            for variant in range(len(self.Settings)):
+                self._count(variant, [standardLine], [command.ToString()])
+        self.Feedrate = None
+
+    def _count(self, variant, standardLines, lines):
+        self.LinesSaved[variant] += len(standardLines) - len(lines)
+        for line in standardLines:
+            self.CharactersSaved[variant] += len(line) + 1
+        for line in lines:
+            self.CharactersSaved[variant] -= len(line) + 1
+
+
+class VariantWriters:
+    '''
+    Write a translated template for several retraction curves (See
+    Program.TranslateVariants). Both the serial and the chunked (See
+    Program.TranslateParallel) translation write every line through
+    this, so they decide how to write a G0 or G1 in the same way.
+
+    Sequential arguments:
+    writers -- See Program.TranslateVariants.
+    curvePointsSets -- See Program.TranslateVariants.
+
+    Keyword arguments:
+    firmware_retraction -- See Program.TranslateVariants.
+    message_policy -- See Program.TranslateVariants.
+    '''
+    def __init__(self, writers, curvePointsSets, firmware_retraction=False,
+                 message_policy=None):
+        self.Curves = [RetractionCurve(curvePoints)
+                       for curvePoints in curvePointsSets]
+        self.GCodeWriters = [
+            GCodeWriter(writer,
+                        binary=not isinstance(writer, io.TextIOBase))
+            for writer in writers
+        ]
+        self.PairsSets = [[] for writer in writers]
+        self.Messages = StatusMessages(len(writers), policy=message_policy)
+        self.Firmware = None
+        if firmware_retraction:
+            self.Firmware = FirmwareRetraction(len(writers))
+        self.NumberOfRetractions = 0
+
+    def WriteRaw(self, rawLines):
+        for gcodeWriter in self.GCodeWriters:
+            gcodeWriter.WriteRaw(rawLines)
+
+    def WriteLine(self, command):
+        '''
+        Write command the same way to every writer.
+        '''
+        line = command.ToString()
+        for gcodeWriter in self.GCodeWriters:
+            gcodeWriter.WriteLine(command, text=line)
+
+    def WriteMove(self, command, e, lastE, z, is_relative, isRetraction):
+        '''
+        Write a G0 or G1 command (with X and Y already offset).
+
+        Sequential arguments:
+        e -- E of command (only used if isRetraction)
+        lastE -- E before command (only used if isRetraction)
+        isRetraction -- Write command to each writer with the E of its
+                        curve (See Program._writeRetraction).
+        '''
+        if isRetraction:
+            self.NumberOfRetractions += 1
+            Program._writeRetraction(
+                command, e, lastE, z, is_relative, self.Curves,
+                self.GCodeWriters, self.PairsSets, self.Messages,
+                firmware=self.Firmware,
+            )
+            return
+        firmware = self.Firmware
+        if firmware is not None:
+            if ((firmware.RetractedE is not None)
+                    and command.HasParameter('E')):
+                firmware.Unretract(command, is_relative, self.GCodeWriters)
+                return
+            firmware.RestoreFeedrate(command)
+        self.WriteLine(command)
+
+    def Finish(self, numUniqueZValues, stats=None):
+        '''
+        Flush the writers and show what was written (See
+        Program._finishVariants).
+
+        Returns:
+        a list of pairs lists (See Program.TranslateCommands), one for
+        each writer.
+        '''
+        Program._finishVariants(self.GCodeWriters, numUniqueZValues,
+                                self.NumberOfRetractions, stats=stats,
+                                firmware=self.Firmware)
+        return self.PairsSets
+
+
 class Program:
     _FirstTowerZ = 2.1
     _GraphRowHeight = 0.5
+    _DefaultHeight = 32.0  # the top for /interpolate and the chart
     _DEFAULT_TEMPLATE_NAME = "Template.gcode"
     DATA_DIR = os.path.dirname(os.path.abspath(__file__))
     MODEL_PATH = os.path.join(DATA_DIR, "Model",
@@ -245,6 +832,36 @@ class Program:
     TEMPLATE_PATH = os.path.join(os.getcwd(), _DEFAULT_TEMPLATE_NAME)
     _extents = None
     _extents_done = False
+    _commands = None  # The template's lines, if kept by CalculateExtents
+    _columns = None  # The template's GCodeColumns, if columnar
+    _bytesTemplate = None  # The template's BytesTemplate, if /mmap
+    tracer = None  # a Tracer that records the phases, if /trace
+    PROFILE_LIMIT = 30  # how many functions /profile shows
+    extents_used_by = None
+    HEADER_BYTES = 8192  # how much of the template may have extents
+    # The slicer header comment for each extent (Only Cura writes them
+    #   at the start of the file, as in tests/data).
+    HEADER_EXTENT_KEYS = {
+        ";MINX:": ('X', "From"),
+        ";MINY:": ('Y', "From"),
+        ";MINZ:": ('Z', "From"),
+        ";MAXX:": ('X', "To"),
+        ";MAXY:": ('Y', "To"),
+        ";MAXZ:": ('Z', "To"),
+    }
+    # How /parallel splits the template (See FindChunks): more chunks
+    #   than workers keep every worker busy, but tiny chunks would
+    #   spend more time starting than translating.
+    CHUNKS_PER_WORKER = 4
+    MIN_CHUNK_BYTES = 256 * 1024
+    LAYER_MARK = b"\n;LAYER:"  # Cura's comment before each layer
+    # How many values follow each curve option (See ParseCurveArgs)
+    CURVE_ARG_COUNTS = {
+        "/startwith": 1,
+        "/setat": 1,
+        "/interpolateto": 2,
+        "/interpolate": 1,
+    }
 
     @staticmethod
     def get_FirstTowerZ():
@@ -254,6 +871,10 @@ class Program:
     def get_GraphRowHeight():
         return Program._GraphRowHeight
 
+    @staticmethod
+    def get_DefaultHeight():
+        return Program._DefaultHeight
+
     @staticmethod
     def getTemplateUsage():
         msg = (
@@ -272,10 +893,48 @@ class Program:
         if not os.path.isfile(Program.TEMPLATE_PATH):
             raise ValueError(Program.getTemplateUsage())
             # return None
-        return open(Program.TEMPLATE_PATH)
+        return open_file(Program.TEMPLATE_PATH)
+
+    @staticmethod
+    def ReadCommands(reader, path=None, line_n=0):
+        '''
+        Yield a lazy GCodeCommand for each line that reader yields.
+
+        Keyword arguments:
+        line_n -- the number of lines before the first one from reader
+                  (only for error messages, See GCodeCommand).
+        '''
+        while True:
+            line_n += 1  # Counting numbers start at 1.
+            line = reader.readline()
+            if not line:
+                break
+            line = line.rstrip("\n\r")
+            yield GCodeCommand(line, path=path, line_n=line_n, lazy=True)
+
+    @staticmethod
+    def MeasureGCode(stream, path=None, keep_commands=False):
+        '''
+        Get the extents of the G-code that stream yields (See
+        MeasureCommands).
+        '''
+        return Program.MeasureCommands(
+            Program.ReadCommands(stream, path=path),
+            keep_commands=keep_commands,
+        )
 
     @staticmethod
-    def MeasureGCode(stream, path=None):
+    def MeasureCommands(commands, keep_commands=False):
+        '''
+        Get the extents of commands such as from ReadCommands or
+        BytesTemplate.Commands.
+
+        Keyword arguments:
+        keep_commands -- Also keep every command in the Commands member
+                         of the result, so that TranslateCommands can
+                         process the G-code without reading and parsing
+                         it again. Otherwise, Commands is None.
+        '''
         #  Count only G1 moves in X and Y.
         #  Count G0 and G1 moves in Z, but only for Z values
         #    where filament is extruded.
@@ -288,17 +947,15 @@ class Program:
         lastE = sys.float_info.min
         currentZ = sys.float_info.min
         zTBS = None
-        line_n = 0
-        while True:
-            line_n += 1  # Counting numbers start at 1.
-            line = stream.readline()
-            if not line:
-                break
-            line = line.rstrip("\n\r")
-
-            if IsNullOrWhiteSpace(line):
+        keptCommands = None
+        if keep_commands:
+            keptCommands = []
+        for command in commands:
+            if keptCommands is not None:
+                keptCommands.append(command)
+            if command.Command is None:
                 continue
-            command = GCodeCommand(line, path=path, line_n=line_n)
+            line = command._line
 
             if command.Command == "G1":
                 if command.HasParameter('X'):
@@ -335,20 +992,158 @@ class Program:
         result.X = x
         result.Y = y
         result.Z = z
+        result.Commands = keptCommands
+        return result
+
+    @staticmethod
+    def ReadHeaderExtents(stream, max_bytes=None):
+        '''
+        Get the extents from the slicer's header comments (See
+        HEADER_EXTENT_KEYS) in the first max_bytes (default
+        Program.HEADER_BYTES) of stream without parsing any G-code.
+
+        Returns:
+        the same type of object as MeasureGCode, or None if the header
+        doesn't have every extent.
+        '''
+        if max_bytes is None:
+            max_bytes = Program.HEADER_BYTES
+        x = Extent()
+        y = Extent()
+        z = Extent()
+        axes = {'X': x, 'Y': y, 'Z': z}
+        found = set()
+        count = 0
+        while count < max_bytes:
+            line = stream.readline()
+            if not line:
+                break
+            count += len(line)
+            key = line[:6]
+            destination = Program.HEADER_EXTENT_KEYS.get(key)
+            if destination is None:
+                continue
+            try:
+                value = float(line[6:])
+            except ValueError:
+                echo0('Warning: "{}" in the header is not a number.'
+                      ''.format(line.rstrip("\n\r")))
+                return None
+            axis, end = destination
+            setattr(axes[axis], end, value)
+            found.add(key)
+            if len(found) == len(Program.HEADER_EXTENT_KEYS):
+                break
+        if len(found) < len(Program.HEADER_EXTENT_KEYS):
+            return None
+
+        class AnonymousClass:
+            pass
+        result = AnonymousClass()
+        result.X = x
+        result.Y = y
+        result.Z = z
+        result.Commands = None
         return result
 
     @classmethod
-    def CalculateExtents(cls):
+    def CalculateExtents(cls, keep_commands=False, verify=False,
+                         columnar=False, cache=None, use_mmap=False):
+        '''
+        Get the extents of the template from its header if present (See
+        ReadHeaderExtents), otherwise measure every line.
+
+        Keyword arguments:
+        keep_commands -- If every line must be measured, keep the parsed
+                         template in cls._commands so Main can translate
+                         it without a second pass. Otherwise
+                         cls._commands is None.
+        verify -- Measure every line even if the header has extents.
+        columnar -- Load the template into cls._columns (See
+                    GCodeColumns) and measure the columns instead of
+                    keeping commands.
+        cache -- a TemplateCache from which to get cls._columns (and
+                 the extents they measure) if the template was parsed
+                 before, otherwise where to store them. It is only used
+                 if every line must be measured (verify, columnar, or
+                 the header has no extents), since otherwise the
+                 template is only parsed once anyway (to translate it).
+        use_mmap -- Read the template as bytes (See BytesTemplate) and
+                    keep it in cls._bytesTemplate for translating, unless
+                    it has carriage returns.
+        '''
         path = cls.TEMPLATE_PATH
         if not os.path.isfile(path):
             return False
         cls._extents_done = False
+        cls._commands = None
+        cls._columns = None
+        cls._closeBytesTemplate()
+        if use_mmap and (compression_of(path) is not None):
+            echo0("Warning: /mmap was ignored since \"{}\" is"
+                  " compressed.".format(path))
+        elif use_mmap:
+            cls._bytesTemplate = BytesTemplate(path)
+            if not cls._bytesTemplate.Supported:
+                echo0("Warning: /mmap was ignored since \"{}\" has"
+                      " carriage returns.".format(path))
+                cls._closeBytesTemplate()
+        headerExtents = None
         reader = cls.GetTemplateReader()
         try:
-            cls._extents = cls.MeasureGCode(reader, path=path)
-            cls._extents_done = True
+            headerExtents = cls.ReadHeaderExtents(reader)
         finally:
             reader.close()
+        measureAll = (headerExtents is None) or verify or columnar
+        if measureAll and (cache is not None) and cache.IsAvailable():
+            cls._columns = cache.GetColumns(
+                path,
+                firstTowerZ=cls.get_FirstTowerZ(),
+            )
+        elif columnar:
+            reader = cls.GetTemplateReader()
+            try:
+                cls._columns = GCodeColumns.Load(reader, path=path)
+            finally:
+                reader.close()
+        if (headerExtents is not None) and not verify:
+            echo1("* using the extents from the header of \"{}\""
+                  "".format(path))
+            cls._extents = headerExtents
+            cls._extents_done = True
+        elif cls._columns is not None:
+            cls._extents = cls._columns.Extents()
+            cls._extents_done = True
+        else:
+            if cls._bytesTemplate is not None:
+                cls._extents = cls.MeasureCommands(
+                    cls._bytesTemplate.Commands(),
+                    keep_commands=keep_commands,
+                )
+            else:
+                reader = cls.GetTemplateReader()
+                try:
+                    cls._extents = cls.MeasureGCode(
+                        reader,
+                        path=path,
+                        keep_commands=keep_commands,
+                    )
+                finally:
+                    reader.close()
+            cls._commands = cls._extents.Commands
+            cls._extents.Commands = None
+            cls._extents_done = True
+        if (headerExtents is not None) and verify:
+            # The extents were measured (from the lines or the columns).
+            for axis in "XYZ":
+                header = getattr(headerExtents, axis)
+                measured = getattr(cls._extents, axis)
+                if ((header.From != measured.From)
+                        or (header.To != measured.To)):
+                    echo0("Warning: The header says {0} is from {1}"
+                          " to {2} but the G-code is from {3} to {4}."
+                          "".format(axis, header.From, header.To,
+                                    measured.From, measured.To))
 
         if cls._extents_done:
             print("Template extents:")
@@ -365,200 +1160,184 @@ class Program:
                             cls._extents.Z.To))
         return cls._extents_done
 
+    @classmethod
+    def _closeBytesTemplate(cls):
+        if cls._bytesTemplate is None:
+            return
+        cls._commands = None
+        # ^ Any RawLines in it use the map.
+        cls._bytesTemplate.close()
+        cls._bytesTemplate = None
+
+    @staticmethod
+    def _fileTell(stream):
+        '''
+        Get a function that gets the position in the file under stream
+        (even if stream decompresses it, so that it is comparable to the
+        size of the file), or None if stream has no file descriptor.
+        The text reader's own tell is slow and can't be used while
+        LineReader reads.
+        '''
+        try:
+            fd = stream.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+        return lambda: os.lseek(fd, 0, os.SEEK_CUR)
+
+    @classmethod
+    def _span(cls, name, **args):
+        '''
+        Record the time spent in a with statement if tracing (See
+        Tracer.Span).
+        '''
+        if cls.tracer is None:
+            return contextlib.nullcontext()
+        return cls.tracer.Span(name, **args)
+
+    @classmethod
+    def _traceLayers(cls, commands):
+        '''
+        Record the time spent on each layer of commands if tracing (See
+        Tracer.LayerSpans).
+        '''
+        if cls.tracer is None:
+            return commands
+        return cls.tracer.LayerSpans(commands)
+
     @classmethod
     def set_template(cls, template_path):
+        '''
+        Choose the template. It is not measured until CalculateExtents
+        is called, so options that depend on the extents (such as
+        /center) are applied after all arguments are processed.
+        '''
         cls.TEMPLATE_PATH = template_path
-        cls.CalculateExtents()
-        if cls.extents_used_by == "/center":
-            deltaX = center[0] - cls._extents.X.Middle
-            deltaY = center[1] - cls._extents.Y.Middle
-        elif cls.extents_used_by is not None:
-            raise NotImplementedError(
-                "The program cannot recalculate the"
-                " effect of {} after changing the model."
-            )
+        cls._extents = None
+        cls._extents_done = False
+        cls._commands = None
+        cls._closeBytesTemplate()
 
     @classmethod
-    def Main(cls, args):
-        cls.CalculateExtents()
+    def ParseCurveArgs(cls, args):
+        '''
+        Get the curvePoints list from the curve options (/startwith,
+        /setat, /interpolateto and /interpolate) in args.
 
+        Raises ValueError if the options are not valid.
+        '''
         curvePoints = []
-
-        deltaX = 0.0
-        deltaY = 0.0
-
-        outputFileName = "RetractionTest.gcode"
-        inputFileName = None
-        cls.extents_used_by = None
-        center = None
         last_retraction = 2.0
-        default_height = 32.0
+        default_height = cls.get_DefaultHeight()
         start_point_done = False
         start_point_done_flags = ["/startwith", "/setat"]
         prevArgName = None
-        if True:
-            index = 0
-
-            while index < len(args):
-                curvePoint = CurvePoint()
+        index = 0
+        while index < len(args):
+            curvePoint = CurvePoint()
+
+            argName = args[index].lower()
+            if prevArgName in start_point_done_flags:
+                start_point_done = True
+            prevArgName = argName
+            if argName == "/startwith":
+                initialPoint = CurvePoint()
+                initialPoint.PointType = CurvePointType.SameValueUntil
+                initialPoint.Z = cls.get_FirstTowerZ()
+                initialPoint.Retraction = float(args[index + 1])
+                curvePoints.append(initialPoint)
+                index += 2
+                continue
 
-                argName = args[index].lower()
-                if prevArgName in start_point_done_flags:
-                    start_point_done = True
-                prevArgName = argName
-                if argName == "/output":
-                    outputFileName = args[index + 1]
+            elif ((argName == "/setat")
+                    or (argName == "/interpolateto")
+                    or (argName == "/interpolate")):
+                if argName == "/setat":
+                    curvePoint.PointType = CurvePointType.SameValueUntil
+                else:
+                    curvePoint.PointType = CurvePointType.InterpolateUpTo
+                    # prevent divide by zero:
+                    if not start_point_done:
+                        raise ValueError("You must use one of {} first."
+                                         "".format(start_point_done_flags))
+
+                if argName == "/setat":
+                    curvePoint.Z = float(args[index + 1])
+                    curvePoint.Retraction = last_retraction
                     index += 2
-                    continue
-
-                elif argName == "/center":
-                    if not cls._extents_done:
-                        raise ValueError(Program.getTemplateUsage())
-                    center = (float(args[index + 1]),
-                              float(args[index + 2]))
-                    deltaX = center[0] - cls._extents.X.Middle
-                    deltaY = center[1] - cls._extents.Y.Middle
+                elif argName == "/interpolateto":
+                    curvePoint.Z = float(args[index + 1])
+                    if len(args) <= index + 2:
+                        raise ValueError(
+                            "You must specify both"
+                            " <height> and <Retraction>. If you only"
+                            " want to set retraction"
+                            " (assuming Z {} as the height),"
+                            " use /interpolate."
+                            "".format(default_height)
+                        )
+                    if not isfloat(args[index + 2]):
+                        raise ValueError(
+                            'You must specify a number'
+                            ' for Retraction after Z but "{}"'
+                            ' is not a number.'.format(args[index + 2])
+                        )
+                    curvePoint.Retraction = float(args[index + 2])
+                    last_retraction = curvePoint.Retraction
                     index += 3
-                    cls.extents_used_by = "/center"
-                    continue
-
-                elif argName == "/template":
-                    inputFileName = args[index+1]
-                    cls.set_template(inputFileName)
-                    index += 2
-                    continue
-
-                elif argName == "/startwith":
-                    initialPoint = CurvePoint()
-                    initialPoint.PointType = CurvePointType.SameValueUntil
-                    initialPoint.Z = cls.get_FirstTowerZ()
-                    initialPoint.Retraction = float(args[index + 1])
-                    curvePoints.append(initialPoint)
+                elif argName == "/interpolate":
+                    curvePoint.Z = default_height
+                    curvePoint.Retraction = float(args[index + 1])
+                    last_retraction = curvePoint.Retraction
                     index += 2
-                    continue
-
-                elif ((argName == "/setat")
-                        or (argName == "/interpolateto")
-                        or (argName == "/interpolate")):
-                    if argName == "/setat":
-                        curvePoint.PointType = CurvePointType.SameValueUntil
-                    else:
-                        curvePoint.PointType = CurvePointType.InterpolateUpTo
-                        # prevent divide by zero:
-                        if not start_point_done:
-                            echo0("Error: You must use one of {} first."
-                                  "".format(start_point_done_flags))
-                            return 1
-
-                    if argName == "/setat":
-                        curvePoint.Z = float(args[index + 1])
-                        curvePoint.Retraction = last_retraction
-                        index += 2
-                    elif argName == "/interpolateto":
-                        curvePoint.Z = float(args[index + 1])
-                        if len(args) <= index + 2:
-                            usage()
-                            echo0("Error: You must specify both"
-                                  " <height> and <Retraction>. If you only"
-                                  " want to set retraction"
-                                  " (assuming Z {} as the height),"
-                                  " use /interpolate."
-                                  "".format(default_height))
-                            return 1
-                        if not isfloat(args[index + 2]):
-                            usage()
-                            echo0('Error: You must specify a number'
-                                  ' for Retraction after Z but "{}"'
-                                  ' is not a number.'.format(args[index + 2]))
-                            return 1
-                        curvePoint.Retraction = float(args[index + 2])
-                        last_retraction = curvePoint.Retraction
-                        index += 3
-                    elif argName == "/interpolate":
-                        curvePoint.Z = default_height
-                        curvePoint.Retraction = float(args[index + 1])
-                        last_retraction = curvePoint.Retraction
-                        index += 2
-                    else:
-                        raise NotImplementedError(argName)
-                    curvePoints.append(curvePoint)
-                    continue
+                else:
+                    raise NotImplementedError(argName)
+                curvePoints.append(curvePoint)
+                continue
 
-                elif argName == "/checkfile":
-                    cls.AnalyzeFile(args[index + 1])
-                    index += 2
-                    return 0
-                elif argName in ["--help", "/?"]:
-                    usage()
-                    return 0
-                elif argName in ["--debug", "/debug"]:
-                    set_verbosity(2)
-                    index += 1
-                    continue
-                elif argName in ["--verbose", "/verbose", "/v", "-v"]:
-                    set_verbosity(1)
-                    index += 1
-                    continue
+            raise ValueError('"{}" is not a curve option'.format(argName))
+        return curvePoints
 
-                elif inputFileName is None:
-                    # must be the *last* case
-                    inputFileName = args[index]
-                    cls.set_template(inputFileName)
-                    index += 1
-                    continue
+    @staticmethod
+    def LoadVariants(path):
+        '''
+        Load the curve options of each variant from a JSON file. The
+        file must contain a list where each element is either a list of
+        arguments such as ["/startwith", "1", "/interpolate", "4"] or a
+        string such as "/startwith 1 /interpolate 4".
 
-                raise Exception(
-                    'Error: "{}" is not a valid argument'.format(argName)
-                )
-        if (not os.path.isfile(cls.TEMPLATE_PATH)
-                or (not cls._extents_done)):
-            raise ValueError(Program.getTemplateUsage())
-        if len(curvePoints) == 0:
-            curvePoints.append(
-                CurvePoint(
-                    PointType=CurvePointType.SameValueUntil,
-                    Z=cls.get_FirstTowerZ(),
-                    Retraction=2.0,
+        Returns:
+        a list of argument lists, one for each variant.
+        '''
+        with open(path, 'r') as stream:
+            variants = json.load(stream)
+        if not isinstance(variants, list):
+            raise ValueError('"{}" must contain a list of variants.'
+                             ''.format(path))
+        results = []
+        for variant in variants:
+            if isinstance(variant, str):
+                variant = variant.split()
+            if not isinstance(variant, list):
+                raise ValueError(
+                    'Each variant in "{}" must be a list or string but'
+                    ' one is "{}".'.format(path, variant)
                 )
-            )
-
-            curvePoints.append(
-                CurvePoint(
-                    PointType=CurvePointType.InterpolateUpTo,
-                    Z=cls._extents.Z.To,
-                    Retraction=3.0,
-                )
-            )
-
-        print("")
-        inputFileName = cls.TEMPLATE_PATH
-        print('Using "{}"'.format(inputFileName))
-        if "Template" in inputFileName:
-            outputFileName = inputFileName.replace("Template",
-                                                   "RetractionTest")
-        else:
-            outputFileName = "RetractionTest " + inputFileName
-        # ^ The name changes more after spans are calculated below.
-
-
-        if (deltaX != 0) or (deltaY != 0):
-            print(
-                "Will translate test print to be centered at ({0:.1f}"
-                ", {1:.1f})".format(
-                    cls._extents.X.Middle + deltaX,
-                    cls._extents.Y.Middle + deltaY,
-                )
-            )
-            print("")
+            results.append([str(arg) for arg in variant])
+        return results
 
+    @classmethod
+    def PrintChart(cls, curvePoints):
+        '''
+        Show the retraction at each height of the tower.
+        '''
         print("Z    ? Retraction")
 
         lastCurvePointsPassed = 0
+        curve = RetractionCurve(curvePoints)
 
         # z = 17.0  # for original
-        z = default_height
+        z = cls.get_DefaultHeight()
         span = cls.get_FirstTowerZ() - cls.get_GraphRowHeight()
-        pairs = []
         while z >= span:
             lastExtraRow = False
             if z < cls.get_FirstTowerZ():
@@ -566,14 +1345,13 @@ class Program:
                 z = cls.get_FirstTowerZ()
             sys.stdout.write("{:.1f}".format(z).rjust(4))
             sys.stdout.write(' ')
-            curvePointsPassed = \
-                sum(1 for point in curvePoints if point.Z >= z)
+            curvePointsPassed = curve.CountFrom(z)
             if curvePointsPassed == lastCurvePointsPassed:
                 sys.stdout.write("  ")
             else:
                 sys.stdout.write("+ ")
                 lastCurvePointsPassed = curvePointsPassed
-            retraction = cls.GetRetractionForZ(z, curvePoints)
+            retraction = curve.Get(z)
             sys.stdout.write("{:.4f} ".format(retraction).rjust(8))
             barWidth = int(round(retraction * 5))
             sys.stdout.write('*'*barWidth)
@@ -582,46 +1360,846 @@ class Program:
                 break
             z -= cls.get_GraphRowHeight()
 
+    @staticmethod
+    def PairsFileName(outputFileName, pairs):
+        '''
+        Get the name of the output file including the curve's first
+        and last height and retraction (See TranslateCommands).
+        '''
+        left, dotCompression = split_compression(outputFileName)
+        left, dotExt = os.path.splitext(left)
+        dotExt += dotCompression
+        left += " ("
+        left += "z={},r={}".format(
+            limited_f(pairs[0][0]),
+            limited_f(pairs[0][1])
+        )
+        # if len(pairs) > 2:
+        left += " to z={},r={}".format(
+            limited_f(pairs[-1][0]),
+            limited_f(pairs[-1][1])
+        )
+        left += ")"
+        return left + dotExt
+
+    @staticmethod
+    def OutputFileName(templatePath):
+        '''
+        Get the name of the output file (before PairsFileName) in the
+        same directory as the template.
+        '''
+        directory, name = os.path.split(templatePath)
+        if "Template" in name:
+            name = name.replace("Template", "RetractionTest")
+        else:
+            name = "RetractionTest " + name
+        return os.path.join(directory, name)
+
+    @classmethod
+    def Generate(cls, curvePointsSets, variantsArgs=None, center=None,
+                 verify_extents=False, columnar=False, cache=None,
+                 use_mmap=False, parallel=False, workers=None,
+                 pipelined=False, progress_callback=None,
+                 firmware_retraction=False, message_policy=None,
+                 compact=False, compact_decimals=None, verify_compact=False):
+        '''
+        Write a tower for each curve using the template (See
+        set_template), parsing the template only once.
+
+        Sequential arguments:
+        curvePointsSets -- a list of curvePoints lists (An empty one
+                           gets the default curve from 2 to 3 at the
+                           top of the template).
+
+        Keyword arguments:
+        variantsArgs -- the curve options of each curve, to show above
+                        its chart if there is more than one.
+        center -- an (x, y) tuple where the tower should be centered.
+        verify_extents -- See CalculateExtents.
+        columnar -- See CalculateExtents.
+        cache -- See CalculateExtents.
+        use_mmap -- See CalculateExtents.
+        parallel -- Translate the template in chunks using several
+                    processes (See TranslateParallel).
+        workers -- the number of processes if parallel.
+        pipelined -- Read the template and write the output in other
+                     threads (See LineReader and ThreadedWriter) while
+                     translating.
+        progress_callback -- a function to call with the progress of
+                             translating (See Progress). Progress is
+                             also shown if stdout is a terminal.
+        firmware_retraction -- See TranslateVariants.
+        message_policy -- See TranslateVariants.
+        compact -- Compact the output as it is written (See
+                   CompactWriter) and add 'compacted_characters' and
+                   'compacted_lines' to the stats.
+        compact_decimals -- the decimal places to keep if compact (See
+                            Compactor).
+        verify_compact -- Check the toolpath of every line compacted
+                          (See CompactWriter), and add 'verified_events'
+                          to the stats.
+
+        Returns:
+        a list with a dict for each curve, with the stats from
+        TranslateVariants plus 'path' (the output file), 'pairs' and
+        the metrics of the run (See AddRunMetrics).
+        '''
+        startTime = time.perf_counter()
+        deltaX = 0.0
+        deltaY = 0.0
+        if not os.path.isfile(cls.TEMPLATE_PATH):
+            raise ValueError(Program.getTemplateUsage())
+        if parallel and (compression_of(cls.TEMPLATE_PATH) is not None):
+            echo0("Warning: /parallel was ignored since \"{}\" is"
+                  " compressed.".format(cls.TEMPLATE_PATH))
+            parallel = False
+            # ^ The chunks are found by mapping the file into memory.
+        # Parse the template only once: Either the header has the
+        #   extents or the commands parsed while measuring are
+        #   translated below (for every variant at once).
+        with cls._span("CalculateExtents"):
+            calculated = cls.CalculateExtents(keep_commands=not parallel,
+                                              verify=verify_extents,
+                                              columnar=columnar,
+                                              cache=cache,
+                                              use_mmap=use_mmap)
+        if not calculated:
+            raise ValueError(Program.getTemplateUsage())
+        parseSeconds = time.perf_counter() - startTime
+        if center is not None:
+            deltaX = center[0] - cls._extents.X.Middle
+            deltaY = center[1] - cls._extents.Y.Middle
+        for curvePoints in curvePointsSets:
+            if len(curvePoints) > 0:
+                continue
+            curvePoints.append(
+                CurvePoint(
+                    PointType=CurvePointType.SameValueUntil,
+                    Z=cls.get_FirstTowerZ(),
+                    Retraction=2.0,
+                )
+            )
+
+            curvePoints.append(
+                CurvePoint(
+                    PointType=CurvePointType.InterpolateUpTo,
+                    Z=cls._extents.Z.To,
+                    Retraction=3.0,
+                )
+            )
+
         print("")
+        inputFileName = cls.TEMPLATE_PATH
+        print('Using "{}"'.format(inputFileName))
+        outputFileName = cls.OutputFileName(inputFileName)
+        # ^ The name changes more after spans are calculated below.
+
+
+        if (deltaX != 0) or (deltaY != 0):
+            print(
+                "Will translate test print to be centered at ({0:.1f}"
+                ", {1:.1f})".format(
+                    cls._extents.X.Middle + deltaX,
+                    cls._extents.Y.Middle + deltaY,
+                )
+            )
+            print("")
+
+        outputFileNames = [outputFileName]
+        if len(curvePointsSets) > 1:
+            left, dotCompression = split_compression(outputFileName)
+            left, dotExt = os.path.splitext(left)
+            dotExt += dotCompression
+            outputFileNames = [
+                "{} variant {}{}".format(left, variant + 1, dotExt)
+                for variant in range(len(curvePointsSets))
+            ]
+        for variant, curvePoints in enumerate(curvePointsSets):
+            if (len(curvePointsSets) > 1) and (variantsArgs is not None):
+                print("Variant {}: {}".format(
+                    variant + 1,
+                    " ".join(variantsArgs[variant]),
+                ))
+            with cls._span("PrintChart", variant=variant + 1):
+                cls.PrintChart(curvePoints)
+            print("")
         # print('Will write output to: "{0}"'.format(outputFileName))
         # ^ The name is not finalized yet.
-        newFileName = None
-        with open(outputFileName, 'w') as writer:
+        writers = []
+        stats = []
+        mode = 'w'
+        if verify_compact or (compact_decimals is not None):
+            compact = True
+        if ((cls._bytesTemplate is not None) or parallel or pipelined
+                or compact):
+            mode = 'wb'
+            # ^ so RawLines are written without decoding them (and
+            #   ThreadedWriter and CompactWriter only write bytes)
+        compactWriters = []
+        translateTime = time.perf_counter()
+        with cls._span("Translate"):
+            try:
+                for name in outputFileNames:
+                    writer = open_file(name, mode,
+                                       like=cls.TEMPLATE_PATH)
+                    if compact:
+                        writer = CompactWriter(writer,
+                                               decimals=compact_decimals,
+                                               verify=verify_compact)
+                        compactWriters.append(writer)
+                    if pipelined:
+                        writer = ThreadedWriter(writer)
+                    writers.append(writer)
+                print("")
+                print("Generating G code...")
+                progress = None
+                if Progress.IsNeeded(callback=progress_callback):
+                    progress = Progress(
+                        total_bytes=os.path.getsize(cls.TEMPLATE_PATH),
+                        callback=progress_callback,
+                    )
+
+                if cls._commands is not None:
+                    if progress is not None:
+                        progress.TotalLines = sum(
+                            command.LineCount
+                            if command.__class__ is RawLines else 1
+                            for command in cls._commands
+                        )
+                    pairsSets = cls.TranslateVariants(
+                        cls._traceLayers(cls._commands),
+                        writers,
+                        cls.get_FirstTowerZ(),
+                        deltaX,
+                        deltaY,
+                        curvePointsSets,
+                        stats=stats,
+                        progress=progress,
+                        firmware_retraction=firmware_retraction,
+                        message_policy=message_policy,
+                    )
+                    cls._commands = None
+                    # ^ The commands were changed by TranslateVariants so
+                    #   they can't be reused.
+                else:
+                    retractions = None
+                    if cls._columns is not None:
+                        retractions = cls._columns.Retractions(
+                            cls.get_FirstTowerZ()
+                        )
+                    reader = None
+                    if parallel:
+                        commands = None
+                    elif cls._bytesTemplate is not None:
+                        commands = cls._bytesTemplate.Commands()
+                        if progress is not None:
+                            progress.TotalLines = \
+                                cls._bytesTemplate.CountLines()
+                    else:
+                        reader = cls.GetTemplateReader()
+                        if progress is not None:
+                            progress.Tell = cls._fileTell(reader)
+                        if pipelined:
+                            reader = LineReader(reader)
+                        commands = cls.ReadCommands(reader)
+                    try:
+                        if parallel:
+                            pairsSets = cls.TranslateParallel(
+                                cls.TEMPLATE_PATH,
+                                writers,
+                                cls.get_FirstTowerZ(),
+                                deltaX,
+                                deltaY,
+                                curvePointsSets,
+                                retractions=retractions,
+                                stats=stats,
+                                workers=workers,
+                                progress=progress,
+                                firmware_retraction=firmware_retraction,
+                                message_policy=message_policy,
+                            )
+                        else:
+                            pairsSets = cls.TranslateVariants(
+                                cls._traceLayers(commands),
+                                writers,
+                                cls.get_FirstTowerZ(),
+                                deltaX,
+                                deltaY,
+                                curvePointsSets,
+                                retractions=retractions,
+                                stats=stats,
+                                progress=progress,
+                                firmware_retraction=firmware_retraction,
+                                message_policy=message_policy,
+                            )
+                    finally:
+                        commands = None
+                        if reader is not None:
+                            reader.close()
+            finally:
+                for writer in writers:
+                    writer.close()
+                cls._closeBytesTemplate()
+        writeSeconds = time.perf_counter() - translateTime
+        for variant, compactWriter in enumerate(compactWriters):
             print("")
-            print("Generating G code...")
-
-            pairs = cls.TranslateGCode(
-                cls.GetTemplateReader(),
-                writer,
-                cls.get_FirstTowerZ(),
-                deltaX,
-                deltaY,
-                curvePoints,
-            )
-            left, dotExt = os.path.splitext(outputFileName)
-            left += " ("
-            left += "z={},r={}".format(
-                limited_f(pairs[0][0]),
-                limited_f(pairs[0][1])
-            )
-            # if len(pairs) > 2:
-            left += " to z={},r={}".format(
-                limited_f(pairs[-1][0]),
-                limited_f(pairs[-1][1])
-            )
-            left += ")"
-            newFileName = left + dotExt
-        if newFileName is not None:
-            shutil.move(outputFileName, newFileName)
-            outputFileName = newFileName
+            if len(compactWriters) == 1:
+                print("Compacted:")
+            else:
+                print("Compacted variant {}:".format(variant + 1))
+            saved = 0.0
+            if compactWriter.CharactersIn > 0:
+                saved = (1.0 - compactWriter.CharactersOut
+                         / compactWriter.CharactersIn)
+            print("- {0} characters ({1:.1%} smaller)".format(
+                compactWriter.CharactersOut, saved))
+            print("- {0} lines".format(compactWriter.LinesOut))
+            stats[variant]['compacted_characters'] = \
+                compactWriter.CharactersOut
+            stats[variant]['compacted_lines'] = compactWriter.LinesOut
+            if verify_compact:
+                print("- {0} moves and commands verified".format(
+                    compactWriter.VerifiedEvents))
+                stats[variant]['verified_events'] = \
+                    compactWriter.VerifiedEvents
 
         print("")
-        print('* wrote "{}"'.format(os.path.abspath(outputFileName)))
+        newFileNames = []
+        for name, pairs, result in zip(outputFileNames, pairsSets, stats):
+            newFileName = cls.PairsFileName(outputFileName, pairs)
+            if newFileName in newFileNames:
+                # Variants may only differ between the first and last
+                #   pairs, so keep the name unique.
+                newFileName = cls.PairsFileName(name, pairs)
+            with cls._span("move", path=newFileName):
+                shutil.move(name, newFileName)
+            newFileNames.append(newFileName)
+            print('* wrote "{}"'.format(os.path.abspath(newFileName)))
+            result['path'] = newFileName
+            result['pairs'] = pairs
+        cls.AddRunMetrics(stats, parseSeconds, writeSeconds,
+                          time.perf_counter() - startTime)
+        return stats
+
+    @staticmethod
+    def PeakMemoryMB():
+        '''
+        Get the peak resident memory of this process in MB, or if the
+        resource module isn't available, the peak traced by tracemalloc
+        (if tracing), otherwise None.
+        '''
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if sys.platform == "darwin":
+                return peak / (1024 * 1024)  # bytes on macOS
+            return peak / 1024  # KiB on Linux
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        return None
+
+    @classmethod
+    def AddRunMetrics(cls, stats, parseSeconds, writeSeconds, seconds):
+        '''
+        Add the metrics of a run of Generate to each of its stats (The
+        ones of the whole run are the same for every variant so that
+        each dict can be used alone):
+        'template' -- the template path.
+        'bytes_read' -- the size of the template.
+        'bytes_written' -- the size of the output file.
+        'parse_seconds' -- the time taken to measure the template
+                           (including parsing it unless the header had
+                           the extents or the cache had it).
+        'write_seconds' -- the time taken to translate the template and
+                           write every output file.
+        'seconds' -- the time taken by the whole run.
+        'lines_per_second' -- lines written per second of the run.
+        'peak_memory_mb' -- See PeakMemoryMB.
+        '''
+        bytesRead = os.path.getsize(cls.TEMPLATE_PATH)
+        peakMemory = cls.PeakMemoryMB()
+        for result in stats:
+            result['template'] = cls.TEMPLATE_PATH
+            result['bytes_read'] = bytesRead
+            result['bytes_written'] = os.path.getsize(result['path'])
+            result['parse_seconds'] = parseSeconds
+            result['write_seconds'] = writeSeconds
+            result['seconds'] = seconds
+            result['lines_per_second'] = None
+            if seconds > 0:
+                result['lines_per_second'] = result['lines'] / seconds
+            result['peak_memory_mb'] = peakMemory
+
+    @staticmethod
+    def SaveMetrics(path, results, failures=None):
+        '''
+        Save the results of Generate (or of every template in RunBatch)
+        as JSON (See /metrics).
+
+        Keyword arguments:
+        failures -- a list of (templatePath, error) tuples for templates
+                    that failed.
+        '''
+        data = {
+            'results': results,
+            'failures': [{'template': templatePath, 'error': error}
+                         for templatePath, error in (failures or [])],
+        }
+        with open(path, 'w') as stream:
+            json.dump(data, stream, indent=2)
+            stream.write("\n")
+
+    @staticmethod
+    def FindBatchTemplates(pattern):
+        '''
+        Get the sorted list of templates for /batch.
+
+        Sequential arguments:
+        pattern -- a glob such as "templates/*.gcode", or the path of a
+                   JSON manifest (ending with ".json") that has a list
+                   of paths or globs relative to the manifest.
+        '''
+        patterns = [pattern]
+        if pattern.lower().endswith(".json"):
+            with open(pattern, 'r') as stream:
+                patterns = json.load(stream)
+            if not isinstance(patterns, list):
+                raise ValueError('"{}" must contain a list of templates.'
+                                 ''.format(pattern))
+            directory = os.path.dirname(pattern)
+            patterns = [os.path.join(directory, str(path))
+                        for path in patterns]
+        results = []
+        for path_pattern in patterns:
+            for path in sorted(glob.glob(path_pattern)):
+                path = os.path.normpath(path)
+                if os.path.isfile(path) and (path not in results):
+                    results.append(path)
+        return results
+
+    @staticmethod
+    def RunBatchJob(job):
+        '''
+        Generate every variant for one template in a worker process
+        (See RunBatch). The output that Generate would show is discarded
+        so that the summary is the same regardless of the order in
+        which jobs finish.
+
+        Sequential arguments:
+        job -- a (templatePath, variantsArgs, cacheDirectory, options)
+               tuple where cacheDirectory is None for no TemplateCache
+               and options is a dict of keyword arguments for Generate.
+
+        Returns:
+        a (templatePath, results, error) tuple where results is from
+        Generate and error is a message (or None).
+        '''
+        templatePath, variantsArgs, cacheDirectory, options = job
+        cache = None
+        if cacheDirectory is not None:
+            cache = TemplateCache(cacheDirectory)
+        try:
+            curvePointsSets = [Program.ParseCurveArgs(variantArgs)
+                               for variantArgs in variantsArgs]
+            Program.set_template(templatePath)
+            with contextlib.redirect_stdout(io.StringIO()):
+                results = Program.Generate(
+                    curvePointsSets,
+                    variantsArgs=variantsArgs,
+                    cache=cache,
+                    **options
+                )
+        except Exception as ex:
+            return (templatePath, None, "{}: {}".format(type(ex).__name__,
+                                                        ex))
+        return (templatePath, results, None)
+
+    @classmethod
+    def RunBatch(cls, templatePaths, variantsArgs, cache=None, workers=None,
+                 **options):
+        '''
+        Generate the towers for each template in a pool of processes
+        (Program keeps the template in class attributes, so a process
+        can only work on one template at a time). Each job is one
+        template with all of its variants so the template is only
+        parsed once (See Generate).
+
+        Keyword arguments:
+        cache -- a TemplateCache for every job to use.
+        workers -- the number of processes (default: os.cpu_count()).
+        Any other keyword arguments are passed to Generate (such as
+        center).
+
+        Returns:
+        a list of RunBatchJob results in the order of templatePaths.
+        '''
+        cacheDirectory = None
+        if cache is not None:
+            cacheDirectory = cache.Directory
+        jobs = [
+            (path, variantsArgs, cacheDirectory, options)
+            for path in templatePaths
+        ]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, min(workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map keeps the order of the jobs.
+            return list(executor.map(cls.RunBatchJob, jobs))
+
+    @staticmethod
+    def PrintBatchSummary(batchResults):
+        '''
+        Show a table with a row for each output of RunBatch.
+
+        Returns:
+        the number of templates that failed.
+        '''
+        print("Template                       Var    Lines  Commands"
+              "     Moves  Retr.  Curve")
+        failures = 0
+        for templatePath, results, error in batchResults:
+            name = os.path.basename(split_compression(templatePath)[0])
+            name = os.path.splitext(name)[0]
+            if error is not None:
+                failures += 1
+                print("{} FAILED: {}".format(name.ljust(30), error))
+                continue
+            for variant, result in enumerate(results):
+                pairs = result['pairs']
+                print("{} {:>3} {:>8} {:>9} {:>9} {:>6}  {}".format(
+                    name[:30].ljust(30),
+                    variant + 1,
+                    result['lines'],
+                    result['commands'],
+                    result['movement_commands'],
+                    result['retractions'],
+                    "z={},r={} to z={},r={}".format(
+                        limited_f(pairs[0][0]),
+                        limited_f(pairs[0][1]),
+                        limited_f(pairs[-1][0]),
+                        limited_f(pairs[-1][1]),
+                    ),
+                ))
+        for templatePath, results, error in batchResults:
+            if results is None:
+                continue
+            for result in results:
+                print('* wrote "{}"'.format(os.path.abspath(result['path'])))
+        return failures
+
+    @classmethod
+    def Main(cls, args):
+        curveArgs = []
+        variantsPath = None
+        batchPattern = None
+        workers = None
+
+        inputFileName = None
+        cls.extents_used_by = None
+        center = None
+        verify_extents = False
+        columnar = False
+        use_cache = True
+        use_mmap = False
+        parallel = False
+        pipelined = False
+        firmware_retraction = False
+        message_policy = None
+        compact = False
+        compact_decimals = None
+        verify_compact = False
+        metricsPath = None
+        if True:
+            index = 0
+
+            while index < len(args):
+                argName = args[index].lower()
+                if argName == "/output":
+                    # The name is based on the template instead (See
+                    #   OutputFileName).
+                    index += 2
+                    continue
+
+                elif argName == "/center":
+                    center = (float(args[index + 1]),
+                              float(args[index + 2]))
+                    index += 3
+                    cls.extents_used_by = "/center"
+                    continue
+
+                elif argName == "/template":
+                    inputFileName = args[index+1]
+                    cls.set_template(inputFileName)
+                    index += 2
+                    continue
+
+                elif argName in cls.CURVE_ARG_COUNTS:
+                    # See ParseCurveArgs.
+                    end = index + 1 + cls.CURVE_ARG_COUNTS[argName]
+                    curveArgs += args[index:end]
+                    index = end
+                    continue
+
+                elif argName == "/variants":
+                    variantsPath = args[index + 1]
+                    index += 2
+                    continue
+
+                elif argName == "/batch":
+                    batchPattern = args[index + 1]
+                    index += 2
+                    continue
+
+                elif argName == "/jobs":
+                    workers = int(args[index + 1])
+                    index += 2
+                    continue
+
+                elif argName == "/verify-extents":
+                    verify_extents = True
+                    index += 1
+                    continue
+
+                elif argName == "/columnar":
+                    columnar = True
+                    index += 1
+                    continue
+
+                elif argName == "/mmap":
+                    use_mmap = True
+                    index += 1
+                    continue
+
+                elif argName == "/parallel":
+                    parallel = True
+                    index += 1
+                    continue
+
+                elif argName == "/pipeline":
+                    pipelined = True
+                    index += 1
+                    continue
+
+                elif argName == "/messages":
+                    try:
+                        message_policy = MessagePolicy.Parse(args[index + 1])
+                    except ValueError as ex:
+                        usage()
+                        echo0("Error: {}".format(ex))
+                        return 1
+                    index += 2
+                    continue
+
+                elif argName == "/compact":
+                    compact = True
+                    index += 1
+                    continue
+
+                elif argName == "/compact-decimals":
+                    compact_decimals = int(args[index + 1])
+                    index += 2
+                    continue
+
+                elif argName == "/verify-compact":
+                    verify_compact = True
+                    index += 1
+                    continue
+
+                elif argName == "/firmware-retraction":
+                    firmware_retraction = True
+                    index += 1
+                    continue
+
+                elif argName == "/metrics":
+                    metricsPath = args[index + 1]
+                    index += 2
+                    continue
+
+                elif argName in ["/trace", "/profile"]:
+                    # Run everything else (including the arguments
+                    #   before this one) again while tracing.
+                    tracePath = None
+                    count = 1
+                    if argName == "/trace":
+                        tracePath = args[index + 1]
+                        count = 2
+                    return cls.MainWithDiagnostics(
+                        args[:index] + args[index + count:],
+                        trace_path=tracePath,
+                        profile=(argName == "/profile"),
+                    )
+
+                elif argName == "/no-cache":
+                    use_cache = False
+                    index += 1
+                    continue
+
+                elif argName == "/checkfile":
+                    cache = None
+                    if use_cache:
+                        cache = TemplateCache()
+                    cls.AnalyzeFile(args[index + 1], cache=cache)
+                    index += 2
+                    return 0
+                elif argName in ["--help", "/?"]:
+                    usage()
+                    return 0
+                elif argName in ["--debug", "/debug"]:
+                    set_verbosity(2)
+                    index += 1
+                    continue
+                elif argName in ["--verbose", "/verbose", "/v", "-v"]:
+                    set_verbosity(1)
+                    index += 1
+                    continue
+
+                elif inputFileName is None:
+                    # must be the *last* case
+                    inputFileName = args[index]
+                    cls.set_template(inputFileName)
+                    index += 1
+                    continue
+
+                raise Exception(
+                    'Error: "{}" is not a valid argument'.format(argName)
+                )
+        if variantsPath is not None:
+            if len(curveArgs) > 0:
+                usage()
+                echo0("Error: Put the curve options in the /variants file"
+                      " instead of using {}.".format(curveArgs[0]))
+                return 1
+            variantsArgs = cls.LoadVariants(variantsPath)
+            if len(variantsArgs) == 0:
+                echo0('Error: There are no variants in "{}".'
+                      ''.format(variantsPath))
+                return 1
+        else:
+            variantsArgs = [curveArgs]
+        curvePointsSets = []
+        for variantArgs in variantsArgs:
+            try:
+                curvePointsSets.append(cls.ParseCurveArgs(variantArgs))
+            except ValueError as ex:
+                usage()
+                echo0("Error: {}".format(ex))
+                return 1
+        cache = None
+        if use_cache:
+            cache = TemplateCache()
+        if batchPattern is not None:
+            if inputFileName is not None:
+                echo0("Error: Use either /batch or a template path.")
+                return 1
+            templatePaths = cls.FindBatchTemplates(batchPattern)
+            if len(templatePaths) == 0:
+                echo0('Error: No templates match "{}".'
+                      ''.format(batchPattern))
+                return 1
+            with cls._span("RunBatch"):
+                batchResults = cls.RunBatch(
+                    templatePaths,
+                    variantsArgs,
+                    cache=cache,
+                    workers=workers,
+                    center=center,
+                    verify_extents=verify_extents,
+                    columnar=columnar,
+                    use_mmap=use_mmap,
+                    pipelined=pipelined,
+                    firmware_retraction=firmware_retraction,
+                    message_policy=message_policy,
+                    compact=compact,
+                    compact_decimals=compact_decimals,
+                    verify_compact=verify_compact,
+                )
+            failures = cls.PrintBatchSummary(batchResults)
+            if metricsPath is not None:
+                allResults = []
+                errors = []
+                for templatePath, results, error in batchResults:
+                    if error is not None:
+                        errors.append((templatePath, error))
+                        continue
+                    allResults += results
+                cls.SaveMetrics(metricsPath, allResults, failures=errors)
+            if failures > 0:
+                return 1
+            return 0
+        results = cls.Generate(
+            curvePointsSets,
+            variantsArgs=variantsArgs,
+            center=center,
+            verify_extents=verify_extents,
+            columnar=columnar,
+            cache=cache,
+            use_mmap=use_mmap,
+            parallel=parallel,
+            workers=workers,
+            pipelined=pipelined,
+            firmware_retraction=firmware_retraction,
+            message_policy=message_policy,
+            compact=compact,
+            compact_decimals=compact_decimals,
+            verify_compact=verify_compact,
+        )
+        if metricsPath is not None:
+            cls.SaveMetrics(metricsPath, results)
         return 0
 
+    @classmethod
+    def MainWithDiagnostics(cls, args, trace_path=None, profile=False):
+        '''
+        Run Main with args while recording what takes the time. The
+        stdout of Main is unchanged (The profile goes to stderr).
+
+        Keyword arguments:
+        trace_path -- Save a trace of each phase (and each layer while
+                      translating) here as Chrome Trace Event JSON (See
+                      Tracer).
+        profile -- Run Main with cProfile and show the functions that
+                   took the most time (not counting the functions they
+                   call).
+        '''
+        if trace_path is not None:
+            cls.tracer = Tracer()
+        profiler = None
+        if profile:
+            profiler = cProfile.Profile()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                with cls._span("Main", args=" ".join(args)):
+                    return cls.Main(args)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+        finally:
+            if profiler is not None:
+                stats = pstats.Stats(profiler, stream=sys.stderr)
+                stats.sort_stats("tottime").print_stats(cls.PROFILE_LIMIT)
+            if trace_path is not None:
+                cls.tracer.Save(trace_path)
+                cls.tracer = None
+                echo0('* wrote trace "{}"'.format(
+                    os.path.abspath(trace_path)))
+
     @staticmethod
-    def AnalyzeFile(fileName):
-        with open(fileName, 'r') as reader:
+    def AnalyzeFile(fileName, cache=None):
+        '''
+        Show every retraction in the file.
+
+        Keyword arguments:
+        cache -- a TemplateCache from which to get the file's
+                 GCodeColumns if it was parsed before.
+        '''
+        if (cache is not None) and cache.IsAvailable():
+            columns = cache.GetColumns(fileName)
+            for amount, z in columns.AnalyzeRetractions():
+                print("=> Retract by {0} at Z {z}".format(amount, z=z))
+            return 0
+        with open_file(fileName, 'r') as reader:
             z = sys.float_info.min
             lastE = sys.float_info.min
 
@@ -631,7 +2209,7 @@ class Program:
                     break
                 line = line.rstrip("\n\r")
 
-                command = GCodeCommand(line)
+                command = GCodeCommand(line, lazy=True)
 
                 if (command.Command == "G0") or (command.Command == "G1"):
                     if command.HasParameter('Z'):
@@ -649,129 +2227,550 @@ class Program:
 
     @staticmethod
     def TranslateGCode(reader, writer, firstTowerZ, deltaX, deltaY,
-                       curvePoints):
+                       curvePoints, retractions=None, stats=None,
+                       progress=None, firmware_retraction=False,
+                       message_policy=None):
         '''
+        Read G-code from reader then translate it to writer (See
+        TranslateCommands).
+        '''
+        return Program.TranslateCommands(
+            Program.ReadCommands(reader),
+            writer,
+            firstTowerZ,
+            deltaX,
+            deltaY,
+            curvePoints,
+            retractions=retractions,
+            stats=stats,
+            progress=progress,
+            firmware_retraction=firmware_retraction,
+            message_policy=message_policy,
+        )
+
+    @staticmethod
+    def TranslateCommands(commands, writer, firstTowerZ, deltaX, deltaY,
+                          curvePoints, retractions=None, stats=None,
+                          progress=None, firmware_retraction=False,
+                          message_policy=None):
+        '''
+        Translate commands to writer using one retraction curve (See
+        TranslateVariants).
+
+        Keyword arguments:
+        stats -- a list to which to append a dict of what was written
+                 (See TranslateVariants).
+        progress -- See TranslateVariants.
+        firmware_retraction -- See TranslateVariants.
+        message_policy -- See TranslateVariants.
+
         Returns:
         a list of (retraction, z) tuples, where the first is the first
         value, the second is the first one where retraction differs,
         and the last is the last set changed.
         '''
-        if not isinstance(firstTowerZ, float):
-            raise ValueError("The firstTowerZ must be an float but"
-                             " is \"{}\".".format(firstTowerZ))
-        if not isinstance(curvePoints, list):
-            raise ValueError("The curvePoints must be a list but"
-                             " is \"{}\".".format(curvePoints))
+        return Program.TranslateVariants(
+            commands,
+            [writer],
+            firstTowerZ,
+            deltaX,
+            deltaY,
+            [curvePoints],
+            retractions=retractions,
+            stats=stats,
+            progress=progress,
+            firmware_retraction=firmware_retraction,
+            message_policy=message_policy,
+        )[0]
+
+    @staticmethod
+    def _addPair(pairs, z, retraction):
+        if len(pairs) == 0:
+            pairs.append((z, retraction))
+        elif len(pairs) == 1:
+            # Write the first delta if there is a
+            #   delta.
+            if retraction != pairs[0][0]:
+                pairs.append((z, retraction))
+        else:
+            # Always overwrite the third element,
+            #   which represents the last value,
+            #   unless negative (end retraction)
+            if len(pairs) < 3:
+                pairs.append((z, retraction))
+            else:
+                pairs[2] = (z, retraction)
+
+    @staticmethod
+    def TranslateVariants(commands, writers, firstTowerZ, deltaX, deltaY,
+                          curvePointsSets, retractions=None, stats=None,
+                          progress=None, firmware_retraction=False,
+                          message_policy=None):
+        '''
+        Translate the commands once for several retraction curves. Each
+        line that isn't a retraction is only converted to a string once
+        then written to every writer, so the cost of parsing the
+        template is shared by all of the variants.
+
+        Sequential arguments:
+        commands -- an iterable of GCodeCommand objects such as from
+                    ReadCommands (They are changed by this method), or
+                    from BytesTemplate.Commands (which also yields
+                    RawLines).
+        writers -- a list of streams, one for each curve (Binary
+                   streams get UTF-8)
+        curvePointsSets -- a list of curvePoints lists, one for each
+                           writer
+
+        Keyword arguments:
+        retractions -- a dict of retractions that were already detected
+                       (See GCodeColumns.Retractions), so that E is
+                       only checked on those lines. Otherwise, compare
+                       E of each G0 or G1 above firstTowerZ to the
+                       previous one.
+        stats -- a list to which a dict of the counts shown as "Output"
+                 is appended for each writer.
+        progress -- a Progress to update at each new Z.
+        firmware_retraction -- Write retractions as G10 and the moves
+                               after them as G11 (See
+                               FirmwareRetraction), and add
+                               'characters_saved' and 'lines_saved'
+                               (compared to changing E) to stats.
+        message_policy -- when to write the messages that show each
+                          retraction (See MessagePolicy and
+                          StatusMessages).
 
-        curvePoints = sorted(curvePoints)
+        Returns:
+        a list of pairs lists (See TranslateCommands), one for each
+        writer.
+        '''
+        Program._checkVariants(writers, firstTowerZ, curvePointsSets)
+        output = VariantWriters(writers, curvePointsSets,
+                                firmware_retraction=firmware_retraction,
+                                message_policy=message_policy)
         z = sys.float_info.min
         uniqueZValues = set()
         lastE = sys.float_info.min
-        lastSerialMessage = ""
-        gcodeWriter = GCodeWriter(writer)
-        numberOfRetractions = 0
-        pairs = []
-        line_n = 0
         is_relative = False
-        while True:
-            line_n += 1
-            line = reader.readline()
-            if not line:
-                break
-            line = line.rstrip("\n\r")
-
-            command = GCodeCommand(line)
-
+        line_index = -1
+        for command in commands:
+            if command.__class__ is RawLines:
+                # Lines from BytesTemplate that don't need to change
+                line_index += command.LineCount
+                output.WriteRaw(command)
+                continue
+            line_index += 1
             if (command.Command == "G0") or (command.Command == "G1"):
-                if command.HasParameter('X'):
-                    command.SetParameter(
-                        'X',
-                        command.GetParameter('X') + deltaX
-                    )
-                if command.HasParameter('Y'):
-                    command.SetParameter(
-                        'Y',
-                        command.GetParameter('Y') + deltaY
-                    )
+                Program._offsetXY(command, deltaX, deltaY)
 
                 if command.HasParameter('Z'):
                     z = command.GetParameter('Z')
-
-                    if uniqueZValues.add(z):
-                        sys.stdout.write('#')
-
-                if z >= firstTowerZ:
+                    uniqueZValues.add(z)
+                    if progress is not None:
+                        progress.Update(line_index + 1)
+
+                isRetraction = False
+                e = None
+                if retractions is not None:
+                    # The retractions were already detected (such as by
+                    #   GCodeColumns.Retractions).
+                    event = retractions.get(line_index)
+                    if event is not None:
+                        isRetraction = True
+                        lastE = event[1]
+                        e = command.GetParameter('E')
+                elif z >= firstTowerZ:
                     if command.HasParameter('E'):
                         e = command.GetParameter('E')
-
                         if e < lastE:
-                            #  Retraction!
-                            numberOfRetractions += 1
-
-                            retraction = Program.GetRetractionForZ(
-                                z,
-                                curvePoints
-                            )
-                            if is_relative:
-                                # Don't change relative extrusion
-                                #   such as end G-code.
-                                newE = retraction
-                                if e < 0:
-                                    newE *= -1.0
-                            else:
-                                newE = lastE - retraction
-                            command.SetParameter('E', newE)
-                            echo2("* z={:.2f},r={:.4f}".format(z, retraction))
-                            if len(pairs) == 0:
-                                pairs.append((z, retraction))
-                            elif len(pairs) == 1:
-                                # Write the first delta if there is a
-                                #   delta.
-                                if retraction != pairs[0][0]:
-                                    pairs.append((z, retraction))
-                            else:
-                                # Always overwrite the third element,
-                                #   which represents the last value,
-                                #   unless negative (end retraction)
-                                if len(pairs) < 3:
-                                    pairs.append((z, retraction))
-                                else:
-                                    pairs[2] = (z, retraction)
-                            lcdScreenMessage = (
-                                "dE {retraction:.3f} at Z {z:.1f}"
-                            ).format(retraction=retraction, z=z)
-                            serialMessage = (
-                                "Retraction {retraction:.5f}"
-                                " at Z {z:.1f}"
-                            ).format(retraction=retraction, z=z)
-
-                            gcodeWriter.WriteLine("M117 " + lcdScreenMessage)
-
-                            if serialMessage != lastSerialMessage:
-                                gcodeWriter.WriteLine("M118 " + serialMessage)
-
-                                lastSerialMessage = serialMessage
+                            isRetraction = True
+                        else:
+                            lastE = e
 
-                        lastE = e
+                output.WriteMove(command, e, lastE, z, is_relative,
+                                 isRetraction)
+                if isRetraction:
+                    lastE = e
+                continue
             elif command.Command == "G91":
                 is_relative = True
             elif command.Command == "G90":
                 is_relative = False
+            output.WriteLine(command)
+        if progress is not None:
+            progress.Finish(line_index + 1)
+        return output.Finish(len(uniqueZValues), stats=stats)
 
+    @staticmethod
+    def _offsetXY(command, deltaX, deltaY):
+        '''
+        Move X and Y of a G0 or G1 command (if it has them).
+        '''
+        if command.HasParameter('X'):
+            command.SetParameter('X', command.GetParameter('X') + deltaX)
+        if command.HasParameter('Y'):
+            command.SetParameter('Y', command.GetParameter('Y') + deltaY)
+
+    @staticmethod
+    def _checkVariants(writers, firstTowerZ, curvePointsSets):
+        if not isinstance(firstTowerZ, float):
+            raise ValueError("The firstTowerZ must be an float but"
+                             " is \"{}\".".format(firstTowerZ))
+        if len(writers) != len(curvePointsSets):
+            raise ValueError("There are {} writers but {} curves."
+                             "".format(len(writers), len(curvePointsSets)))
+        for curvePoints in curvePointsSets:
+            if not isinstance(curvePoints, list):
+                raise ValueError("The curvePoints must be a list but"
+                                 " is \"{}\".".format(curvePoints))
+
+    @staticmethod
+    def _writeRetraction(command, e, lastE, z, is_relative, curves,
+                         gcodeWriters, pairsSets, messages,
+                         firmware=None):
+        '''
+        Write a retraction to each writer with the E of its curve, and
+        the messages that show it (See TranslateVariants).
+
+        Sequential arguments:
+        command -- the G0 or G1 command that retracts to e
+        lastE -- E before command
+        messages -- the StatusMessages that decides the messages
+
+        Keyword arguments:
+        firmware -- a FirmwareRetraction to write the retraction as
+                    G10 if possible.
+        '''
+        if firmware is not None:
+            if FirmwareRetraction.CanConvert(command, is_relative):
+                firmware.Retract(command, lastE, z, curves, gcodeWriters,
+                                 pairsSets, messages)
+                return
+            firmware.RestoreFeedrate(command)
+        # Only E differs between the variants, so write the line
+        #   separately to each one.
+        for variant in range(len(gcodeWriters)):
+            retraction = curves[variant].Get(z)
+            if is_relative:
+                # Don't change relative extrusion
+                #   such as end G-code.
+                newE = retraction
+                if e < 0:
+                    newE *= -1.0
+            else:
+                newE = lastE - retraction
+            command.SetParameter('E', newE)
+            echo2("* z={:.2f},r={:.4f}".format(z, retraction))
+            Program._addPair(pairsSets[variant], z, retraction)
+            gcodeWriter = gcodeWriters[variant]
+            for line in messages.Lines(variant, z, retraction):
+                gcodeWriter.WriteLine(line)
             gcodeWriter.WriteLine(command)
 
+    @staticmethod
+    def _finishVariants(gcodeWriters, numUniqueZValues, numberOfRetractions,
+                        stats=None, firmware=None):
+        '''
+        Flush the writers and show what was written to each (See
+        TranslateVariants).
+
+        Keyword arguments:
+        firmware -- the FirmwareRetraction used, to show what it saved.
+        '''
+        for gcodeWriter in gcodeWriters:
+            gcodeWriter.Flush()
+
         print("")
         print("")
         print("See the chart generated above for what measurement (from bottom, not top of base) demonstrates what amount of retraction.")
-        print("")
-        print("Output:")
-        print("- {0} characters".format(gcodeWriter.NumCharactersWritten))
-        print("- {0} lines".format(gcodeWriter.NumLines))
-        print("- {0} commands".format(gcodeWriter.NumCommands))
-        print("- {0} movement commands".format(gcodeWriter.NumMovementCommands))
-        print("- {0} unique Z values".format(len(uniqueZValues)))
-        print("- {0} retractions".format(numberOfRetractions))
-        return pairs
+        for variant, gcodeWriter in enumerate(gcodeWriters):
+            print("")
+            if len(gcodeWriters) == 1:
+                print("Output:")
+            else:
+                print("Output of variant {}:".format(variant + 1))
+            print("- {0} characters".format(gcodeWriter.NumCharactersWritten))
+            print("- {0} lines".format(gcodeWriter.NumLines))
+            print("- {0} commands".format(gcodeWriter.NumCommands))
+            print("- {0} movement commands".format(gcodeWriter.NumMovementCommands))
+            print("- {0} unique Z values".format(numUniqueZValues))
+            print("- {0} retractions".format(numberOfRetractions))
+            if firmware is not None:
+                print("- {0} characters and {1} lines saved by firmware"
+                      " retraction".format(firmware.CharactersSaved[variant],
+                                           firmware.LinesSaved[variant]))
+            if stats is not None:
+                variantStats = {
+                    'characters': gcodeWriter.NumCharactersWritten,
+                    'lines': gcodeWriter.NumLines,
+                    'commands': gcodeWriter.NumCommands,
+                    'movement_commands': gcodeWriter.NumMovementCommands,
+                    'unique_z_values': numUniqueZValues,
+                    'retractions': numberOfRetractions,
+                }
+                if firmware is not None:
+                    variantStats['characters_saved'] = \
+                        firmware.CharactersSaved[variant]
+                    variantStats['lines_saved'] = \
+                        firmware.LinesSaved[variant]
+                stats.append(variantStats)
+
+    @staticmethod
+    def FindChunks(path, count):
+        '''
+        Split the file at path into about count chunks that each start
+        at a layer (See LAYER_MARK) if possible, otherwise at any line.
+
+        Returns:
+        a list of (start, end, line_index) tuples where start and end
+        are byte offsets and line_index is the number of lines before
+        start.
+        '''
+        chunks = []
+        with open(path, 'rb') as stream:
+            try:
+                data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file can't be mapped.
+                return chunks
+            try:
+                size = len(data)
+                step = max(size // max(count, 1), 1)
+                start = 0
+                line_index = 0
+                while start < size:
+                    end = size
+                    target = start + step
+                    if target < size:
+                        end = data.find(Program.LAYER_MARK, target,
+                                        target + step)
+                        if end < 0:
+                            end = data.find(b"\n", target)
+                        end = size if end < 0 else end + 1
+                    chunks.append((start, end, line_index))
+                    line_index += data[start:end].count(b"\n")
+                    start = end
+            finally:
+                data.close()
+        return chunks
+
+    @staticmethod
+    def TranslateChunk(job):
+        '''
+        Translate one chunk of a template in a worker process (See
+        TranslateParallel). The state from the lines before the chunk
+        isn't known here, so any line that depends on it (and every
+        retraction, since the messages depend on the previous one) is
+        returned as a record instead of as text.
+
+        Sequential arguments:
+        job -- a (path, start, end, line_index, firstTowerZ, deltaX,
+               deltaY, retractions, firmware_retraction) tuple where
+               start, end and line_index are from FindChunks and
+               retractions are those in the chunk (or None, See
+               TranslateVariants).
+
+        Returns:
+        an (items, state, uniqueZValues) tuple where items has a
+        RawLines of the translated lines (encoded) between records,
+        each record is either ("line", command, e, z, is_relative) for
+        a G0 or G1 that retracts if z is in the tower and e is less
+        than the E before it, or ("retraction", command, e, lastE, z,
+        is_relative), where None is the state before the chunk. If
+        firmware_retraction, a G0 or G1 that may need to be G11 or get F
+        (the first one with E after the start or after a record that may
+        retract, and the first one after any record) is also returned,
+        as ("move", command, e, z, is_relative) where e is None if it
+        doesn't have E (See FirmwareRetraction). The state is the (z,
+        lastE, is_relative) after the chunk (None if the records
+        determine it).
+        '''
+        (path, start, end, line_index, firstTowerZ, deltaX, deltaY,
+         retractions, firmware_retraction) = job
+        with open(path, 'rb') as stream:
+            stream.seek(start)
+            data = stream.read(end - start)
+        reader = io.TextIOWrapper(io.BytesIO(data))
+        # ^ decoded the same way as GetTemplateReader
+        items = []
+        output = io.BytesIO()
+        gcodeWriter = GCodeWriter(output, binary=True)
+        z = None
+        lastE = None
+        is_relative = None
+        uniqueZValues = set()
+        mayUnretract = firmware_retraction
+        mayRestoreFeedrate = firmware_retraction
+        line_index -= 1
+        for command in Program.ReadCommands(reader, path=path,
+                                            line_n=line_index + 1):
+            line_index += 1
+            if (command.Command == "G0") or (command.Command == "G1"):
+                Program._offsetXY(command, deltaX, deltaY)
+                if command.HasParameter('Z'):
+                    z = command.GetParameter('Z')
+                    uniqueZValues.add(z)
+
+                record = None
+                if retractions is not None:
+                    event = retractions.get(line_index)
+                    if event is not None:
+                        e = command.GetParameter('E')
+                        record = ("retraction", command, e, event[1], z,
+                                  is_relative)
+                elif (((z is None) or (z >= firstTowerZ))
+                        and command.HasParameter('E')):
+                    e = command.GetParameter('E')
+                    if (z is None) or (lastE is None):
+                        record = ("line", command, e, z, is_relative)
+                    elif e < lastE:
+                        record = ("retraction", command, e, lastE, z,
+                                  is_relative)
+                    if z is not None:
+                        lastE = e
+                    # ^ Otherwise it stays None since it depends on
+                    #   whether the Z before the chunk is in the tower.
+                if firmware_retraction:
+                    hasE = command.HasParameter('E')
+                    if ((record is None)
+                            and ((mayUnretract and hasE)
+                                 or mayRestoreFeedrate)):
+                        e = None
+                        if hasE:
+                            e = command.GetParameter('E')
+                        record = ("move", command, e, z, is_relative)
+                    if hasE:
+                        mayUnretract = ((record is not None)
+                                        and (record[0] != "move"))
+                    mayRestoreFeedrate = ((record is not None)
+                                          and ((record[0] != "move")
+                                               or hasE))
+                if record is not None:
+                    if gcodeWriter.NumLines > 0:
+                        items.append(Program._takeRawLines(gcodeWriter,
+                                                           output))
+                        output = io.BytesIO()
+                        gcodeWriter = GCodeWriter(output, binary=True)
+                    items.append(record)
+                    continue
+            elif command.Command == "G91":
+                is_relative = True
+            elif command.Command == "G90":
+                is_relative = False
+            gcodeWriter.WriteLine(command)
+        if gcodeWriter.NumLines > 0:
+            items.append(Program._takeRawLines(gcodeWriter, output))
+        return items, (z, lastE, is_relative), uniqueZValues
+
+    @staticmethod
+    def _takeRawLines(gcodeWriter, output):
+        gcodeWriter.Flush()
+        return RawLines(output.getvalue(), gcodeWriter.NumLines,
+                        gcodeWriter.NumCommands,
+                        gcodeWriter.NumCharactersWritten,
+                        gcodeWriter.NumMovementCommands)
+
+    @staticmethod
+    def TranslateParallel(path, writers, firstTowerZ, deltaX, deltaY,
+                          curvePointsSets, retractions=None, stats=None,
+                          workers=None, chunks=None, progress=None,
+                          firmware_retraction=False, message_policy=None):
+        '''
+        Translate the template at path like TranslateVariants but in
+        chunks (See FindChunks) using a pool of processes (See
+        TranslateChunk). Retractions are decided by going through the
+        records of the chunks in order, so the output is the same.
+
+        Keyword arguments:
+        retractions -- See TranslateVariants.
+        stats -- See TranslateVariants.
+        workers -- the number of processes (default: os.cpu_count()).
+        chunks -- the number of chunks (default: workers times
+                  CHUNKS_PER_WORKER, but fewer if they would be smaller
+                  than MIN_CHUNK_BYTES).
+        progress -- a Progress to update after each chunk.
+        firmware_retraction -- See TranslateVariants.
+        message_policy -- See TranslateVariants.
+
+        Returns:
+        a list of pairs lists (See TranslateCommands), one for each
+        writer.
+        '''
+        Program._checkVariants(writers, firstTowerZ, curvePointsSets)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = max(1, workers)
+        if chunks is None:
+            chunks = workers * Program.CHUNKS_PER_WORKER
+            chunks = max(1, min(
+                chunks,
+                os.path.getsize(path) // Program.MIN_CHUNK_BYTES,
+            ))
+        jobs = []
+        for start, end, line_index in Program.FindChunks(path, chunks):
+            chunkRetractions = None
+            if retractions is not None:
+                last_index = line_index + (end - start)
+                # ^ more than the number of lines, which is enough
+                chunkRetractions = {
+                    index: event for index, event in retractions.items()
+                    if line_index <= index < last_index
+                }
+            jobs.append((path, start, end, line_index, firstTowerZ,
+                         deltaX, deltaY, chunkRetractions,
+                         firmware_retraction))
+
+        output = VariantWriters(writers, curvePointsSets,
+                                firmware_retraction=firmware_retraction,
+                                message_policy=message_policy)
+        z = sys.float_info.min
+        uniqueZValues = set()
+        lastE = sys.float_info.min
+        is_relative = False
+        workers = max(1, min(workers, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map keeps the order of the chunks.
+            results = executor.map(Program.TranslateChunk, jobs)
+            for job, (items, state, chunkZValues) in zip(jobs, results):
+                for item in items:
+                    if item.__class__ is RawLines:
+                        output.WriteRaw(item)
+                        continue
+                    if item[0] == "retraction":
+                        command, e, lastE, itemZ, itemRelative = item[1:]
+                        isRetraction = True
+                    else:
+                        # a "line" or "move" record
+                        command, e, itemZ, itemRelative = item[1:]
+                        isRetraction = False
+                    if itemZ is None:
+                        itemZ = z
+                    if itemRelative is None:
+                        itemRelative = is_relative
+                    if (item[0] == "line") and (itemZ >= firstTowerZ):
+                        if e < lastE:
+                            isRetraction = True
+                        else:
+                            lastE = e
+                    output.WriteMove(command, e, lastE, itemZ,
+                                     itemRelative, isRetraction)
+                    if isRetraction:
+                        lastE = e
+                chunkZ, chunkLastE, chunkRelative = state
+                if chunkZ is not None:
+                    z = chunkZ
+                if chunkLastE is not None:
+                    lastE = chunkLastE
+                if chunkRelative is not None:
+                    is_relative = chunkRelative
+                uniqueZValues |= chunkZValues
+                if progress is not None:
+                    progress.Update(output.GCodeWriters[0].NumLines,
+                                    position=job[2])
+        if progress is not None:
+            progress.Finish(output.GCodeWriters[0].NumLines,
+                            position=os.path.getsize(path))
+        return output.Finish(len(uniqueZValues), stats=stats)
 
     @staticmethod
     def GetRetractionForZ(z, curvePoints):
@@ -0,0 +1,751 @@
+#!/usr/bin/env python
+'''
+Read and write Prusa's binary G-code (.bgcode) as described by
+https://github.com/prusa3d/libbgcode/blob/main/doc/specifications.md
+without libbgcode: a file header, then blocks (metadata, thumbnails and
+G-code) each with a header, parameters, data (compressed with deflate
+or heatshrink) and a CRC32. The G-code blocks are also MeatPack
+encoded, which packs the most common characters into 4 bits.
+
+open_bgcode gives a stream that reads the G-code of a .bgcode file as
+text (or bytes) one block at a time, or that writes text (or bytes) as
+G-code blocks, so memory doesn't depend on the size of the file.
+'''
+import io
+import struct
+import zlib
+
+
+class BlockType:
+    FileMetadata = 0
+    GCode = 1
+    SlicerMetadata = 2
+    PrinterMetadata = 3
+    PrintMetadata = 4
+    Thumbnail = 5
+
+
+class Compression:
+    NoCompression = 0
+    Deflate = 1
+    Heatshrink11_4 = 2
+    Heatshrink12_4 = 3
+
+
+class GCodeEncoding:
+    NoEncoding = 0
+    MeatPack = 1
+    MeatPackComments = 2
+
+
+class ChecksumType:
+    NoChecksum = 0
+    CRC32 = 1
+
+
+class Heatshrink:
+    '''
+    Compress and decompress heatshrink (LZSS) data: a 1 bit followed
+    by a literal byte, or a 0 bit followed by the offset (minus 1) of
+    earlier output in window_bits and a count (minus 1) of bytes to
+    copy from there in lookahead_bits, most significant bit first. As
+    in heatshrink, the window starts out full of zeros.
+    '''
+    # The window and lookahead bits of each Compression
+    PARAMETERS = {
+        Compression.Heatshrink11_4: (11, 4),
+        Compression.Heatshrink12_4: (12, 4),
+    }
+
+    @staticmethod
+    def MinimumMatch(window_bits, lookahead_bits):
+        '''
+        Get the length of the shortest match that heatshrink's encoder
+        uses instead of literals (the shortest that is longer than a
+        backref in whole bytes).
+        '''
+        return (1 + window_bits + lookahead_bits) // 8 + 1
+
+    @staticmethod
+    def _matchLength(data, start, index, limit):
+        '''
+        Count how many bytes (up to limit) at start are the same as
+        those at index.
+        '''
+        if data[start:start + limit] == data[index:index + limit]:
+            return limit
+        low = 0
+        high = limit
+        while high - low > 1:
+            middle = (low + high) // 2
+            if data[start:start + middle] == data[index:index + middle]:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def Compress(data, window_bits, lookahead_bits):
+        '''
+        Compress data the same way as heatshrink's encoder (so the
+        output is the same as that of PrusaSlicer and libbgcode): At
+        each byte, use the longest match in the window (the nearest of
+        those as long) if it is at least MinimumMatch, otherwise a
+        literal.
+        '''
+        windowSize = 1 << window_bits
+        data = bytes(windowSize) + bytes(data)
+        size = len(data)
+        maxLength = 1 << lookahead_bits
+        backrefBits = 1 + window_bits + lookahead_bits
+        minMatch = Heatshrink.MinimumMatch(window_bits, lookahead_bits)
+        candidates = {}
+        # ^ where each minMatch bytes start (A longer match starts with
+        #   them, so only these have to be compared.)
+        for index in range(windowSize):
+            key = data[index:index + minMatch]
+            positions = candidates.get(key)
+            if positions is None:
+                candidates[key] = [index]
+            else:
+                positions.append(index)
+        out = bytearray()
+        acc = 0
+        bits = 0
+        index = windowSize
+        while index < size:
+            bestLength = 0
+            bestOffset = 0
+            key = data[index:index + minMatch]
+            positions = candidates.get(key)
+            if positions is not None:
+                limit = min(maxLength, size - index)
+                for start in reversed(positions):
+                    offset = index - start
+                    if offset > windowSize:
+                        break
+                    if (bestLength > 0) and (data[start + bestLength]
+                                             != data[index + bestLength]):
+                        continue  # It can't be longer than bestLength.
+                    length = Heatshrink._matchLength(data, start, index,
+                                                     limit)
+                    if length > bestLength:
+                        bestLength = length
+                        bestOffset = offset
+                        if length == limit:
+                            break
+            if bestLength >= minMatch:
+                acc = ((acc << backrefBits)
+                       | ((bestOffset - 1) << lookahead_bits)
+                       | (bestLength - 1))
+                bits += backrefBits
+                end = index + bestLength
+            else:
+                acc = (acc << 9) | 0x100 | data[index]
+                bits += 9
+                end = index + 1
+            while index < end:
+                key = data[index:index + minMatch]
+                positions = candidates.get(key)
+                if positions is None:
+                    candidates[key] = [index]
+                else:
+                    positions.append(index)
+                index += 1
+            while bits >= 8:
+                bits -= 8
+                out.append((acc >> bits) & 0xFF)
+            acc &= (1 << bits) - 1
+        if bits > 0:
+            out.append((acc << (8 - bits)) & 0xFF)
+            # ^ The padding is too short for another backref.
+        return bytes(out)
+
+    @staticmethod
+    def Decompress(data, window_bits, lookahead_bits):
+        data = bytes(data)
+        size = len(data)
+        windowSize = 1 << window_bits
+        windowMask = windowSize - 1
+        lookaheadMask = (1 << lookahead_bits) - 1
+        backrefBits = window_bits + lookahead_bits
+        out = bytearray(windowSize)  # the zeros before the data
+        acc = 0
+        bits = 0
+        pos = 0
+        while True:
+            if bits < 1:
+                if pos >= size:
+                    break
+                acc = (acc << 8) | data[pos]
+                pos += 1
+                bits += 8
+            bits -= 1
+            if (acc >> bits) & 1:
+                needed = 8
+            else:
+                needed = backrefBits
+            while (bits < needed) and (pos < size):
+                acc = (acc << 8) | data[pos]
+                pos += 1
+                bits += 8
+            if bits < needed:
+                break  # the padding at the end
+            if needed == 8:
+                bits -= 8
+                out.append((acc >> bits) & 0xFF)
+            else:
+                bits -= window_bits
+                offset = ((acc >> bits) & windowMask) + 1
+                bits -= lookahead_bits
+                count = ((acc >> bits) & lookaheadMask) + 1
+                start = len(out) - offset
+                if offset >= count:
+                    out += out[start:start + count]
+                else:
+                    for index in range(start, start + count):
+                        out.append(out[index])
+            acc &= (1 << bits) - 1
+        return bytes(out[windowSize:])
+
+
+class _PackedPairs(dict):
+    '''
+    The MeatPack encoding of each pair of bytes (calculated when first
+    used).
+    '''
+    def __missing__(self, pair):
+        first = MeatPack.INDEXES.get(pair[0], MeatPack.LITERAL)
+        second = MeatPack.INDEXES.get(pair[1], MeatPack.LITERAL)
+        packed = bytearray([first | (second << 4)])
+        if first == MeatPack.LITERAL:
+            packed.append(pair[0])
+        if second == MeatPack.LITERAL:
+            packed.append(pair[1])
+        packed = bytes(packed)
+        self[pair] = packed
+        return packed
+
+
+class MeatPack:
+    '''
+    Encode G-code as MeatPack (See Pack), the same way that Marlin and
+    Prusa firmware decode it. The spaces and comments are kept, so
+    Unpack gets exactly the same text (Files that omit spaces, where
+    the table has 'E' instead of ' ', can also be unpacked).
+    '''
+    SIGNAL = 0xFF  # Two of these then a command byte is a command.
+    EnablePacking = 251
+    DisablePacking = 250
+    ResetAll = 249
+    QueryConfig = 248
+    EnableNoSpaces = 247
+    DisableNoSpaces = 246
+    LITERAL = 0b1111  # The character isn't packed but follows.
+    CHARACTERS = b"0123456789. \nGX"  # The index of each is its code.
+    NO_SPACES_CHARACTERS = b"0123456789.E\nGX"
+    INDEXES = {character: index for index, character in
+               enumerate(CHARACTERS)}
+    PAD = b" "  # a packed character that is ignored after a newline
+    _pairs = _PackedPairs()
+
+    @staticmethod
+    def Pack(data):
+        '''
+        Encode the bytes of G-code lines.
+
+        Each line (including the newline) is packed two characters per
+        byte, with the first in the low 4 bits. Characters not in
+        CHARACTERS are written after the byte in full. If a newline is
+        the first of a pair, the decoder ignores the second, so a
+        line's odd character doesn't affect the next line.
+
+        Raises:
+        ValueError if data has a 0xFF byte, which can't be sent since
+        two of them start a command.
+        '''
+        data = bytes(data)
+        if data.find(bytes([MeatPack.SIGNAL])) > -1:
+            raise ValueError("MeatPack can't encode a 0xFF byte.")
+        lines = data.split(b"\n")
+        last = lines.pop()  # after the last newline (usually b"")
+        padded = []
+        for line in lines:
+            if len(line) % 2 == 0:
+                padded.append(line + b"\n" + MeatPack.PAD)
+            else:
+                padded.append(line + b"\n")
+        tail = b""
+        if len(last) % 2 == 1:
+            # A character without a newline can't be padded, so send
+            #   it without packing.
+            tail = bytes([MeatPack.SIGNAL, MeatPack.SIGNAL,
+                          MeatPack.DisablePacking]) + last[-1:]
+            last = last[:-1]
+        padded.append(last)
+        padded = b"".join(padded)
+        pairs = MeatPack._pairs
+        return b"".join(
+            [bytes([MeatPack.SIGNAL, MeatPack.SIGNAL,
+                    MeatPack.EnablePacking])]
+            + [pairs[padded[index:index + 2]]
+               for index in range(0, len(padded), 2)]
+            + [tail]
+        )
+
+    @staticmethod
+    def Unpack(data):
+        '''
+        Decode MeatPack data (See Pack). Packing is off until a command
+        enables it. If spaces were omitted, one is added before each
+        letter that follows another character (except in comments) like
+        libbgcode does.
+        '''
+        data = bytes(data)
+        size = len(data)
+        signal = MeatPack.SIGNAL
+        literal = MeatPack.LITERAL
+        newline = ord("\n")
+        characters = MeatPack.CHARACTERS
+        packing = False
+        noSpaces = False
+        out = bytearray()
+        index = 0
+        while index < size:
+            byte = data[index]
+            if ((byte == signal) and (index + 2 < size)
+                    and (data[index + 1] == signal)):
+                command = data[index + 2]
+                index += 3
+                if command == MeatPack.EnablePacking:
+                    packing = True
+                elif command == MeatPack.DisablePacking:
+                    packing = False
+                elif command == MeatPack.ResetAll:
+                    packing = False
+                    noSpaces = False
+                elif command == MeatPack.EnableNoSpaces:
+                    noSpaces = True
+                elif command == MeatPack.DisableNoSpaces:
+                    noSpaces = False
+                characters = (MeatPack.NO_SPACES_CHARACTERS if noSpaces
+                              else MeatPack.CHARACTERS)
+                continue
+            index += 1
+            if not packing:
+                out.append(byte)
+                continue
+            first = byte & 0x0F
+            second = byte >> 4
+            if first == literal:
+                out.append(data[index])
+                index += 1
+            else:
+                out.append(characters[first])
+                if characters[first] == newline:
+                    continue
+            if second == literal:
+                out.append(data[index])
+                index += 1
+            else:
+                out.append(characters[second])
+        if noSpaces:
+            out = MeatPack.AddSpaces(out)
+        return bytes(out)
+
+    @staticmethod
+    def AddSpaces(data):
+        '''
+        Add a space before each letter that follows another character
+        (except in comments), such as to change b"G1X10E.5" to
+        b"G1 X10 E.5".
+        '''
+        out = bytearray()
+        for line in bytes(data).split(b"\n"):
+            if out:
+                out += b"\n"
+            comment = line.find(b";")
+            code = line if comment < 0 else line[:comment]
+            for index, byte in enumerate(code):
+                if ((index > 0) and (0x41 <= byte <= 0x5A)
+                        and (code[index - 1] != 0x20)):
+                    out.append(0x20)
+                out.append(byte)
+            if comment > -1:
+                out += line[comment:]
+        return out
+
+
+class Block:
+    '''
+    A block of a .bgcode file.
+
+    Sequential arguments:
+    Type -- a value from BlockType.
+    Parameters -- the bytes of the parameters (The encoding as 2 bytes
+                  for most blocks, See ENCODING_FORMAT).
+    Data -- the uncompressed data.
+    '''
+    HEADER_FORMAT = "<HHI"  # type, compression, uncompressed size
+    COMPRESSED_SIZE_FORMAT = "<I"  # only if compressed
+    ENCODING_FORMAT = "<H"
+    THUMBNAIL_PARAMETERS_FORMAT = "<HHH"  # format, width, height
+    CHECKSUM_FORMAT = "<I"
+
+    def __init__(self, Type, Parameters, Data):
+        self.Type = Type
+        self.Parameters = Parameters
+        self.Data = Data
+
+    def Encoding(self):
+        '''
+        Get the encoding parameter (a GCodeEncoding for a G-code block,
+        0 (INI) for metadata).
+        '''
+        if self.Type == BlockType.Thumbnail:
+            return None
+        return struct.unpack(Block.ENCODING_FORMAT, self.Parameters)[0]
+
+    @staticmethod
+    def ParametersSize(blockType):
+        if blockType == BlockType.Thumbnail:
+            return struct.calcsize(Block.THUMBNAIL_PARAMETERS_FORMAT)
+        return struct.calcsize(Block.ENCODING_FORMAT)
+
+    @staticmethod
+    def Compress(data, compression):
+        if compression == Compression.NoCompression:
+            return data
+        if compression == Compression.Deflate:
+            return zlib.compress(data)
+        window_bits, lookahead_bits = Heatshrink.PARAMETERS[compression]
+        return Heatshrink.Compress(data, window_bits, lookahead_bits)
+
+    @staticmethod
+    def Decompress(data, compression):
+        if compression == Compression.NoCompression:
+            return data
+        if compression == Compression.Deflate:
+            return zlib.decompress(data)
+        parameters = Heatshrink.PARAMETERS.get(compression)
+        if parameters is None:
+            raise ValueError("Compression {} is not known."
+                             "".format(compression))
+        return Heatshrink.Decompress(data, *parameters)
+
+    def Write(self, stream, compression, checksum_type):
+        '''
+        Write the block (with its data compressed) to a binary stream.
+        '''
+        data = self.Data
+        if self.Type == BlockType.Thumbnail:
+            compression = Compression.NoCompression
+            # ^ The images are already compressed.
+        compressed = Block.Compress(data, compression)
+        framed = struct.pack(Block.HEADER_FORMAT, self.Type, compression,
+                             len(data))
+        if compression != Compression.NoCompression:
+            framed += struct.pack(Block.COMPRESSED_SIZE_FORMAT,
+                                  len(compressed))
+        framed += self.Parameters
+        stream.write(framed)
+        stream.write(compressed)
+        if checksum_type == ChecksumType.CRC32:
+            crc = zlib.crc32(compressed, zlib.crc32(framed))
+            stream.write(struct.pack(Block.CHECKSUM_FORMAT, crc))
+
+    @staticmethod
+    def _readExactly(stream, size, path):
+        data = stream.read(size)
+        if len(data) != size:
+            raise ValueError('"{}" ends in the middle of a block.'
+                             ''.format(path))
+        return data
+
+    @staticmethod
+    def Read(stream, checksum_type, path=None):
+        '''
+        Read the next block from a binary stream, or return None at the
+        end of it.
+
+        Raises:
+        ValueError if the file is cut off or a checksum doesn't match.
+        '''
+        headerSize = struct.calcsize(Block.HEADER_FORMAT)
+        framed = stream.read(headerSize)
+        if len(framed) == 0:
+            return None
+        if len(framed) != headerSize:
+            raise ValueError('"{}" ends in the middle of a block.'
+                             ''.format(path))
+        blockType, compression, size = struct.unpack(Block.HEADER_FORMAT,
+                                                     framed)
+        compressedSize = size
+        if compression != Compression.NoCompression:
+            sizeBytes = Block._readExactly(
+                stream, struct.calcsize(Block.COMPRESSED_SIZE_FORMAT), path,
+            )
+            framed += sizeBytes
+            compressedSize = struct.unpack(Block.COMPRESSED_SIZE_FORMAT,
+                                           sizeBytes)[0]
+        parameters = Block._readExactly(
+            stream, Block.ParametersSize(blockType), path,
+        )
+        framed += parameters
+        compressed = Block._readExactly(stream, compressedSize, path)
+        if checksum_type == ChecksumType.CRC32:
+            expected = struct.unpack(
+                Block.CHECKSUM_FORMAT,
+                Block._readExactly(
+                    stream, struct.calcsize(Block.CHECKSUM_FORMAT), path,
+                ),
+            )[0]
+            if zlib.crc32(compressed, zlib.crc32(framed)) != expected:
+                raise ValueError('"{}" has a block with a bad checksum.'
+                                 ''.format(path))
+        data = Block.Decompress(compressed, compression)
+        if len(data) != size:
+            raise ValueError('"{}" has a block of the wrong size.'
+                             ''.format(path))
+        return Block(blockType, parameters, data)
+
+
+class BGCodeFile:
+    '''
+    The file header of a .bgcode file.
+    '''
+    MAGIC = b"GCDE"
+    VERSION = 1
+    HEADER_FORMAT = "<4sIH"  # magic, version, checksum type
+
+    @staticmethod
+    def ReadHeader(stream, path=None):
+        '''
+        Get the checksum type from the header of a binary stream.
+        '''
+        headerSize = struct.calcsize(BGCodeFile.HEADER_FORMAT)
+        header = stream.read(headerSize)
+        if ((len(header) != headerSize)
+                or not header.startswith(BGCodeFile.MAGIC)):
+            raise ValueError('"{}" is not binary G-code.'.format(path))
+        magic, version, checksumType = struct.unpack(
+            BGCodeFile.HEADER_FORMAT, header,
+        )
+        if version != BGCodeFile.VERSION:
+            raise ValueError('"{}" is binary G-code version {}, not {}.'
+                             ''.format(path, version, BGCodeFile.VERSION))
+        return checksumType
+
+    @staticmethod
+    def WriteHeader(stream, checksum_type):
+        stream.write(struct.pack(BGCodeFile.HEADER_FORMAT, BGCodeFile.MAGIC,
+                                 BGCodeFile.VERSION, checksum_type))
+
+    @staticmethod
+    def ReadMetadata(path):
+        '''
+        Get the blocks before the G-code (metadata and thumbnails) of
+        the .bgcode file at path.
+        '''
+        blocks = []
+        with open(path, 'rb') as stream:
+            checksumType = BGCodeFile.ReadHeader(stream, path=path)
+            while True:
+                block = Block.Read(stream, checksumType, path=path)
+                if (block is None) or (block.Type == BlockType.GCode):
+                    break
+                blocks.append(block)
+        return blocks
+
+    @staticmethod
+    def DefaultMetadata():
+        '''
+        Get the metadata blocks for a file that isn't made from a
+        .bgcode template. The printer, print and slicer metadata are
+        required (in that order) but may be empty.
+        '''
+        ini = struct.pack(Block.ENCODING_FORMAT, 0)
+        return [
+            Block(BlockType.FileMetadata, ini, b"Producer=retractiontower\n"),
+            Block(BlockType.PrinterMetadata, ini, b""),
+            Block(BlockType.PrintMetadata, ini, b""),
+            Block(BlockType.SlicerMetadata, ini, b""),
+        ]
+
+
+class BGCodeReader(io.RawIOBase):
+    '''
+    Read the G-code of a .bgcode file one block at a time.
+
+    Sequential arguments:
+    path -- the .bgcode file.
+
+    Attributes:
+    Metadata -- the blocks before the G-code (after the first read).
+    '''
+    def __init__(self, path):
+        self.Path = path
+        self.Metadata = []
+        self._file = open(path, 'rb')
+        try:
+            self._checksumType = BGCodeFile.ReadHeader(self._file,
+                                                       path=path)
+        except Exception:
+            self._file.close()
+            raise
+        self._data = b""
+        self._index = 0
+
+    def readable(self):
+        return True
+
+    def fileno(self):
+        return self._file.fileno()
+
+    def _nextData(self):
+        '''
+        Get the G-code of the next G-code block, or b"" at the end.
+        '''
+        while True:
+            block = Block.Read(self._file, self._checksumType,
+                               path=self.Path)
+            if block is None:
+                return b""
+            if block.Type != BlockType.GCode:
+                self.Metadata.append(block)
+                continue
+            if block.Encoding() == GCodeEncoding.NoEncoding:
+                data = block.Data
+            else:
+                data = MeatPack.Unpack(block.Data)
+            if data:
+                return data
+
+    def readinto(self, buffer):
+        if self._index >= len(self._data):
+            self._data = self._nextData()
+            self._index = 0
+            if not self._data:
+                return 0
+        count = min(len(buffer), len(self._data) - self._index)
+        buffer[:count] = self._data[self._index:self._index + count]
+        self._index += count
+        return count
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+            self._data = b""
+        super().close()
+
+
+class BGCodeWriter(io.RawIOBase):
+    '''
+    Write G-code to a .bgcode file in blocks of whole lines.
+
+    Sequential arguments:
+    path -- the .bgcode file.
+
+    Keyword arguments:
+    metadata -- the blocks to write before the G-code (default:
+                BGCodeFile.DefaultMetadata()), such as from
+                BGCodeFile.ReadMetadata of a .bgcode template.
+    compression -- how to compress the G-code blocks (default:
+                   Heatshrink12_4 like PrusaSlicer, which the firmware
+                   can read).
+    encoding -- how to encode the G-code blocks (default:
+                MeatPackComments). MeatPack is used as
+                MeatPackComments since comments are never removed.
+    '''
+    BLOCK_BYTES = 65535  # the most G-code in one block
+    COMPRESSION = Compression.Heatshrink12_4
+    METADATA_COMPRESSION = Compression.Deflate
+    ENCODING = GCodeEncoding.MeatPackComments
+    CHECKSUM_TYPE = ChecksumType.CRC32
+
+    def __init__(self, path, metadata=None, compression=None,
+                 encoding=None):
+        if metadata is None:
+            metadata = BGCodeFile.DefaultMetadata()
+        if compression is None:
+            compression = BGCodeWriter.COMPRESSION
+        if encoding is None:
+            encoding = BGCodeWriter.ENCODING
+        if encoding == GCodeEncoding.MeatPack:
+            encoding = GCodeEncoding.MeatPackComments
+        self._compression = compression
+        self._encoding = encoding
+        self._buffer = bytearray()
+        self._file = open(path, 'wb')
+        try:
+            BGCodeFile.WriteHeader(self._file, BGCodeWriter.CHECKSUM_TYPE)
+            for block in metadata:
+                block.Write(self._file, BGCodeWriter.METADATA_COMPRESSION,
+                            BGCodeWriter.CHECKSUM_TYPE)
+        except Exception:
+            self._file.close()
+            raise
+
+    def writable(self):
+        return True
+
+    def _writeBlock(self, data):
+        encoding = self._encoding
+        if encoding != GCodeEncoding.NoEncoding:
+            try:
+                data = MeatPack.Pack(data)
+            except ValueError:
+                encoding = GCodeEncoding.NoEncoding
+                # ^ The block has a 0xFF byte.
+        Block(
+            BlockType.GCode,
+            struct.pack(Block.ENCODING_FORMAT, encoding),
+            data,
+        ).Write(self._file, self._compression, BGCodeWriter.CHECKSUM_TYPE)
+
+    def write(self, data):
+        self._buffer += data
+        blockBytes = BGCodeWriter.BLOCK_BYTES
+        while len(self._buffer) >= blockBytes:
+            end = self._buffer.rfind(b"\n", 0, blockBytes) + 1
+            if end == 0:
+                end = blockBytes  # a line longer than a block
+            self._writeBlock(bytes(self._buffer[:end]))
+            del self._buffer[:end]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._buffer:
+                    self._writeBlock(bytes(self._buffer))
+                    self._buffer = bytearray()
+            finally:
+                self._file.close()
+        super().close()
+
+
+def open_bgcode(path, mode='r', like=None):
+    '''
+    Open the G-code in a .bgcode file like open.
+
+    Sequential arguments:
+    mode -- 'r', 'w', 'rb' or 'wb'.
+
+    Keyword arguments:
+    like -- when writing, copy the metadata and thumbnails from this
+            .bgcode file (such as the template) if it is one.
+    '''
+    if mode.startswith('r'):
+        stream = io.BufferedReader(BGCodeReader(path))
+    else:
+        metadata = None
+        if like is not None:
+            try:
+                metadata = BGCodeFile.ReadMetadata(like)
+            except ValueError:
+                pass  # It isn't binary G-code.
+        stream = io.BufferedWriter(BGCodeWriter(path, metadata=metadata))
+    if mode.endswith('b'):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8")
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+'''
+Read a template through mmap as bytes so that only the lines which the
+translation may change (G0, G1, G90 and G91) are decoded and parsed.
+Every run of other lines is kept as one memoryview of the file and
+written to the output without being copied line by line.
+'''
+import mmap
+
+from retractiontower.gcodecommand import GCodeCommand
+
+
+class RawLines:
+    '''
+    Consecutive lines of a template that are written without changes.
+
+    members:
+    Data -- a memoryview of the lines including each newline
+    LineCount -- the number of lines
+    NumCommands -- how many are commands (See GCodeWriter)
+    NumCharacters -- the number of characters once decoded
+    NumMovementCommands -- how many are G0 or G1 (always 0 from
+                           BytesTemplate, but not for the translated
+                           lines from Program.TranslateChunk)
+    '''
+    __slots__ = ('Data', 'LineCount', 'NumCommands', 'NumCharacters',
+                 'NumMovementCommands')
+    Command = None  # so that code expecting a GCodeCommand skips it
+
+    def __init__(self, Data, LineCount, NumCommands, NumCharacters,
+                 NumMovementCommands=0):
+        self.Data = Data
+        self.LineCount = LineCount
+        self.NumCommands = NumCommands
+        self.NumCharacters = NumCharacters
+        self.NumMovementCommands = NumMovementCommands
+
+
+class BytesTemplate:
+    '''
+    A memory-mapped template. Use it as a context manager or call close
+    after the last RawLines from Commands is no longer used.
+
+    Sequential arguments:
+    path -- the template (It must be UTF-8 or ASCII)
+
+    members:
+    Supported -- False if the file has any carriage return, since text
+                 mode would change the line endings (so use
+                 Program.ReadCommands instead).
+    '''
+    ENCODING = "utf-8"
+    # The lines that Program.TranslateCommands may change or that change
+    #   its state are decoded. The rest are RawLines.
+    DECODED_G_NUMBERS = (0, 1, 90, 91)
+    COMMAND_TYPES = (b"G", b"M")
+    COUNT_BYTES = 1024 * 1024  # how much CountLines copies at once
+
+    def __init__(self, path):
+        self.Path = path
+        self._file = open(path, 'rb')
+        self._mmap = None
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+            data = self._mmap
+        except ValueError:
+            # An empty file can't be mapped.
+            data = b""
+        self._data = data
+        self.Supported = data.find(b"\r") < 0
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._data = b""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def _classify(line):
+        '''
+        Get the command type (such as b"G") and number of the first word
+        with a number like GCodeCommand._classify, or (None, None) if
+        there is none. The number is None if it can't be parsed.
+        '''
+        for word in GCodeCommand.CodeWords(line):
+            if len(word) < 2:
+                continue
+            try:
+                return word[:1], int(float(word[1:]))
+            except ValueError:
+                return word[:1], None
+        return None, None
+
+    def CountLines(self):
+        '''
+        Count the lines (including a last one without a newline).
+        '''
+        data = self._data
+        count = 0
+        for start in range(0, len(data), BytesTemplate.COUNT_BYTES):
+            count += data[start:start + BytesTemplate.COUNT_BYTES].count(
+                b"\n"
+            )
+            # ^ mmap has no count, so count a slice (copy) at a time.
+        if data[-1:] not in (b"", b"\n"):
+            count += 1
+        return count
+
+    def Commands(self, path=None):
+        '''
+        Yield a lazy GCodeCommand for each line that Program.
+        TranslateCommands needs to see, and a RawLines for each run of
+        other lines (in the order of the file).
+        '''
+        if not self.Supported:
+            raise ValueError('"{}" has carriage returns, so read it in'
+                             ' text mode instead.'.format(self.Path))
+        if path is None:
+            path = self.Path
+        data = self._data
+        view = memoryview(data)
+        size = len(data)
+        encoding = BytesTemplate.ENCODING
+        decodedNumbers = BytesTemplate.DECODED_G_NUMBERS
+        commandTypes = BytesTemplate.COMMAND_TYPES
+        pos = 0
+        line_n = 0
+        spanStart = 0
+        spanLines = 0
+        spanCommands = 0
+        spanCharacters = 0
+        try:
+            while pos < size:
+                line_n += 1  # Counting numbers start at 1.
+                end = data.find(b"\n", pos)
+                if end < 0:
+                    end = size
+                line = data[pos:end]
+                first = line.lstrip()[:1]
+                decode = False
+                commandType = None
+                if first and (first != b";"):
+                    commandType, number = BytesTemplate._classify(line)
+                    if commandType == b"G":
+                        decode = (number is None) or (number in decodedNumbers)
+                    elif (commandType is not None) and (number is None):
+                        decode = True
+                        # ^ so that GCodeCommand shows the error
+                if end == size:
+                    # The output needs a newline after the last line.
+                    decode = True
+                if decode:
+                    if spanLines:
+                        yield RawLines(view[spanStart:pos], spanLines,
+                                       spanCommands, spanCharacters)
+                        spanLines = 0
+                        spanCommands = 0
+                        spanCharacters = 0
+                    yield GCodeCommand(line.decode(encoding), path=path,
+                                       line_n=line_n, lazy=True)
+                    pos = end + 1
+                    spanStart = pos
+                    continue
+                spanLines += 1
+                if commandType in commandTypes:
+                    spanCommands += 1
+                if line.isascii():
+                    spanCharacters += len(line) + 1
+                else:
+                    spanCharacters += len(line.decode(encoding)) + 1
+                pos = end + 1
+            if spanLines:
+                yield RawLines(view[spanStart:pos], spanLines,
+                               spanCommands, spanCharacters)
+        finally:
+            view.release()
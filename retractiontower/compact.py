@@ -0,0 +1,585 @@
+#!/usr/bin/env python
+'''
+Make G-code smaller without changing how the printer moves (See
+/compact in the usage of retractiontower): remove comments, parameters
+that repeat the modal state (such as an F that is already the speed or
+a coordinate that is already the position) and moves that then do
+nothing, and round the numbers of absolute moves to a number of decimal
+places. Toolpath simulates the moves so the result can be verified.
+
+Usage:
+python -m retractiontower.compact <path> <output> [--decimals <n>]
+python -m retractiontower.compact --verify <path> <compacted> [--decimals <n>]
+
+The first form compacts path to output and verifies it. The second only
+verifies that compacted moves the same way as path (within the rounding
+of --decimals places). Either file may be compressed (See
+retractiontower.compressedfile).
+'''
+import re
+import sys
+
+from retractiontower.bytestemplate import BytesTemplate
+from retractiontower.compressedfile import open_file
+from retractiontower.gcodecommand import GCodeCommand
+
+
+def _parseWords(words):
+    '''
+    Get the command (such as "G1") and a list of (character, number,
+    text) tuples for the parameters, where number is None if the
+    parameter has none, or return (None, None) if a word isn't a letter
+    and a number (such as a line number or checksum).
+    '''
+    params = []
+    for word in words:
+        character = word[0].upper()
+        if not character.isalpha():
+            return None, None
+        text = word[1:]
+        number = None
+        if text:
+            try:
+                number = float(text)
+            except ValueError:
+                return None, None
+        params.append((character, number, text))
+    character, number, text = params[0]
+    if (number is None) or (not number.is_integer()):
+        return None, None
+    return character + str(int(number)), params[1:]
+
+
+class Compactor:
+    '''
+    Compact G-code one line at a time, keeping the modal state that
+    the lines after it depend on (the position, speed and whether moves
+    are relative).
+
+    Keyword arguments:
+    decimals -- the number of decimal places to keep in X, Y, Z, E and F
+                of G0 and G1 (Relative values are never rounded, since
+                the error would add up).
+    '''
+    DECIMALS = 5
+    MOVES = ("G0", "G1")
+    AXES = ('X', 'Y', 'Z')
+    # Commands with text instead of parameters (kept as they are)
+    TEXT_COMMANDS = ("M0", "M1", "M23", "M28", "M30", "M32", "M117", "M118",
+                     "M928")
+    # Commands known not to move or change the speed. Any other command
+    #   (such as G28, M600 or a tool change) makes the state unknown.
+    STILL_COMMANDS = (
+        "G4", "G10", "G11", "G21",
+        "M73", "M82", "M83", "M104", "M105", "M106", "M107", "M109",
+        "M140", "M141", "M190", "M191", "M201", "M202", "M203", "M204",
+        "M205", "M207", "M208", "M209", "M220", "M221", "M400", "M900",
+    )
+
+    def __init__(self, decimals=None):
+        if decimals is None:
+            decimals = Compactor.DECIMALS
+        self.Decimals = decimals
+        self._spec = ".{}f".format(decimals)
+        self._position = {'X': None, 'Y': None, 'Z': None}
+        self._feedrate = None
+        self._relative = False
+        self._relativeE = False
+
+    def FormatNumber(self, number):
+        '''
+        Round number to Decimals places without trailing zeros.
+        '''
+        text = format(number, self._spec)
+        if '.' in text:
+            text = text.rstrip("0").rstrip(".")
+        if text == "-0":
+            return "0"
+        return text
+
+    def _forget(self):
+        self._position = {'X': None, 'Y': None, 'Z': None}
+        self._feedrate = None
+
+    def Compact(self, line):
+        '''
+        Get the compacted line (without a newline), or None if it can be
+        removed (a comment, a blank line or a move that does nothing).
+        '''
+        words = GCodeCommand.CodeWords(line)
+        if not words:
+            return None
+        if words[0].upper() in Compactor.TEXT_COMMANDS:
+            return line.rstrip()
+            # ^ before parsing, since the text isn't parameters
+        command, params = _parseWords(words)
+        if command is None:
+            self._forget()
+            return " ".join(words)
+        if command in Compactor.MOVES:
+            return self._compactMove(command, params)
+        if command == "G90":
+            self._relative = False
+            self._relativeE = False
+        elif command == "G91":
+            self._relative = True
+            self._relativeE = True
+        elif command == "M82":
+            self._relativeE = False
+        elif command == "M83":
+            self._relativeE = True
+        elif command == "G92":
+            for character, number, text in params:
+                if character in Compactor.AXES:
+                    self._position[character] = number
+            if not params:
+                self._forget()
+        elif command not in Compactor.STILL_COMMANDS:
+            self._forget()
+        return " ".join(words)
+
+    def _compactMove(self, command, params):
+        words = [command]
+        for character, number, text in params:
+            if number is None:
+                words.append(character + text)
+            elif character in Compactor.AXES:
+                if self._relative:
+                    if number == 0:
+                        continue
+                    self._position[character] = None
+                    words.append(character + text)
+                    continue
+                text = self.FormatNumber(number)
+                value = float(text)
+                if value == self._position[character]:
+                    continue
+                self._position[character] = value
+                words.append(character + text)
+            elif character == 'E':
+                if self._relativeE:
+                    if number == 0:
+                        continue
+                    words.append(character + text)
+                else:
+                    words.append(character + self.FormatNumber(number))
+            elif character == 'F':
+                text = self.FormatNumber(number)
+                value = float(text)
+                if value == self._feedrate:
+                    continue
+                self._feedrate = value
+                words.append(character + text)
+            else:
+                words.append(character + text)
+        if len(words) < 2:
+            return None
+        return " ".join(words)
+
+
+class Toolpath:
+    '''
+    Simulate how G-code moves one line at a time, so that two files can
+    be compared (See Compare). It has its own parser and lists of
+    commands on purpose, and never rounds, so that a mistake in how
+    Compactor reads or rounds a line shows up as a difference instead
+    of being repeated here.
+    '''
+    MOVES = ("G0", "G1", "G2", "G3")
+    LINEAR_MOVES = ("G0", "G1")
+    # Commands with text instead of parameters
+    TEXT_COMMANDS = ("M0", "M1", "M23", "M28", "M30", "M32", "M117", "M118",
+                     "M928")
+    # Commands that neither move nor change the speed. Any other command
+    #   makes the position and speed unknown, so the next move must
+    #   state them again.
+    IDLE_COMMANDS = (
+        "G4", "G10", "G11", "G21",
+        "M73", "M82", "M83", "M104", "M105", "M106", "M107", "M109",
+        "M140", "M141", "M190", "M191", "M201", "M202", "M203", "M204",
+        "M205", "M207", "M208", "M209", "M220", "M221", "M400", "M900",
+    )
+    COMMENT_MARKS = (";", "//")
+    WORD = re.compile(r"([A-Za-z])"
+                      r"([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)?")
+
+    def __init__(self):
+        self.Position = {'X': None, 'Y': None, 'Z': None, 'E': None}
+        # ^ absolute (None if unknown, and E is None if it is relative)
+        self.Feedrate = None
+        self._relative = False
+        self._relativeE = False
+
+    def _forget(self):
+        self.Position = {'X': None, 'Y': None, 'Z': None, 'E': None}
+        self.Feedrate = None
+
+    @staticmethod
+    def Parse(code):
+        '''
+        Get the command (such as "G1") and a list of (letter, number)
+        tuples for the parameters of code (a line without a comment),
+        where number is None if the parameter has none, or
+        (None, None) if code isn't letters and numbers.
+        '''
+        params = []
+        for word in code.split():
+            match = Toolpath.WORD.fullmatch(word)
+            if match is None:
+                return None, None
+            number = match.group(2)
+            if number is not None:
+                number = float(number)
+            params.append((match.group(1).upper(), number))
+        letter, number = params[0]
+        if (number is None) or (not number.is_integer()):
+            return None, None
+        return "{}{}".format(letter, int(number)), params[1:]
+
+    def Feed(self, line):
+        '''
+        Get the event of line, or None if it does nothing: A move is
+        ("move", command, x, y, z, e, f, other) where each coordinate is
+        the absolute target (or None if unknown), e is the amount
+        extruded if E is relative, and other is a tuple of the other
+        parameters. Any other command is ("command", text).
+        '''
+        code = line
+        for mark in Toolpath.COMMENT_MARKS:
+            code = code.split(mark, 1)[0]
+        code = " ".join(code.split())
+        if not code:
+            return None
+        if code.split(" ", 1)[0].upper() in Toolpath.TEXT_COMMANDS:
+            return ("command", line.rstrip())
+        command, params = Toolpath.Parse(code)
+        if command is None:
+            self._forget()
+            return ("command", code)
+        if command in Toolpath.MOVES:
+            return self._move(command, params)
+        if command == "G90":
+            self._relative = False
+            self._relativeE = False
+        elif command == "G91":
+            self._relative = True
+            self._relativeE = True
+            self.Position['E'] = None
+        elif command == "M82":
+            self._relativeE = False
+        elif command == "M83":
+            self._relativeE = True
+            self.Position['E'] = None
+        elif command == "G92":
+            for letter, number in params:
+                if letter in self.Position:
+                    self.Position[letter] = number
+            if not params:
+                self._forget()
+        elif command not in Toolpath.IDLE_COMMANDS:
+            self._forget()
+        return ("command", code)
+
+    def _move(self, command, params):
+        target = dict(self.Position)
+        extruded = None
+        other = []
+        moved = command not in Toolpath.LINEAR_MOVES
+        # ^ An arc goes somewhere even if it ends where it started.
+        for letter, number in params:
+            if (letter in target) and (number is not None):
+                if letter == 'E':
+                    relative = self._relativeE
+                else:
+                    relative = self._relative
+                if not relative:
+                    if target[letter] != number:
+                        moved = True
+                    target[letter] = number
+                elif number != 0:
+                    moved = True
+                    if letter == 'E':
+                        extruded = number
+                    elif target[letter] is not None:
+                        target[letter] += number
+            elif (letter == 'F') and (number is not None):
+                self.Feedrate = number
+            else:
+                other.append((letter, number))
+                moved = True
+        if self._relativeE:
+            target['E'] = None
+        self.Position = target
+        if not moved:
+            return None
+        e = extruded
+        if not self._relativeE:
+            e = target['E']
+        return ("move", command, target['X'], target['Y'], target['Z'], e,
+                self.Feedrate, tuple(other))
+
+    @staticmethod
+    def _near(value, other, tolerance):
+        if (value is None) or (other is None):
+            return value is other
+        return abs(value - other) <= tolerance
+
+    @staticmethod
+    def Same(event, other, tolerance=0.0):
+        '''
+        Check whether two events from Feed are the same, allowing each
+        number to differ by tolerance.
+        '''
+        if (event is None) or (other is None):
+            return event is other
+        if len(event) != len(other):
+            return False
+        for value, otherValue in zip(event, other):
+            if isinstance(value, float) and isinstance(otherValue, float):
+                if abs(value - otherValue) > tolerance:
+                    return False
+            elif isinstance(value, tuple) and isinstance(otherValue, tuple):
+                if not Toolpath.Same(value, otherValue, tolerance):
+                    return False
+            elif value != otherValue:
+                return False
+        return True
+
+    @staticmethod
+    def Negligible(event, position, tolerance):
+        '''
+        Check whether event is a straight move that ends within
+        tolerance of position (a Position of another Toolpath) without
+        extruding, so rounding may remove it.
+        '''
+        if (event is None) or (event[0] != "move"):
+            return False
+        if (event[1] not in Toolpath.LINEAR_MOVES) or event[7]:
+            return False
+        for index, axis in enumerate("XYZE", start=2):
+            if not Toolpath._near(event[index], position[axis], tolerance):
+                return False
+        return True
+
+    @staticmethod
+    def Tolerance(decimals):
+        '''
+        Get the most a number can change by rounding it to decimals
+        places (plus a little for the error of floats).
+        '''
+        return 0.5 * 10 ** -decimals + 1e-9
+
+    @staticmethod
+    def Compare(lines, otherLines, decimals=None):
+        '''
+        Check that otherLines move the same way as lines. A move in lines
+        may be missing from otherLines only if rounding makes it
+        negligible (See Negligible).
+
+        Keyword arguments:
+        decimals -- Allow the numbers to differ by rounding to this many
+                    places (See Compactor).
+
+        Returns:
+        the number of events of otherLines that were compared.
+
+        Raises:
+        ValueError if an event differs or one has more events.
+        '''
+        tolerance = 0.0
+        if decimals is not None:
+            tolerance = Toolpath.Tolerance(decimals)
+        otherToolpath = Toolpath()
+        events = Toolpath._events(Toolpath(), lines)
+        otherEvents = Toolpath._events(otherToolpath, otherLines)
+        count = 0
+        otherItem = next(otherEvents, None)
+        for item in events:
+            if (otherItem is not None) and Toolpath.Same(
+                    item[1], otherItem[1], tolerance):
+                count += 1
+                otherItem = next(otherEvents, None)
+                continue
+            position = otherToolpath.Position
+            if otherItem is not None:
+                position = otherItem[2]
+            if Toolpath.Negligible(item[1], position, tolerance):
+                continue
+            Toolpath._raiseDifference(count, item, otherItem)
+        if otherItem is not None:
+            Toolpath._raiseDifference(count, None, otherItem)
+        return count
+
+    @staticmethod
+    def _raiseDifference(count, item, otherItem):
+        raise ValueError(
+            "The toolpaths differ at event {} (line {}: {} vs."
+            " line {}: {})".format(
+                count + 1,
+                None if item is None else item[0],
+                None if item is None else item[1],
+                None if otherItem is None else otherItem[0],
+                None if otherItem is None else otherItem[1],
+            )
+        )
+
+    @staticmethod
+    def _events(toolpath, lines):
+        '''
+        Yield a (line number, event, position) tuple for each line of
+        lines that does something, where position is the Position
+        before the event.
+        '''
+        for line_n, line in enumerate(lines, start=1):
+            position = dict(toolpath.Position)
+            event = toolpath.Feed(line.rstrip("\r\n"))
+            if event is not None:
+                yield line_n, event, position
+
+
+class CompactWriter:
+    '''
+    Compact the G-code written to underlying (See Compactor). It is a
+    binary stream as far as GCodeWriter is concerned (and, like
+    ThreadedWriter, can wrap any binary stream).
+
+    Sequential arguments:
+    underlying -- a binary stream (It is closed by close).
+
+    Keyword arguments:
+    decimals -- See Compactor.
+    verify -- Simulate the toolpath of every line before and after
+              compacting it (See Toolpath) and raise ValueError if it
+              differs.
+    '''
+    def __init__(self, underlying, decimals=None, verify=False):
+        self._underlying = underlying
+        self._compactor = Compactor(decimals=decimals)
+        self._pending = b""
+        self._toolpaths = None
+        self._tolerance = Toolpath.Tolerance(self._compactor.Decimals)
+        if verify:
+            self._toolpaths = (Toolpath(), Toolpath())
+        self.LinesIn = 0
+        self.LinesOut = 0
+        self.CharactersIn = 0
+        self.CharactersOut = 0
+        self.VerifiedEvents = 0
+
+    def write(self, data):
+        data = bytes(data)
+        lines = (self._pending + data).split(b"\n")
+        self._pending = lines.pop()
+        self._writeLines(lines, b"\n")
+        return len(data)
+
+    def _writeLines(self, lines, end):
+        '''
+        Compact and write lines (bytes without newlines), each followed
+        by end.
+        '''
+        output = []
+        for data in lines:
+            line = data.decode(BytesTemplate.ENCODING, "surrogateescape")
+            compacted = self._compactor.Compact(line)
+            self.LinesIn += 1
+            self.CharactersIn += len(line) + len(end)
+            if self._toolpaths is not None:
+                self._verify(line, compacted)
+            if compacted is None:
+                continue
+            self.LinesOut += 1
+            self.CharactersOut += len(compacted) + len(end)
+            output.append(compacted.encode(BytesTemplate.ENCODING,
+                                           "surrogateescape") + end)
+        if output:
+            self._underlying.write(b"".join(output))
+
+    def _verify(self, line, compacted):
+        event = self._toolpaths[0].Feed(line)
+        compactedEvent = None
+        if compacted is not None:
+            compactedEvent = self._toolpaths[1].Feed(compacted)
+        if Toolpath.Same(event, compactedEvent, self._tolerance):
+            if event is not None:
+                self.VerifiedEvents += 1
+            return
+        if (compactedEvent is None) and Toolpath.Negligible(
+                event, self._toolpaths[1].Position, self._tolerance):
+            return
+        raise ValueError(
+            "Compacting line {} (\"{}\" to \"{}\") changed the toolpath"
+            " from {} to {}.".format(self.LinesIn, line, compacted,
+                                     event, compactedEvent)
+        )
+
+    def close(self):
+        '''
+        Write the last line (if it doesn't end with a newline) then
+        close underlying.
+        '''
+        if self._underlying is None:
+            return
+        try:
+            if self._pending:
+                self._writeLines([self._pending], b"")
+                self._pending = b""
+        finally:
+            self._underlying.close()
+            self._underlying = None
+
+
+def main():
+    args = sys.argv[1:]
+    verifyOnly = False
+    decimals = None
+    paths = []
+    index = 0
+    while index < len(args):
+        if args[index] == "--verify":
+            verifyOnly = True
+            index += 1
+        elif (args[index] == "--decimals") and (index + 1 < len(args)):
+            decimals = int(args[index + 1])
+            index += 2
+        elif args[index] in ["--help", "/?"]:
+            print(__doc__)
+            return 0
+        else:
+            paths.append(args[index])
+            index += 1
+    if len(paths) != 2:
+        print(__doc__)
+        print("Error: Specify 2 paths.")
+        return 1
+    path, otherPath = paths
+    if decimals is None:
+        decimals = Compactor.DECIMALS
+    if not verifyOnly:
+        with open_file(path, 'rb') as stream:
+            writer = CompactWriter(open_file(otherPath, 'wb'),
+                                   decimals=decimals)
+            try:
+                while True:
+                    data = stream.read(65536)
+                    if not data:
+                        break
+                    writer.write(data)
+            finally:
+                writer.close()
+        print('Wrote {} of {} lines ({} of {} characters) to "{}"'.format(
+            writer.LinesOut, writer.LinesIn, writer.CharactersOut,
+            writer.CharactersIn, otherPath))
+    with open_file(path, 'r') as stream, \
+            open_file(otherPath, 'r') as otherStream:
+        try:
+            count = Toolpath.Compare(stream, otherStream, decimals=decimals)
+        except ValueError as ex:
+            print("Error: {}".format(ex))
+            return 1
+    print("The toolpaths are the same ({} events).".format(count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+Open G-code files that may be compressed with gzip (.gz), xz (.xz) or
+Zstandard (.zst), or be Prusa's binary G-code (.bgcode, See
+retractiontower.bgcode). Each codec streams, so memory stays the same
+regardless of the size of the file. Zstandard is only available with
+Python 3.14's compression.zstd or the zstandard package.
+'''
+import gzip
+import lzma
+import os
+
+from retractiontower.bgcode import BGCodeFile, open_bgcode
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+# The start of a file compressed by each codec
+MAGIC = {
+    ".gz": b"\x1f\x8b",
+    ".xz": b"\xfd7zXZ\x00",
+    ".zst": b"\x28\xb5\x2f\xfd",
+    ".bgcode": BGCodeFile.MAGIC,
+}
+MAGIC_BYTES = max(len(magic) for magic in MAGIC.values())
+GZIP_LEVEL = 6  # like the gzip command (gzip.open's default 9 is slow)
+
+
+def split_compression(path):
+    '''
+    Split a compression extension from path, such as
+    ("Template.gcode", ".gz") for "Template.gcode.gz", or (path, "") if
+    it has none.
+    '''
+    left, dotExt = os.path.splitext(path)
+    if dotExt.lower() in MAGIC:
+        return left, dotExt
+    return path, ""
+
+
+def compression_of(path, detect=True):
+    '''
+    Get the compression extension (such as ".gz") of the file at path,
+    or None if it isn't compressed.
+
+    Keyword arguments:
+    detect -- If the extension isn't one of a compression, check the
+              start of the file (if it exists) for the magic bytes of
+              one.
+    '''
+    dotExt = split_compression(path)[1].lower()
+    if dotExt:
+        return dotExt
+    if (not detect) or (not os.path.isfile(path)):
+        return None
+    with open(path, 'rb') as stream:
+        start = stream.read(MAGIC_BYTES)
+    for dotExt, magic in MAGIC.items():
+        if start.startswith(magic):
+            return dotExt
+    return None
+
+
+def open_file(path, mode='r', like=None):
+    '''
+    Open path like open, but decompress it if it is compressed (See
+    compression_of) or, when writing, compress it if the extension is
+    that of a compression.
+
+    Sequential arguments:
+    mode -- 'r', 'w', 'rb' or 'wb'.
+
+    Keyword arguments:
+    like -- when writing .bgcode, copy the metadata and thumbnails of
+            this file if it is also .bgcode (See open_bgcode).
+    '''
+    if mode not in ('r', 'w', 'rb', 'wb'):
+        raise ValueError("mode must be 'r', 'w', 'rb' or 'wb'.")
+    dotExt = compression_of(path, detect=mode.startswith('r'))
+    if dotExt is None:
+        return open(path, mode)
+    if dotExt == ".bgcode":
+        return open_bgcode(path, mode, like=like)
+    if not mode.endswith('b'):
+        mode += 't'
+    if dotExt == ".gz":
+        return gzip.open(path, mode, compresslevel=GZIP_LEVEL)
+    if dotExt == ".xz":
+        return lzma.open(path, mode)
+    if zstd is None:
+        raise ValueError(
+            '"{}" is compressed with Zstandard, which requires Python 3.14'
+            ' or the zstandard package.'.format(path)
+        )
+    return zstd.open(path, mode)
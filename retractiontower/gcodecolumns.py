@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+'''
+Load the motion commands of a G-code file into NumPy arrays so that the
+extents and retractions can be found by vectorized operations instead
+of by a Python loop over GCodeCommand objects.
+
+NumPy is optional. It is only imported when this module is used, and
+GCodeColumns.Load raises ImportError if it is not installed.
+'''
+import sys
+
+from retractiontower.gcodecommand import GCodeCommand
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class GCodeColumns:
+    '''
+    One row for each G0, G1, G90 or G91 command of a file.
+
+    members:
+    Line -- the 0-based index of the row's line in the file
+    Code -- the number of the G command (0, 1, 90 or 91)
+    X, Y, Z, E, F -- the parameters (NaN if the command doesn't have
+                     the parameter)
+    LineCount -- the number of lines in the file
+    '''
+    ROW_COMMANDS = {"G0": 0, "G1": 1, "G90": 90, "G91": 91}
+    PARAMS = "XYZEF"
+
+    def __init__(self):
+        self.Line = None
+        self.Code = None
+        self.X = None
+        self.Y = None
+        self.Z = None
+        self.E = None
+        self.F = None
+        self.LineCount = 0
+        self._extents = None
+        self._retractions = {}
+
+    @classmethod
+    def Load(cls, stream, path=None):
+        '''
+        Read every line of stream and collect the columns.
+        '''
+        if np is None:
+            raise ImportError("The columnar loader requires NumPy"
+                              " (pip install numpy).")
+        rowCommands = cls.ROW_COMMANDS
+        params = cls.PARAMS
+        lines = []
+        codes = []
+        columns = {param: [] for param in params}
+        nan = float("nan")
+        line_n = 0
+        for line in stream:
+            line_n += 1
+            words = GCodeCommand.CodeWords(line)
+            # The command is the first word that has a number (See
+            #   GCodeCommand._classify).
+            start = 0
+            while (start < len(words)) and (len(words[start]) < 2):
+                start += 1
+            if start == len(words):
+                continue
+            first = words[start]
+            if first[0] != 'G':
+                continue
+            try:
+                code = rowCommands.get("G" + str(int(float(first[1:]))))
+                if code is None:
+                    continue
+                values = {}
+                for word in words[start+1:]:
+                    if len(word) < 2:
+                        continue
+                    value = float(word[1:])
+                    if word[0] not in values:
+                        # GetParameter uses the first one.
+                        values[word[0]] = value
+            except ValueError:
+                sys.stderr.write(
+                    '{}:{}: A non-float was found in "{}"\n'
+                    ''.format(path, line_n, line.rstrip("\n\r"))
+                )
+                sys.stderr.flush()
+                raise
+            lines.append(line_n - 1)
+            codes.append(code)
+            for param in params:
+                columns[param].append(values.get(param, nan))
+        result = cls()
+        result.LineCount = line_n
+        result.Line = np.array(lines, dtype=np.int64)
+        result.Code = np.array(codes, dtype=np.int16)
+        for param in params:
+            setattr(result, param, np.array(columns[param],
+                                            dtype=np.float64))
+        return result
+
+    @staticmethod
+    def _forwardFill(values, initial):
+        '''
+        Replace each NaN in values with the previous value that isn't
+        NaN, or with initial if there is no previous value.
+        '''
+        valid = ~np.isnan(values)
+        indices = np.where(valid, np.arange(len(values)), -1)
+        np.maximum.accumulate(indices, out=indices)
+        result = np.where(indices >= 0, values[np.maximum(indices, 0)],
+                          initial)
+        return result
+
+    def _motionMask(self):
+        return (self.Code == 0) | (self.Code == 1)
+
+    def CurrentZ(self):
+        '''
+        Get the Z position at each row (sys.float_info.min before the
+        first Z like in Program.TranslateCommands).
+        '''
+        z = np.where(self._motionMask(), self.Z, np.nan)
+        return GCodeColumns._forwardFill(z, sys.float_info.min)
+
+    def SetExtents(self, extents):
+        '''
+        Use extents that were already found (such as by TemplateCache)
+        instead of calculating them in Extents.
+        '''
+        self._extents = extents
+
+    def SetRetractions(self, firstTowerZ, retractions):
+        '''
+        Use retractions that were already found (such as by
+        TemplateCache) instead of finding them in Retractions.
+        '''
+        self._retractions[float(firstTowerZ)] = retractions
+
+    def Extents(self):
+        '''
+        Get the same extents as Program.MeasureGCode.
+        '''
+        if self._extents is not None:
+            return self._extents
+        from retractiontower import Extent
+        x = Extent()
+        y = Extent()
+        z = Extent()
+        x.From = y.From = z.From = sys.float_info.max
+        x.To = y.To = z.To = sys.float_info.min
+
+        g1 = self.Code == 1
+        for extent, column in ((x, self.X), (y, self.Y)):
+            values = column[g1 & ~np.isnan(column)]
+            if len(values):
+                extent.From = min(extent.From, float(values.min()))
+                extent.To = max(extent.To, float(values.max()))
+
+        # Only count Z where E is more than ever before (where the
+        #   filament is extruded) and Z is known.
+        currentZ = self.CurrentZ()
+        hasZ = currentZ != sys.float_info.min
+        candidates = self._motionMask() & ~np.isnan(self.E) & hasZ
+        e = np.where(candidates, self.E, -np.inf)
+        previousMax = np.empty_like(e)
+        if len(e):
+            previousMax[0] = sys.float_info.min
+            np.maximum(np.maximum.accumulate(e)[:-1], sys.float_info.min,
+                       out=previousMax[1:])
+        extruding = candidates & (e > previousMax)
+        values = currentZ[extruding]
+        if len(values):
+            z.From = min(z.From, float(values.min()))
+            z.To = max(z.To, float(values.max()))
+
+        class AnonymousClass:
+            pass
+        result = AnonymousClass()
+        result.X = x
+        result.Y = y
+        result.Z = z
+        result.Commands = None
+        self._extents = result
+        return result
+
+    def Retractions(self, firstTowerZ):
+        '''
+        Find the retractions that Program.TranslateCommands changes:
+        Any G0 or G1 at or above firstTowerZ where E is less than E of
+        the previous such command.
+
+        Returns:
+        a dict where each key is a 0-based line index and each value is
+        a (z, lastE, is_relative) tuple.
+        '''
+        retractions = self._retractions.get(float(firstTowerZ))
+        if retractions is not None:
+            return retractions
+        currentZ = self.CurrentZ()
+        candidates = (self._motionMask() & ~np.isnan(self.E)
+                      & (currentZ >= firstTowerZ))
+        rows = np.nonzero(candidates)[0]
+        e = self.E[rows]
+        lastE = np.empty_like(e)
+        if len(e):
+            lastE[0] = sys.float_info.min
+            lastE[1:] = e[:-1]
+        retracting = e < lastE
+        relative = np.where(self.Code == 91, 1.0,
+                            np.where(self.Code == 90, 0.0, np.nan))
+        # G90/G91 only affects the rows after it.
+        relative = np.concatenate(([np.nan], relative[:-1]))
+        relative = GCodeColumns._forwardFill(relative, 0.0)
+        rows = rows[retracting]
+        retractions = {
+            int(line): (float(z), float(last), bool(isRelative))
+            for line, z, last, isRelative in zip(
+                self.Line[rows], currentZ[rows], lastE[retracting],
+                relative[rows],
+            )
+        }
+        self._retractions[float(firstTowerZ)] = retractions
+        return retractions
+
+    def AnalyzeRetractions(self):
+        '''
+        Find the same retractions as Program.AnalyzeFile: Any G0 or G1
+        where E is less than the highest E so far.
+
+        Returns:
+        a list of (amount, z) tuples.
+        '''
+        rows = np.nonzero(self._motionMask() & ~np.isnan(self.E))[0]
+        e = self.E[rows]
+        previousMax = np.empty_like(e)
+        if len(e):
+            previousMax[0] = sys.float_info.min
+            np.maximum(np.maximum.accumulate(e)[:-1], sys.float_info.min,
+                       out=previousMax[1:])
+        retracting = e < previousMax
+        currentZ = self.CurrentZ()[rows]
+        return [
+            (float(last) - float(value), float(z))
+            for last, value, z in zip(previousMax[retracting],
+                                      e[retracting], currentZ[retracting])
+        ]
@@ -14,13 +14,98 @@ from retractiontower.commandcache import CommandCache
 
 
 class GCodeCommand:
-    def __init__(self, line, path=None, line_n=None):
-        self._line = line  # for debugging only
-        self._line_n = line_n  # for debugging only
-        self._path = path  # for debugging only
+    '''
+    Sequential arguments:
+    line -- one line of G-code (without the newline)
+
+    Keyword arguments:
+    path -- the file the line came from (only for error messages)
+    line_n -- the line number the line came from (only for error
+              messages). The path and line_n are only stored if either
+              is specified.
+    lazy -- Only classify the line (set Command, CommandType and
+            CommandNumber) using its first command word. The line is
+            split into parts only when a parameter is first accessed,
+            and ToString returns the original line byte-for-byte unless
+            SetParameter was called.
+    '''
+    __slots__ = ('_line', '_context', 'Command', 'CommandType',
+                 'CommandNumber', '_parts', '_verbatim')
+
+    def __init__(self, line, path=None, line_n=None, lazy=False):
+        self._line = line
+        self._context = None  # for debugging only
+        if (path is not None) or (line_n is not None):
+            self._context = (path, line_n)
         self.Command = None
         self.CommandType = None
         self.CommandNumber = None
+        self._parts = None
+        self._verbatim = lazy
+        if lazy:
+            self._classify()
+        else:
+            self._parse()
+
+    @property
+    def _path(self):
+        if self._context is None:
+            return None
+        return self._context[0]
+
+    @property
+    def _line_n(self):
+        if self._context is None:
+            return None
+        return self._context[1]
+
+    @staticmethod
+    def CodeWords(line):
+        '''
+        Get the whitespace-separated words of line (str or bytes)
+        before any comment.
+        '''
+        commentIndex, commentMark = GCodeCommandPart.commentStart(line)
+        if commentMark is not None:
+            line = line[:commentIndex]
+        return line.split()
+
+    def _classify(self):
+        '''
+        Set the command members without creating any parts. The command
+        is the first word that has a number (The first
+        CharacterAndNumber part if the line were parsed).
+        '''
+        for word in GCodeCommand.CodeWords(self._line):
+            if len(word) < 2:
+                continue
+            try:
+                number = float(word[1:])
+            except ValueError:
+                sys.stderr.write(
+                    '{}:{}: A non-float was found in "{}"\n'
+                    ''.format(self._path, self._line_n, self._line)
+                )
+                sys.stderr.flush()
+                raise
+            self._setCommand(word[0], number)
+            return
+
+    def _setCommand(self, commandType, number):
+        self.CommandType = commandType
+        self.CommandNumber = int(number)
+        try:
+            self.Command = CommandCache.Get(self.CommandType,
+                                            self.CommandNumber)
+        except Exception as e:
+            print("line: `{}`".format(self._line))
+            print("  parts: {}".format(self._parts))
+            raise e
+
+    def _parse(self):
+        line = self._line
+        path = self._path
+        line_n = self._line_n
         try:
             self._parts = list(GCodeCommandPart.ParseStringToParts(
                 line,
@@ -48,29 +133,34 @@ class GCodeCommand:
                         # if part.Character in GCodeCommandPart.F_PARAMS
                         part.Number = float(part.Number)
 
-        if firstPart is not None:
-            self.CommandType = firstPart.Character
-            self.CommandNumber = int(firstPart.Number)
-            try:
-                self.Command = CommandCache.Get(self.CommandType,
-                                                self.CommandNumber)
-            except Exception as e:
-                print("line: `{}`".format(line))
-                print("  parts: {}".format(self._parts))
-                raise e
+        if self.Command is not None:
+            # Lazy mode already classified the line.
+            pass
+        elif firstPart is not None:
+            self._setCommand(firstPart.Character, firstPart.Number)
         else:
             pass
             # if not GCodeCommandPart.isCommentAt(line, i):
             #     print("WARNING: There is no firstPart in `{}`"
             #           "".format(line))
 
+    def _getParts(self):
+        if self._parts is None:
+            self._parse()
+        return self._parts
+
     def ToString(self):
+        if self._verbatim:
+            return self._line
         result = ""
         for part in self._parts:
             result += str(part)
         return result
 
     def WriteTo(self, writer):
+        if self._verbatim:
+            writer.write(self._line)
+            return
         for part in self._parts:
             writer.write(part)
 
@@ -93,12 +183,36 @@ class GCodeCommand:
             raise Exception("Command does not have a parameter '{}'"
                             "".format(param))
         part.Number = value
+        self._verbatim = False
+
+    def AddParameter(self, param, value):
+        '''
+        Add param after the last parameter (or set it if the command
+        already has it).
+        '''
+        part = self.GetPartByCharacter(param)
+        if part is not None:
+            self.SetParameter(param, value)
+            return
+        index = 0
+        for i, part in enumerate(self._parts):
+            if part.Type == GCodeCommandPartType.CharacterAndNumber:
+                index = i + 1
+        self._parts[index:index] = [
+            GCodeCommandPart(Type=GCodeCommandPartType.Space, Number=1),
+            GCodeCommandPart(
+                Type=GCodeCommandPartType.CharacterAndNumber,
+                Character=param,
+                Number=float(value),
+            ),
+        ]
+        self._verbatim = False
 
     def GetPartByCharacter(self, param):
         if len(param) != 1:
             raise ValueError("The param must be a character but is"
                              " \"{}\".".format(param))
-        for part in self._parts:
+        for part in self._getParts():
             if ((part.Type == GCodeCommandPartType.CharacterAndNumber)
                     and (part.Character == param)):
                 return part
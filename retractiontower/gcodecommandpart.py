@@ -5,19 +5,24 @@
 # from System.Collections.Generic import *
 # from System.IO import *
 # from System.Text import *
+import re
 import sys
 
 from retractiontower.gcodecommandparttype import GCodeCommandPartType
 from retractiontower.spacestring import SpaceString
+from retractiontower.numberformat import NumberFormatter
 from retractiontower.fxshim import (
     IsWhiteSpace,
     decimal_Parse,
-    NumberToStr,
     IsNullOrWhiteSpace,
     optionalD,
 )
 
 
+_SPACE_SPLITTER = re.compile(r"(\s+)")
+_LEADING_SPACE = re.compile(r"\s*")
+
+
 class GCodeCommandPart:
     '''
     public members:
@@ -31,14 +36,21 @@ class GCodeCommandPart:
             GCodeCommandPartType.Comment
     '''
     COMMENT_MARKS = [';', '//']
+    COMMENT_MARK_BYTES = [b';', b'//']  # COMMENT_MARKS for bytes lines
     F_PARAMS = "XY"  # ZE"  # always convert to float
+    # How F_PARAMS are written (Set it to NumberFormatter(places,
+    #   fixed=True) to always write the same number of places)
+    Formatter = NumberFormatter(3)
+    # Every token of every line is a part, so avoid a __dict__ for each.
+    __slots__ = ('Type', 'Character', 'Number', 'Text', 'CommentMark')
 
-    def __init__(self, **kwargs):
-        self.Type = kwargs.get("Type")
-        self.Character = kwargs.get("Character")
-        self.Number = kwargs.get("Number")
-        self.Text = kwargs.get("Text")
-        self.CommentMark = kwargs.get("CommentMark")
+    def __init__(self, Type=None, Character=None, Number=None, Text=None,
+                 CommentMark=None):
+        self.Type = Type
+        self.Character = Character
+        self.Number = Number
+        self.Text = Text
+        self.CommentMark = CommentMark
 
     def __str__(self):
         return self.ToString()
@@ -52,8 +64,9 @@ class GCodeCommandPart:
             return SpaceString.OfLength(self.Number)
         elif self.Type == GCodeCommandPartType.CharacterAndNumber:
             if self.Character in GCodeCommandPart.F_PARAMS:
-                return self.Character + optionalD(float(self.Number), 3).format(float(self.Number))
-            return self.Character + NumberToStr(self.Number)
+                return (self.Character
+                        + GCodeCommandPart.Formatter.Coordinate(self.Number))
+            return self.Character + NumberFormatter.Number(self.Number)
         elif self.Type == GCodeCommandPartType.Character:
             return self.Character
         elif self.Type == GCodeCommandPartType.Comment:
@@ -77,7 +90,9 @@ class GCodeCommandPart:
             # writer.write(
             #     ("{:."+str(want_figures)+"g}").format(self.Number)
             # )
-            writer.write(optionalD(self.Number, want_decimals).format(self.Number))
+            writer.write(
+                optionalD(self.Number, want_decimals).format(self.Number)
+            )
             # writer.write("%.5g" % self.Number)
             # ^ The format was "##0.#####" (# is optional) in C#
             #   (don't use g since though g makes decimals optional,
@@ -110,8 +125,157 @@ class GCodeCommandPart:
         '''
         return GCodeCommandPart.commentMarkAt(line, i) is not None
 
+    @staticmethod
+    def commentStart(line):
+        '''
+        Get the index of the first comment mark in line (str or bytes)
+        and the mark itself as a tuple, or (-1, None) if line has no
+        comment.
+        '''
+        start = -1
+        mark = None
+        marks = GCodeCommandPart.COMMENT_MARKS
+        if isinstance(line, bytes):
+            marks = GCodeCommandPart.COMMENT_MARK_BYTES
+        for cm in marks:
+            i = line.find(cm)
+            if (i > -1) and ((start < 0) or (i < start)):
+                start = i
+                mark = cm
+        return start, mark
+
+    @staticmethod
+    def _wordToPart(word, line, path=None, line_n=None):
+        '''
+        Convert one whitespace-delimited word (without any comment) to a
+        Character or CharacterAndNumber part.
+        '''
+        if len(word) == 1:
+            return GCodeCommandPart(GCodeCommandPartType.Character, word)
+        try:
+            number = float(word[1:])
+        except ValueError:
+            print(
+                "{}:{}: Error parsing line: `{}` substring `{}`"
+                "".format(path, line_n, line, word[1:])
+            )
+            raise
+        return GCodeCommandPart(GCodeCommandPartType.CharacterAndNumber,
+                                word[0], number)
+
     @staticmethod
     def ParseStringToParts(line, path=None, line_n=None):
+        '''
+        Split line into a list of GCodeCommandPart objects.
+
+        Instead of visiting each character, find the comment using
+        str.find then split the rest at whitespace using str.split (or
+        a compiled regex if the whitespace is not single spaces), so
+        each line only takes a few C-level string operations. The
+        result is the same as that of ParseStringToPartsPerChar.
+        '''
+        commentIndex, commentMark = GCodeCommandPart.commentStart(line)
+        if commentMark is not None:
+            code = line[:commentIndex]
+        else:
+            code = line
+        words = code.split()
+        results = []
+        if not words:
+            if code:
+                results.append(GCodeCommandPart(GCodeCommandPartType.Space,
+                                                Number=len(code)))
+        else:
+            wordToPart = GCodeCommandPart._wordToPart
+            first = wordToPart(words[0], line, path, line_n)
+            if ((first.Character == 'M')
+                    and ((first.Number == 117) or (first.Number == 118))):
+                end = line.index(words[0]) + len(words[0])
+                if end < len(line):
+                    # Return remainder of line (even if it contains a
+                    #   comment mark) as a single text block. The
+                    #   character after the command always counts as a
+                    #   space, as in ParseStringToPartsPerChar.
+                    if end > len(words[0]):
+                        results.append(GCodeCommandPart(
+                            GCodeCommandPartType.Space,
+                            Number=end - len(words[0]),
+                        ))
+                    results.append(first)
+                    space = _LEADING_SPACE.match(line, end + 1)
+                    results.append(GCodeCommandPart(
+                        GCodeCommandPartType.Space,
+                        Number=1 + len(space.group()),
+                    ))
+                    if space.end() < len(line):
+                        results.append(GCodeCommandPart(
+                            GCodeCommandPartType.Text,
+                            Text=line[space.end():],
+                        ))
+                    return results
+            if " ".join(words) == code:
+                # Only single spaces separate words (the usual case).
+                # _wordToPart is inlined here since this is the hot path.
+                append = results.append
+                append(first)
+                for word in words[1:]:
+                    append(GCodeCommandPart(GCodeCommandPartType.Space,
+                                            None, 1))
+                    if len(word) == 1:
+                        append(GCodeCommandPart(
+                            GCodeCommandPartType.Character,
+                            word,
+                        ))
+                        continue
+                    try:
+                        number = float(word[1:])
+                    except ValueError:
+                        print(
+                            "{}:{}: Error parsing line: `{}` substring `{}`"
+                            "".format(path, line_n, line, word[1:])
+                        )
+                        raise
+                    append(GCodeCommandPart(
+                        GCodeCommandPartType.CharacterAndNumber,
+                        word[0],
+                        number,
+                    ))
+            else:
+                # The regex has a group, so split keeps the whitespace:
+                #   Even indices are words (or '' at either end) and odd
+                #   indices are whitespace.
+                tokens = _SPACE_SPLITTER.split(code)
+                for i in range(len(tokens)):
+                    token = tokens[i]
+                    if i % 2 == 1:
+                        results.append(GCodeCommandPart(
+                            GCodeCommandPartType.Space,
+                            Number=len(token),
+                        ))
+                    elif first is not None:
+                        if token:
+                            results.append(first)
+                            first = None
+                    elif token:
+                        results.append(wordToPart(token, line, path,
+                                                  line_n))
+
+        if commentMark is not None:
+            results.append(GCodeCommandPart(
+                GCodeCommandPartType.Comment,
+                Text=line[commentIndex + len(commentMark):],
+                CommentMark=commentMark,
+            ))
+        return results
+
+    @staticmethod
+    def ParseStringToPartsPerChar(line, path=None, line_n=None):
+        '''
+        Yield the parts of line by visiting one character at a time.
+        This is the original tokenizer. It is much slower than
+        ParseStringToParts, so it is only kept as a reference for tests
+        and benchmarks.
+        '''
         results = []
         isFirstPart = True
         index = 0
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+'''
+Convert the numbers of G-code parameters to text as fast as possible
+while producing the same text as fxshim.optionalD and
+fxshim.NumberToStr (See RetractionTest.expected.optionalD.gcode in
+retractiontower/tests/data).
+'''
+
+
+class NumberFormatter:
+    '''
+    Format coordinates like optionalD(n, Decimals).format(n), which
+    allows Decimals places after the number of characters in
+    str(int(n)) (so a minus sign or a leading "0" allows one more
+    place), without building a new format string for each number.
+
+    members:
+    Decimals -- the number of decimal places (See optionalD)
+    Fixed -- If True, always write exactly Decimals places (such as
+             "1.500" instead of "1.5").
+    '''
+    # Don't keep a format spec for every integer part of unusual
+    #   numbers.
+    SPEC_CACHE_LIMIT = 100000
+    # The same X and Y values occur on every layer of a tower, so keep
+    #   the text of this many recent values.
+    TEXT_CACHE_LIMIT = 65536
+
+    def __init__(self, decimals=3, fixed=False):
+        self.Decimals = decimals
+        self.Fixed = fixed
+        self._specs = {}
+        self._texts = {}
+        self._fixedSpec = ".{}f".format(decimals)
+
+    def _spec(self, whole):
+        '''
+        Get the format spec for a number where whole is int(n).
+        '''
+        spec = self._specs.get(whole)
+        if spec is None:
+            spec = ".{}g".format(self.Decimals + len(str(whole)))
+            if -NumberFormatter.SPEC_CACHE_LIMIT < whole \
+                    < NumberFormatter.SPEC_CACHE_LIMIT:
+                self._specs[whole] = spec
+        return spec
+
+    def Coordinate(self, n):
+        '''
+        Get n as text (n must be a float or int).
+        '''
+        if self.Fixed:
+            return format(n, self._fixedSpec)
+        text = self._texts.get(n)
+        if text is not None:
+            return text
+        whole = int(n)
+        if (whole == n) and (whole != 0):
+            # The g format would drop the decimal point anyway.
+            text = str(whole)
+        else:
+            text = format(float(n), self._spec(whole))
+            if n == 0:
+                # 0.0 and -0.0 are the same key but not the same text.
+                return text
+        if len(self._texts) >= NumberFormatter.TEXT_CACHE_LIMIT:
+            self._texts.clear()
+        self._texts[n] = text
+        return text
+
+    @staticmethod
+    def Number(n):
+        '''
+        Get n as text the same way as fxshim.NumberToStr (A float
+        without a fractional part has no decimal point).
+        '''
+        if isinstance(n, float) and n.is_integer():
+            return str(int(n))
+        return str(n)
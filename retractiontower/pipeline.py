@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+'''
+Overlap reading the template and writing the output with translating it
+(See Program.Generate with pipelined=True). A LineReader reads batches
+of lines in one thread and a ThreadedWriter writes the chunks from
+GCodeWriter in another, while the calling thread parses and translates.
+Each is connected to the calling thread by a bounded queue, so memory
+stays limited if one stage is slower than the others.
+'''
+import queue
+import threading
+
+
+class LineReader:
+    '''
+    Read lines from stream in a thread. It can be used in place of
+    stream by anything that only calls readline (such as
+    Program.ReadCommands).
+
+    Sequential arguments:
+    stream -- a text stream such as from open (It is closed by close).
+
+    Keyword arguments:
+    batch_characters -- about how many characters to read at once
+                        (See io.IOBase.readlines).
+    max_batches -- how many batches may wait to be used.
+    '''
+    BATCH_CHARACTERS = 1024 * 1024
+    MAX_BATCHES = 4
+
+    def __init__(self, stream, batch_characters=None, max_batches=None):
+        if batch_characters is None:
+            batch_characters = LineReader.BATCH_CHARACTERS
+        if max_batches is None:
+            max_batches = LineReader.MAX_BATCHES
+        self._stream = stream
+        self._batchCharacters = batch_characters
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._stop = threading.Event()
+        self._lines = []
+        self._index = 0
+        self._done = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                lines = self._stream.readlines(self._batchCharacters)
+                self._queue.put(lines)
+                if not lines:
+                    break
+        except Exception as ex:
+            self._queue.put(ex)
+            # ^ raised by readline in the calling thread
+
+    def readline(self):
+        '''
+        Get the next line including the newline, or "" at the end of
+        the stream.
+        '''
+        if self._index >= len(self._lines):
+            if self._done:
+                return ""
+            batch = self._queue.get()
+            if isinstance(batch, Exception):
+                self._done = True
+                raise batch
+            if not batch:
+                self._done = True
+                return ""
+            self._lines = batch
+            self._index = 0
+        line = self._lines[self._index]
+        self._index += 1
+        return line
+
+    def close(self):
+        '''
+        Stop the thread (even if not every line was read) then close
+        the stream.
+        '''
+        if self._thread is not None:
+            self._stop.set()
+            while self._thread.is_alive():
+                # Make room in case the thread is waiting to add a batch.
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._thread.join()
+            self._thread = None
+        self._lines = []
+        self._stream.close()
+
+
+class ThreadedWriter:
+    '''
+    Write to underlying in a thread. It is a binary stream as far as
+    GCodeWriter is concerned, so underlying must be binary.
+
+    Sequential arguments:
+    underlying -- a binary stream such as from open(path, 'wb') (It is
+                  closed by close).
+
+    Keyword arguments:
+    max_chunks -- how many written chunks may wait to be written to
+                  underlying before write waits for the thread.
+    '''
+    MAX_CHUNKS = 16
+
+    def __init__(self, underlying, max_chunks=None):
+        if max_chunks is None:
+            max_chunks = ThreadedWriter.MAX_CHUNKS
+        self._underlying = underlying
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error is not None:
+                # Keep taking chunks so write never waits forever.
+                continue
+            try:
+                self._underlying.write(data)
+            except Exception as ex:
+                self._error = ex
+
+    def write(self, data):
+        '''
+        Queue data (bytes, or a memoryview that stays valid until close)
+        to be written. An error from an earlier write is raised here.
+        '''
+        if self._error is not None:
+            raise self._error
+        self._queue.put(data)
+        return len(data)
+
+    def close(self):
+        '''
+        Wait for the queued chunks to be written then close underlying.
+        An error from writing them is raised here.
+        '''
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._underlying.close()
+        if self._error is not None:
+            raise self._error
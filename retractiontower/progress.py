@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+'''
+Show how far translating the template has gotten (See
+Program.TranslateVariants), and let an application that uses
+retractiontower get the same information with a callback.
+'''
+import sys
+import time
+
+
+class Progress:
+    '''
+    Track the lines translated so far and, at most once per interval,
+    redraw a status line such as
+    " 42% 120000 lines 85000 lines/s ETA 0:03" and call callback.
+
+    Keyword arguments:
+    total_bytes -- the size of the template.
+    total_lines -- the number of lines in the template, used for the
+                   percentage if there is no byte position.
+    tell -- a function that gets the byte position in the template
+            (such as the tell method of the binary stream under the
+            text reader), if Update doesn't get a position.
+    stream -- where to draw (default: sys.stdout). Nothing is drawn
+              unless it is a terminal.
+    interval -- the least number of seconds between redraws.
+    callback -- a function to call with a dict like Info instead of (or
+                in addition to) drawing.
+    '''
+    INTERVAL = 0.1
+
+    def __init__(self, total_bytes=None, total_lines=None, tell=None,
+                 stream=None, interval=None, callback=None):
+        if stream is None:
+            stream = sys.stdout
+        if interval is None:
+            interval = Progress.INTERVAL
+        self.TotalBytes = total_bytes
+        self.TotalLines = total_lines
+        self.Tell = tell
+        self._stream = stream
+        self._interval = interval
+        self._callback = callback
+        isatty = getattr(stream, "isatty", None)
+        self.Drawing = (isatty is not None) and isatty()
+        self._start = time.perf_counter()
+        self._last = self._start
+        self._width = 0
+
+    @staticmethod
+    def IsNeeded(stream=None, callback=None):
+        '''
+        Check whether a Progress would do anything (so the caller can
+        skip making one).
+        '''
+        if callback is not None:
+            return True
+        if stream is None:
+            stream = sys.stdout
+        isatty = getattr(stream, "isatty", None)
+        return (isatty is not None) and isatty()
+
+    def Info(self, lines, position=None, done=False):
+        '''
+        Get a dict with 'lines', 'bytes' (the position, or None),
+        'fraction' (0 to 1, or None if the totals are unknown),
+        'seconds' (since the Progress was made), 'lines_per_second',
+        'eta_seconds' (or None) and 'done'.
+        '''
+        seconds = time.perf_counter() - self._start
+        fraction = None
+        if done:
+            fraction = 1.0
+        elif (position is not None) and self.TotalBytes:
+            fraction = min(position / self.TotalBytes, 1.0)
+        elif self.TotalLines:
+            fraction = min(lines / self.TotalLines, 1.0)
+        linesPerSecond = None
+        if seconds > 0:
+            linesPerSecond = lines / seconds
+        eta = None
+        if fraction:
+            eta = seconds / fraction - seconds
+        return {
+            'lines': lines,
+            'bytes': position,
+            'fraction': fraction,
+            'seconds': seconds,
+            'lines_per_second': linesPerSecond,
+            'eta_seconds': eta,
+            'done': done,
+        }
+
+    def Update(self, lines, position=None):
+        '''
+        Redraw and call the callback if the interval has passed.
+
+        Sequential arguments:
+        lines -- the number of lines translated so far.
+
+        Keyword arguments:
+        position -- the byte position in the template (otherwise tell
+                    is used if set).
+        '''
+        now = time.perf_counter()
+        if now - self._last < self._interval:
+            return
+        self._last = now
+        if (position is None) and (self.Tell is not None):
+            position = self.Tell()
+        info = self.Info(lines, position=position)
+        if self._callback is not None:
+            self._callback(info)
+        if self.Drawing:
+            self._draw(info)
+
+    def Finish(self, lines, position=None):
+        '''
+        Call the callback one last time with 'done' True, and erase
+        the status line so that the output after it is the same as
+        without Progress.
+        '''
+        info = self.Info(lines, position=position, done=True)
+        if self._callback is not None:
+            self._callback(info)
+        if self.Drawing and (self._width > 0):
+            self._stream.write("\r" + " " * self._width + "\r")
+            self._stream.flush()
+            self._width = 0
+
+    @staticmethod
+    def FormatSeconds(seconds):
+        minutes, seconds = divmod(int(seconds + .5), 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours > 0:
+            return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+        return "{}:{:02}".format(minutes, seconds)
+
+    def _draw(self, info):
+        text = ""
+        if info['fraction'] is not None:
+            text += "{:>3.0f}% ".format(info['fraction'] * 100)
+        text += "{} lines".format(info['lines'])
+        if info['lines_per_second'] is not None:
+            text += " {:.0f} lines/s".format(info['lines_per_second'])
+        if info['eta_seconds'] is not None:
+            text += " ETA " + Progress.FormatSeconds(info['eta_seconds'])
+        # Pad with spaces to erase the end of a longer previous line.
+        self._stream.write("\r" + text.ljust(self._width))
+        self._stream.flush()
+        self._width = max(self._width, len(text))
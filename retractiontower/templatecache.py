@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+'''
+Keep what is found by parsing a template (its GCodeColumns, extents and
+retractions) on disk so that later runs with the same template can load
+it instead of parsing every line again.
+
+Each entry is an uncompressed NumPy .npz file named by the SHA-256 of the
+template and the parser version, so an edited template or a new parser
+never gets an old entry. When the entries exceed MaxBytes, the least
+recently used ones are deleted.
+'''
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zipfile
+
+from retractiontower.gcodecolumns import GCodeColumns
+from retractiontower.compressedfile import open_file
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TemplateCache:
+    '''
+    members:
+    Directory -- where the entries are stored
+    MaxBytes -- the most bytes that all entries together may use
+    '''
+    # Increase this whenever a change to GCodeColumns.Load (or to what
+    #   is stored here) would produce different data for the same file.
+    PARSER_VERSION = 1
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+    EXTENSION = ".npz"
+    HASH_CHUNK_BYTES = 1024 * 1024
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = TemplateCache.DefaultDirectory()
+        if max_bytes is None:
+            max_bytes = TemplateCache.DEFAULT_MAX_BYTES
+        self.Directory = directory
+        self.MaxBytes = max_bytes
+
+    @staticmethod
+    def DefaultDirectory():
+        '''
+        Get ~/.cache/retractiontower (or the retractiontower directory
+        in XDG_CACHE_HOME if set).
+        '''
+        cacheHome = os.environ.get("XDG_CACHE_HOME")
+        if not cacheHome:
+            cacheHome = os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(cacheHome, "retractiontower")
+
+    @staticmethod
+    def IsAvailable():
+        '''
+        The cache stores GCodeColumns, so it is only available if NumPy
+        is installed.
+        '''
+        return np is not None
+
+    @staticmethod
+    def Key(path):
+        '''
+        Get the name of the entry for the file at path.
+        '''
+        digest = hashlib.sha256()
+        with open(path, 'rb') as stream:
+            while True:
+                chunk = stream.read(TemplateCache.HASH_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return "{}-v{}".format(digest.hexdigest(),
+                               TemplateCache.PARSER_VERSION)
+
+    def _entryPath(self, key):
+        return os.path.join(self.Directory, key + TemplateCache.EXTENSION)
+
+    def GetColumns(self, path, firstTowerZ=None):
+        '''
+        Get the GCodeColumns of the file at path from the cache, or load
+        them and store them in the cache.
+
+        Keyword arguments:
+        firstTowerZ -- Also store the retractions above this height
+                       (See GCodeColumns.Retractions).
+        '''
+        key = TemplateCache.Key(path)
+        columns = self.Load(key)
+        if columns is None:
+            with open_file(path, 'r') as stream:
+                columns = GCodeColumns.Load(stream, path=path)
+            self.Store(key, columns, firstTowerZ=firstTowerZ)
+        return columns
+
+    def Load(self, key):
+        '''
+        Get the GCodeColumns stored as key, or None if there is no such
+        entry (or it can't be read).
+        '''
+        entryPath = self._entryPath(key)
+        if not os.path.isfile(entryPath):
+            return None
+        try:
+            with np.load(entryPath, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['parser_version'] != TemplateCache.PARSER_VERSION:
+                    return None
+                columns = GCodeColumns()
+                columns.LineCount = meta['line_count']
+                columns.Line = data['Line']
+                columns.Code = data['Code']
+                for param in GCodeColumns.PARAMS:
+                    setattr(columns, param, data[param])
+                columns.SetExtents(TemplateCache._extentsFromMeta(
+                    meta['extents']
+                ))
+                firstTowerZ = meta['retractions_first_tower_z']
+                if firstTowerZ is not None:
+                    columns.SetRetractions(firstTowerZ, {
+                        int(line): (float(z), float(lastE), bool(relative))
+                        for line, z, lastE, relative in zip(
+                            data['retraction_line'], data['retraction_z'],
+                            data['retraction_last_e'],
+                            data['retraction_relative'],
+                        )
+                    })
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as ex:
+            sys.stderr.write('Warning: The cache entry "{}" was skipped'
+                             ' since it could not be read: {}\n'
+                             ''.format(entryPath, ex))
+            sys.stderr.flush()
+            return None
+        try:
+            os.utime(entryPath, None)
+            # ^ Mark it as recently used (See Evict).
+        except OSError:
+            pass
+        return columns
+
+    def Store(self, key, columns, firstTowerZ=None):
+        '''
+        Save columns as the entry for key, then evict old entries if
+        the cache is too big. Errors are shown as warnings since the
+        cache is only an optimization.
+
+        Keyword arguments:
+        firstTowerZ -- Also store the retractions above this height.
+        '''
+        extents = columns.Extents()
+        meta = {
+            'parser_version': TemplateCache.PARSER_VERSION,
+            'line_count': columns.LineCount,
+            'extents': {
+                axis: [getattr(extents, axis).From,
+                       getattr(extents, axis).To]
+                for axis in "XYZ"
+            },
+            'retractions_first_tower_z': firstTowerZ,
+        }
+        arrays = {
+            'Line': columns.Line,
+            'Code': columns.Code,
+        }
+        for param in GCodeColumns.PARAMS:
+            arrays[param] = getattr(columns, param)
+        if firstTowerZ is not None:
+            events = sorted(columns.Retractions(firstTowerZ).items())
+            arrays['retraction_line'] = np.array(
+                [line for line, event in events], dtype=np.int64
+            )
+            for name, index, dtype in (('retraction_z', 0, np.float64),
+                                       ('retraction_last_e', 1, np.float64),
+                                       ('retraction_relative', 2, np.bool_)):
+                arrays[name] = np.array(
+                    [event[index] for line, event in events], dtype=dtype
+                )
+        tmpPath = None
+        try:
+            os.makedirs(self.Directory, exist_ok=True)
+            fd, tmpPath = tempfile.mkstemp(dir=self.Directory,
+                                           suffix=".tmp")
+            with os.fdopen(fd, 'wb') as stream:
+                np.savez(stream, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmpPath, self._entryPath(key))
+            tmpPath = None
+            self.Evict()
+        except OSError as ex:
+            sys.stderr.write('Warning: The template could not be cached'
+                             ' in "{}": {}\n'.format(self.Directory, ex))
+            sys.stderr.flush()
+        finally:
+            if tmpPath is not None:
+                os.remove(tmpPath)
+
+    def Evict(self):
+        '''
+        Delete the least recently used entries until the rest fit in
+        MaxBytes.
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.Directory):
+            if not name.endswith(TemplateCache.EXTENSION):
+                continue
+            path = os.path.join(self.Directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+            total += stat.st_size
+        entries.sort()
+        for mtime, path, size in entries:
+            if total <= self.MaxBytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another process (such as from /batch) may have
+                #   removed it already.
+                pass
+            total -= size
+
+    @staticmethod
+    def _extentsFromMeta(values):
+        from retractiontower import Extent
+
+        class AnonymousClass:
+            pass
+        result = AnonymousClass()
+        for axis in "XYZ":
+            extent = Extent()
+            extent.From, extent.To = values[axis]
+            setattr(result, axis, extent)
+        result.Commands = None
+        return result
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+'''
+Generate a synthetic template like those that Cura writes for the
+retraction test towers (See tests/data), but with any number of
+towers, perimeters and layers, so that the processing of very large
+templates can be tested.
+
+Usage:
+python -m retractiontower.templategenerator <path> [options]
+
+Options:
+--layers <n>          the number of layers (default 80)
+--layer-height <mm>   the height of each layer after the first
+                      (default 0.2)
+--towers <n>          the number of towers (default 4)
+--perimeters <n>      the number of walls of each tower (default 2)
+--size <bytes>        Add layers until the file is about this size
+                      (instead of --layers). The size may end with K,
+                      M or G such as 1G.
+--seed <n>            the seed for the random seam of each wall, so the
+                      same options always generate the same file
+                      (default 0)
+'''
+import math
+import os
+import random
+import sys
+
+
+def _number(value, places):
+    '''
+    Get value with up to places decimal places but no trailing zeros,
+    the way Cura writes numbers.
+    '''
+    text = "{:.{}f}".format(value, places)
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    if text == "-0":
+        text = "0"
+    return text
+
+
+class TemplateGenerator:
+    '''
+    Keyword arguments (each is also a member with a CamelCase name):
+    layers -- the number of layers
+    layer_height -- the height of each layer after the first
+    towers -- the number of towers (arranged in a grid)
+    perimeters -- the number of walls of each tower
+    seed -- the seed for the random choices (such as seams)
+    target_bytes -- If not None, choose the number of layers so the
+                    file is about this size.
+    messages -- Write M117 at each layer and M118 at the start and end
+                (Cura doesn't, but other slicers and plugins do).
+    '''
+    FLAVOR = "Marlin"
+    FIRST_LAYER_HEIGHT = 0.3
+    LINE_WIDTH = 0.4
+    FILAMENT_DIAMETER = 1.75
+    RETRACTION = 3.0
+    RADIUS = 5.0  # of the outer wall of each tower
+    SEGMENTS = 48  # straight moves around each wall
+    SPACING = 20.0  # between the middles of the towers
+    CENTER = (117.5, 117.5)
+    SKIRT_DISTANCE = 3.0
+    MESH = "Synthetic Retraction Towers.stl"
+
+    def __init__(self, layers=80, layer_height=0.2, towers=4, perimeters=2,
+                 seed=0, target_bytes=None, messages=True):
+        if layers < 1:
+            raise ValueError("There must be at least 1 layer.")
+        if towers < 1:
+            raise ValueError("There must be at least 1 tower.")
+        if perimeters < 1:
+            raise ValueError("There must be at least 1 perimeter.")
+        if perimeters * TemplateGenerator.LINE_WIDTH \
+                >= TemplateGenerator.RADIUS:
+            raise ValueError("There can't be {} perimeters in a radius of"
+                             " {} mm.".format(perimeters,
+                                              TemplateGenerator.RADIUS))
+        self.Layers = layers
+        self.LayerHeight = layer_height
+        self.Towers = towers
+        self.Perimeters = perimeters
+        self.Seed = seed
+        self.TargetBytes = target_bytes
+        self.Messages = messages
+        columns = int(math.ceil(math.sqrt(towers)))
+        rows = int(math.ceil(towers / columns))
+        self._middles = []
+        for tower in range(towers):
+            row, column = divmod(tower, columns)
+            self._middles.append((
+                TemplateGenerator.CENTER[0]
+                + (column - (columns - 1) / 2.0) * TemplateGenerator.SPACING,
+                TemplateGenerator.CENTER[1]
+                + (row - (rows - 1) / 2.0) * TemplateGenerator.SPACING,
+            ))
+        self._filamentArea = math.pi * (TemplateGenerator.FILAMENT_DIAMETER
+                                        / 2.0) ** 2
+
+    def LayerZ(self, layer):
+        return (TemplateGenerator.FIRST_LAYER_HEIGHT
+                + layer * self.LayerHeight)
+
+    def Extents(self):
+        '''
+        Get the ((minX, maxX), (minY, maxY), (minZ, maxZ)) of the towers
+        (as written in the header like Cura, which doesn't include the
+        start G-code).
+        '''
+        radius = TemplateGenerator.RADIUS + TemplateGenerator.SKIRT_DISTANCE
+        xs = [x for x, y in self._middles]
+        ys = [y for x, y in self._middles]
+        return (
+            (min(xs) - radius, max(xs) + radius),
+            (min(ys) - radius, max(ys) + radius),
+            (self.LayerZ(0), self.LayerZ(self.Layers - 1)),
+        )
+
+    def _wall(self, lines, state, middle, radius, angle, feedrate):
+        '''
+        Add the moves around one wall starting at angle. The state is a
+        dict with the current 'e' and 'height' (of the layer).
+        '''
+        ePerMM = (TemplateGenerator.LINE_WIDTH * state['height']
+                  / self._filamentArea)
+        step = 2.0 * math.pi / TemplateGenerator.SEGMENTS
+        segment = 2.0 * radius * math.sin(step / 2.0)
+        for index in range(1, TemplateGenerator.SEGMENTS + 1):
+            theta = angle + index * step
+            state['e'] += segment * ePerMM
+            line = "G1 X{} Y{} E{}".format(
+                _number(middle[0] + radius * math.cos(theta), 3),
+                _number(middle[1] + radius * math.sin(theta), 3),
+                _number(state['e'], 5),
+            )
+            if index == 1:
+                line = "G1 F{} {}".format(feedrate, line[3:])
+            lines.append(line)
+
+    def _layer(self, layer, state, generator):
+        '''
+        Get the lines of one layer.
+        '''
+        lines = [";LAYER:{}".format(layer)]
+        if self.Messages:
+            lines.append("M117 Layer {}/{}".format(layer + 1, self.Layers))
+        if layer == 0:
+            lines.append("M107")
+            state['height'] = TemplateGenerator.FIRST_LAYER_HEIGHT
+        else:
+            state['height'] = self.LayerHeight
+            if layer <= 2:
+                lines.append("M106 S{}".format(85 * layer))
+        z = _number(self.LayerZ(layer), 3)
+        retracted = state['retracted']
+        if layer == 0:
+            (minX, maxX), (minY, maxY), zs = self.Extents()
+            lines.append("G0 F6000 X{} Y{} Z{}".format(
+                _number(minX, 3), _number(minY, 3), z))
+            lines.append(";TYPE:SKIRT")
+            lines.append("G1 F2400 E{}".format(_number(state['e'], 5)))
+            ePerMM = (TemplateGenerator.LINE_WIDTH * state['height']
+                      / self._filamentArea)
+            corners = [(maxX, minY), (maxX, maxY), (minX, maxY), (minX, minY)]
+            previous = (minX, minY)
+            for index, corner in enumerate(corners):
+                state['e'] += math.hypot(corner[0] - previous[0],
+                                         corner[1] - previous[1]) * ePerMM
+                lines.append("G1 {}X{} Y{} E{}".format(
+                    "F1800 " if index == 0 else "",
+                    _number(corner[0], 3), _number(corner[1], 3),
+                    _number(state['e'], 5),
+                ))
+                previous = corner
+            retracted = False
+        for tower, middle in enumerate(self._middles):
+            angle = generator.uniform(0.0, 2.0 * math.pi)
+            # ^ a random seam like Cura's "shortest" seam on a cylinder
+            for perimeter in range(self.Perimeters):
+                radius = (TemplateGenerator.RADIUS
+                          - (self.Perimeters - 1 - perimeter)
+                          * TemplateGenerator.LINE_WIDTH)
+                startX = _number(middle[0] + radius * math.cos(angle), 3)
+                startY = _number(middle[1] + radius * math.sin(angle), 3)
+                if perimeter == 0:
+                    if not retracted:
+                        lines.append("G1 F2400 E{}".format(_number(
+                            state['e'] - TemplateGenerator.RETRACTION, 5
+                        )))
+                    if state['z'] != z:
+                        lines.append("G0 F3000 X{} Y{} Z{}".format(
+                            startX, startY, z))
+                        state['z'] = z
+                    else:
+                        lines.append("G0 F3000 X{} Y{}".format(startX,
+                                                               startY))
+                    if tower == 0:
+                        lines.append(";TYPE:WALL-INNER")
+                        lines.append(";MESH:" + TemplateGenerator.MESH)
+                    lines.append("G1 F2400 E{}".format(_number(state['e'],
+                                                               5)))
+                    retracted = False
+                else:
+                    lines.append("G0 F3000 X{} Y{}".format(startX, startY))
+                if perimeter == self.Perimeters - 1:
+                    lines.append(";TYPE:WALL-OUTER")
+                self._wall(lines, state, middle, radius, angle,
+                           600 if layer > 0 else 1200)
+        state['retracted'] = retracted
+        state['seconds'] += (len(lines) * 0.05)
+        lines.append(";TIME_ELAPSED:{:.6f}".format(state['seconds']))
+        return lines
+
+    def _filamentUsed(self, layers):
+        '''
+        Estimate the meters of filament (for the header).
+        '''
+        wallsLength = sum(
+            2.0 * math.pi * (TemplateGenerator.RADIUS
+                             - perimeter * TemplateGenerator.LINE_WIDTH)
+            for perimeter in range(self.Perimeters)
+        ) * self.Towers
+        volume = wallsLength * TemplateGenerator.LINE_WIDTH * (
+            TemplateGenerator.FIRST_LAYER_HEIGHT
+            + (layers - 1) * self.LayerHeight
+        )
+        return volume / self._filamentArea / 1000.0
+
+    def _startLines(self, layers):
+        (minX, maxX), (minY, maxY), (minZ, maxZ) = self.Extents()
+        lines = [
+            ";FLAVOR:{}".format(TemplateGenerator.FLAVOR),
+            ";TIME:{}".format(int(layers * self.Towers * self.Perimeters
+                                  * TemplateGenerator.SEGMENTS * 0.05)),
+            ";Filament used: {}m".format(
+                _number(self._filamentUsed(layers), 6)
+            ),
+            ";Layer height: {}".format(_number(self.LayerHeight, 3)),
+            ";MINX:{}".format(_number(minX, 3)),
+            ";MINY:{}".format(_number(minY, 3)),
+            ";MINZ:{}".format(_number(minZ, 3)),
+            ";MAXX:{}".format(_number(maxX, 3)),
+            ";MAXY:{}".format(_number(maxY, 3)),
+            ";MAXZ:{}".format(_number(maxZ, 3)),
+            ";Generated with retractiontower.templategenerator"
+            " (seed {})".format(self.Seed),
+            "M140 S60",
+            "M105",
+            "M190 S60",
+            "M104 S200",
+            "M105",
+            "M109 S200",
+            "M82 ;absolute extrusion mode",
+            "G28 ;Home",
+            "G92 E0 ;Reset Extruder",
+            "G1 Z2.0 F3000 ;Move Z Axis up",
+            "G1 X10.1 Y20 Z0.28 F5000.0 ;Move to start position",
+            "G1 X10.1 Y200.0 Z0.28 F1500.0 E15 ;Draw the first line",
+            "G1 X10.4 Y200.0 Z0.28 F5000.0 ;Move to side a little",
+            "G1 X10.4 Y20 Z0.28 F1500.0 E30 ;Draw the second line",
+            "G92 E0 ;Reset Extruder",
+            "G1 Z2.0 F3000 ;Move Z Axis up",
+            "G92 E0",
+            "G1 F2400 E-{}".format(_number(TemplateGenerator.RETRACTION, 5)),
+            ";LAYER_COUNT:{}".format(layers),
+        ]
+        if self.Messages:
+            lines.insert(lines.index("G28 ;Home"),
+                         "M118 Synthetic template with {} towers"
+                         "".format(self.Towers))
+        return lines
+
+    def _endLines(self, state):
+        lines = [
+            "G1 F2400 E{}".format(_number(
+                state['e'] - TemplateGenerator.RETRACTION, 5
+            )),
+            "M140 S0",
+            "M107",
+            "G91 ;Relative positioning",
+            "G1 E-2 F2700 ;Retract a bit",
+            "G1 E-2 Z0.2 F2400 ;Retract and raise Z",
+            "G1 X5 Y5 F3000 ;Wipe out",
+            "G1 Z10 ;Raise Z more",
+            "G90 ;Absolute positionning",
+            "G1 X0 Y235 ;Present print",
+            "M106 S0 ;Turn-off fan",
+            "M104 S0 ;Turn-off hotend",
+            "M140 S0 ;Turn-off bed",
+            "M84 X Y E ;Disable all steppers but Z",
+            "M82 ;absolute extrusion mode",
+            "M104 S0",
+        ]
+        if self.Messages:
+            lines.append("M118 Done")
+        lines.append(";End of Gcode")
+        return lines
+
+    def _newState(self):
+        return {'e': 0.0, 'z': None, 'height': None, 'retracted': True,
+                'seconds': 0.0}
+
+    def CountLayers(self):
+        '''
+        Get the number of layers to write: Layers, or enough to reach
+        TargetBytes if set (estimated from the second layer, plus a
+        character on each line with E whenever E gets another digit).
+        '''
+        if self.TargetBytes is None:
+            return self.Layers
+        state = self._newState()
+        generator = random.Random(self.Seed)
+        total = len("\n".join(self._layer(0, state, generator))) + 1
+        startE = state['e']
+        lines = self._layer(1, state, generator)
+        layerBytes = len("\n".join(lines)) + 1
+        eLines = sum(1 for line in lines if " E" in line)
+        layerE = state['e'] - startE
+        total += (len("\n".join(self._startLines(self.Layers))) + 1
+                  + len("\n".join(self._endLines(state))) + 1)
+        layers = 1
+        startDigits = len(str(int(state['e'])))
+        while total < self.TargetBytes:
+            e = state['e'] + (layers - 1) * layerE
+            total += (layerBytes
+                      + eLines * (len(str(int(e))) - startDigits))
+            layers += 1
+        return layers
+
+    def Write(self, stream):
+        '''
+        Write the template to a text stream (one layer at a time, so
+        the whole file is never in memory).
+
+        Returns:
+        the number of lines written.
+        '''
+        layers = self.CountLayers()
+        self.Layers = layers
+        # ^ so Extents and LayerZ use the actual count
+        generator = random.Random(self.Seed)
+        state = self._newState()
+        count = 0
+        lines = self._startLines(layers)
+        stream.write("\n".join(lines) + "\n")
+        count += len(lines)
+        for layer in range(layers):
+            lines = self._layer(layer, state, generator)
+            stream.write("\n".join(lines) + "\n")
+            count += len(lines)
+        lines = self._endLines(state)
+        stream.write("\n".join(lines) + "\n")
+        count += len(lines)
+        return count
+
+
+def parse_size(text):
+    '''
+    Get the number of bytes from text such as "1G", "250M" or "4096".
+    '''
+    multipliers = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    multiplier = multipliers.get(text[-1:].upper())
+    if multiplier is None:
+        return int(text)
+    return int(float(text[:-1]) * multiplier)
+
+
+def main():
+    args = sys.argv[1:]
+    if (len(args) < 1) or (args[0] in ["--help", "/?"]):
+        print(__doc__)
+        return 0 if args else 1
+    path = args[0]
+    options = {}
+    names = {
+        "--layers": ('layers', int),
+        "--layer-height": ('layer_height', float),
+        "--towers": ('towers', int),
+        "--perimeters": ('perimeters', int),
+        "--size": ('target_bytes', parse_size),
+        "--seed": ('seed', int),
+    }
+    index = 1
+    while index < len(args):
+        name = names.get(args[index])
+        if (name is None) or (index + 1 >= len(args)):
+            print(__doc__)
+            print('Error: "{}" is not a valid option or has no value.'
+                  ''.format(args[index]))
+            return 1
+        key, convert = name
+        options[key] = convert(args[index + 1])
+        index += 2
+    generator = TemplateGenerator(**options)
+    with open(path, 'w') as stream:
+        count = generator.Write(stream)
+    print('Wrote {} lines ({} layers, {} bytes) to "{}"'.format(
+        count, generator.Layers, os.path.getsize(path), path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
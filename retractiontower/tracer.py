@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+'''
+Record how long each phase of a run takes (See /trace in the usage of
+retractiontower) as Chrome Trace Event JSON, which can be opened in
+chrome://tracing or https://ui.perfetto.dev.
+'''
+import contextlib
+import json
+import os
+import threading
+import time
+
+from retractiontower.bytestemplate import RawLines
+
+
+class Tracer:
+    '''
+    Keep "complete" events (with a start and duration) in Events.
+
+    Keyword arguments:
+    process_name -- the name of the process shown by the viewer.
+    '''
+    LAYER_MARK = ";LAYER:"
+
+    def __init__(self, process_name="retractiontower"):
+        self._start = time.perf_counter()
+        self._pid = os.getpid()
+        self.Events = [{
+            'name': "process_name",
+            'ph': "M",
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+            'args': {'name': process_name},
+        }]
+
+    def Now(self):
+        '''
+        Get the microseconds since the Tracer was created.
+        '''
+        return (time.perf_counter() - self._start) * 1000000.0
+
+    def Add(self, name, start, end, category="phase", args=None):
+        '''
+        Add a span from start to end (from Now).
+        '''
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': "X",
+            'ts': start,
+            'dur': end - start,
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+        }
+        if args:
+            event['args'] = args
+        self.Events.append(event)
+
+    @contextlib.contextmanager
+    def Span(self, name, category="phase", **args):
+        '''
+        Add a span for the time spent in a with statement.
+        '''
+        start = self.Now()
+        try:
+            yield
+        finally:
+            self.Add(name, start, self.Now(), category=category,
+                     args=args)
+
+    def LayerSpans(self, commands):
+        '''
+        Yield each of commands (such as from Program.ReadCommands or
+        BytesTemplate.Commands) and add a span for each layer (starting
+        at each ;LAYER: comment), so the time that the caller spends on
+        the lines of each layer is recorded.
+        '''
+        name = "start"
+        start = self.Now()
+        lineCount = 0
+        for command in commands:
+            layer = None
+            if command.__class__ is RawLines:
+                data = command.Data.tobytes()
+                index = data.rfind(Tracer.LAYER_MARK.encode("utf-8"))
+                if index > -1:
+                    end = data.find(b"\n", index)
+                    layer = data[index + len(Tracer.LAYER_MARK):end]
+                    layer = layer.decode("utf-8").strip()
+            elif ((command.Command is None)
+                    and command._line.startswith(Tracer.LAYER_MARK)):
+                layer = command._line[len(Tracer.LAYER_MARK):].strip()
+            if layer is not None:
+                now = self.Now()
+                self.Add(name, start, now, category="layer",
+                         args={'lines': lineCount})
+                name = "layer " + layer
+                start = now
+                lineCount = 0
+            if command.__class__ is RawLines:
+                lineCount += command.LineCount
+            else:
+                lineCount += 1
+            yield command
+        self.Add(name, start, self.Now(), category="layer",
+                 args={'lines': lineCount})
+
+    def Save(self, path):
+        '''
+        Write the events to path as JSON.
+        '''
+        with open(path, 'w') as stream:
+            json.dump({'traceEvents': self.Events,
+                       'displayTimeUnit': "ms"}, stream)
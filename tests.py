@@ -1,21 +1,78 @@
 #!/usr/bin/env python
+import atexit
+import io
+import os
+import glob
+import json
+import time
+import contextlib
+import shutil
+import tempfile
+import tracemalloc
 
 from retractiontower.gcodecommandpart import GCodeCommandPart
 
 from retractiontower.fxshim import (
-    IsWhiteSpace
+    IsWhiteSpace,
+    optionalD,
+    NumberToStr,
 )
 
+from retractiontower.numberformat import NumberFormatter
+
 from retractiontower.gcodecommand import (
     GCodeCommand,
 )
 
+from retractiontower.gcodecolumns import GCodeColumns
+
+from retractiontower.templatecache import TemplateCache
+
+from retractiontower.bytestemplate import BytesTemplate, RawLines
+
+from retractiontower.pipeline import LineReader, ThreadedWriter
+
+from retractiontower.templategenerator import TemplateGenerator
+
+from retractiontower.tracer import Tracer
+
+from retractiontower.progress import Progress
+
+from retractiontower.bgcode import (
+    BGCodeFile,
+    BGCodeWriter,
+    Block,
+    BlockType,
+    Compression,
+    Heatshrink,
+    MeatPack,
+    open_bgcode,
+)
+
+from retractiontower.compressedfile import (
+    compression_of,
+    open_file,
+    split_compression,
+)
+
+from retractiontower.compact import Compactor, CompactWriter, Toolpath
+
 from retractiontower import (
+    Program,
     Extent,
     CurvePoint,
     CurvePointType,
+    RetractionCurve,
+    GCodeWriter,
+    MessagePolicy,
 )
 
+TEST_CACHE_HOME = tempfile.mkdtemp()
+os.environ["XDG_CACHE_HOME"] = TEST_CACHE_HOME
+# ^ so that Main doesn't store the test templates in the real cache
+#   (See TemplateCache.DefaultDirectory).
+atexit.register(shutil.rmtree, TEST_CACHE_HOME, ignore_errors=True)
+
 def toPythonLiteral(v):
     '''
     [copied from pycodetool by author]
@@ -135,6 +192,78 @@ assertPartsAllEqual(good_parts, got_parts)
 assertEqual(got_parts[0].ToString(), "M70")
 
 assertEqual(GCodeCommand("M70").ToString(), "M70")
+assertEqual(GCodeCommand.CodeWords("G1 X1 // a;b"), ["G1", "X1"])
+assertEqual(GCodeCommand.CodeWords(b"G1 X1 ;a // b"), [b"G1", b"X1"])
+
+
+def partsToTuples(parts):
+    return [(part.Type, part.Character, part.Number, part.Text,
+             part.CommentMark) for part in parts]
+
+
+def assertSameAsPerChar(line, tbs=None):
+    assertAllEqual(
+        partsToTuples(GCodeCommandPart.ParseStringToParts(line)),
+        partsToTuples(GCodeCommandPart.ParseStringToPartsPerChar(line)),
+        tbs=tbs,
+    )
+
+
+for line in ["", " ", "\t", ";", "; only a comment", "// action:pause",
+             "G1 X1 Y2", "  G1\tX1  Y2 ;c", "G29 A", "T0", "G1 X1;c",
+             "G1 X1//c", "M117", "M117 ", "M117  Hi; there",
+             "M117;x", "  M118 Retraction 2.00000 at Z 2.1", "M0117 Hi",
+             "G1 M117 X1", "M117.5 X1"]:
+    assertSameAsPerChar(line, tbs="parsing {}".format(toPythonLiteral(line)))
+
+TESTS_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "retractiontower", "tests", "data")
+TEMPLATE_PATH = os.path.join(TESTS_DATA_DIR,
+                             "RetractionTestTemplate-C_CR-10.gcode")
+with open(TEMPLATE_PATH, 'r') as stream:
+    line_n = 0
+    for line in stream:
+        line_n += 1
+        assertSameAsPerChar(
+            line.rstrip("\n\r"),
+            tbs="parsing {}:{}".format(TEMPLATE_PATH, line_n),
+        )
+
+coordinateFormatter = NumberFormatter(3)
+for value in [0.0, -0.0, 1.0, -1.0, 12.0, 0.5, -0.5, 0.01234, 1.23456,
+              -1.23456, 99.9999, 199.9996, 200.0004, -12.3456, 1e-7, 12,
+              123456.789, 1e20]:
+    assertEqual(coordinateFormatter.Coordinate(value),
+                optionalD(float(value), 3).format(float(value)),
+                tbs="formatting {}".format(value))
+for value in [0, 5, 1.0, 1.5, -2.0, 224.82078859060402, 1e20]:
+    assertEqual(NumberFormatter.Number(value), NumberToStr(value),
+                tbs="formatting {}".format(value))
+assertEqual(NumberFormatter(3, fixed=True).Coordinate(1.5), "1.500")
+assertEqual(NumberFormatter(3, fixed=True).Coordinate(2), "2.000")
+
+EXPECTED_OPTIONALD_PATH = os.path.join(
+    TESTS_DATA_DIR, "RetractionTest.expected.optionalD.gcode"
+)
+with open(EXPECTED_OPTIONALD_PATH, 'r') as stream:
+    line_n = 0
+    for line in stream:
+        line_n += 1
+        line = line.rstrip("\n\r")
+        command = GCodeCommand(line)
+        for character in "XY":
+            if command.HasParameter(character):
+                value = command.GetParameter(character)
+                assertEqual(coordinateFormatter.Coordinate(value),
+                            optionalD(value, 3).format(value))
+        if any(len(word.lstrip("-").replace(".", "")) > 18
+               for word in GCodeCommand.CodeWords(line)):
+            # C# wrote E with decimal (up to 29 digits) which a float
+            #   can't hold.
+            continue
+        assertEqual(command.ToString(), line,
+                    tbs="formatting {}:{}".format(EXPECTED_OPTIONALD_PATH,
+                                                  line_n))
 
 line = "G00 X25 Y20"
 command = GCodeCommand(line)
@@ -169,6 +298,66 @@ assert(isinstance(command.GetParameter('X'), float))
 assertEqual(command.GetParameter('X'), 206.867)
 assertEqual(command.GetParameter('E'), 294.62339)
 
+line = "M201 X500.00 Y500.00 Z100.00 E5000.00 ;Setup machine max acceleration"
+command = GCodeCommand(line, lazy=True)
+assertEqual(command.Command, "M201")
+assertEqual(command._parts, None)
+assertEqual(command.ToString(), line)
+assertEqual(command.GetParameter('X'), 500.0)
+assertEqual(command.ToString(), line)
+# ^ Reading a parameter must not change the output.
+assertEqual(GCodeCommand(line).ToString(),
+            "M201 X500 Y500 Z100 E5000 ;Setup machine max acceleration")
+
+line = "G1 X206.8670 Y199.367 E294.62339 ;move"
+command = GCodeCommand(line, lazy=True)
+assertEqual(command.Command, "G1")
+command.SetParameter('X', command.GetParameter('X') + 1.0)
+assertEqual(command.ToString(), GCodeCommand("G1 X207.867 Y199.367"
+                                             " E294.62339 ;move").ToString())
+command.AddParameter('F', 2400)
+assertEqual(command.ToString(), "G1 X207.867 Y199.367 E294.62339 F2400 ;move")
+command.AddParameter('F', 600)
+assertEqual(command.GetParameter('F'), 600)
+
+for line in ["", ";LAYER:0", "  T0 ;tool", "A X1", "M117 Hello; world"]:
+    lazyCommand = GCodeCommand(line, lazy=True)
+    command = GCodeCommand(line)
+    assertEqual(lazyCommand.Command, command.Command, tbs=line)
+    assertEqual(lazyCommand.ToString(), line)
+
+assert(not hasattr(GCodeCommandPart(), "__dict__"))
+assert(not hasattr(GCodeCommand("G1 X1"), "__dict__"))
+assertEqual(GCodeCommand("G1 X1")._path, None)
+assertEqual(GCodeCommand("G1 X1", line_n=3)._line_n, 3)
+
+
+def bytesPerParsedLine(lines, lazy=False):
+    '''
+    Use tracemalloc to measure how many bytes the GCodeCommand objects
+    (including parts) for lines take while all of them are in memory.
+    '''
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        commands = [GCodeCommand(line, lazy=lazy) for line in lines]
+        used = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    return used / len(commands)
+
+
+with open(TEMPLATE_PATH, 'r') as stream:
+    templateLines = [line.rstrip("\n\r") for line in stream]
+eagerBytes = bytesPerParsedLine(templateLines)
+lazyBytes = bytesPerParsedLine(templateLines, lazy=True)
+print("bytes per parsed line: {:.0f} (eager), {:.0f} (lazy)"
+      "".format(eagerBytes, lazyBytes))
+# ^ Before GCodeCommandPart and GCodeCommand used __slots__, eager
+#   parsing took about 1195 bytes per line of TEMPLATE_PATH.
+assert(eagerBytes < 1100)
+assert(lazyBytes < eagerBytes / 2)
+
 ex = Extent()
 ex.From = 1.0
 ex.To = 3.0
@@ -238,4 +427,944 @@ curvePointsPassed = \
     sum(1 for point in curvePoints if point.Z >= z)
 assertEqual(curvePointsPassed, 1)
 
+curve = RetractionCurve(list(curvePoints))
+assertEqual(curve.CountFrom(1.5), 2)
+assertEqual(curve.CountFrom(-1), 3)
+assertEqual(curve.CountFrom(3.0), 1)
+assertEqual(curve.CountFrom(3.5), 0)
+
+mixedPoints = [
+    CurvePoint(PointType=CurvePointType.SameValueUntil, Z=2.1,
+               Retraction=1.0),
+    CurvePoint(PointType=CurvePointType.InterpolateUpTo, Z=10.0,
+               Retraction=4.0),
+    CurvePoint(PointType=CurvePointType.SameValueUntil, Z=5.0,
+               Retraction=4.0),
+    CurvePoint(PointType=CurvePointType.InterpolateUpTo, Z=32.0,
+               Retraction=6.0),
+]
+mixedCurve = RetractionCurve(mixedPoints)
+sortedPoints = sorted(mixedPoints)
+zValues = [0.3, 2.1, 2.2, 4.99, 5.0, 7.35, 10.0, 10.1, 31.9, 32.0, 40.0]
+for z in zValues:
+    assertEqual(mixedCurve.Get(z),
+                Program.GetRetractionForZ(z, sortedPoints),
+                tbs="getting the retraction at {}".format(z))
+    assertEqual(mixedCurve.Get(z), mixedCurve.Get(z))
+    # ^ The second one is cached.
+assertAllEqual(list(mixedCurve.GetMany(zValues)),
+               [mixedCurve.Get(z) for z in zValues])
+
+# The counts from the parsed commands must match scanning the strings.
+parsedOutput = io.StringIO()
+parsedWriter = GCodeWriter(parsedOutput)
+scannedWriter = GCodeWriter(io.StringIO())
+with open(TEMPLATE_PATH, 'r') as stream:
+    for line in stream:
+        line = line.rstrip("\n\r")
+        parsedWriter.WriteLine(GCodeCommand(line, lazy=True))
+        scannedWriter.WriteLine(line)
+        if parsedWriter.NumLines == 10:
+            assertEqual(parsedOutput.getvalue(), "")
+            # ^ The lines are buffered.
+parsedWriter.Flush()
+scannedWriter.Flush()
+for member in ["NumLines", "NumCommands", "NumMovementCommands",
+               "NumCharactersWritten"]:
+    assertEqual(getattr(parsedWriter, member), getattr(scannedWriter, member),
+                tbs="counting {}".format(member))
+assertEqual(parsedWriter.NumCharactersWritten, len(parsedOutput.getvalue()))
+
+templateText = """;LAYER:0
+G1 Z0.3
+G0 X10 Y10
+G1 X20 Y10 E1
+G1 X20 Y20 E2
+;LAYER:1
+G1 Z2.5
+G1 F2400 E1
+G1 X10 Y20 E3
+G1 F2400 E2
+G1 X10 Y10 E4
+"""
+measured = Program.MeasureGCode(io.StringIO(templateText),
+                                keep_commands=True)
+assertEqual(measured.X.From, 10.0)
+assertEqual(measured.X.To, 20.0)
+assertEqual(measured.Z.To, 2.5)
+assertEqual(len(measured.Commands), 11)
+singlePass = io.StringIO()
+singlePassPairs = Program.TranslateCommands(
+    measured.Commands, singlePass, 2.1, 1.0, -1.0, list(curvePoints),
+)
+separate = io.StringIO()
+separatePairs = Program.TranslateGCode(
+    io.StringIO(templateText), separate, 2.1, 1.0, -1.0, list(curvePoints),
+)
+assertEqual(singlePass.getvalue(), separate.getvalue())
+assertEqual(singlePassPairs, separatePairs)
+assert("G1 X11 Y19 E3" in separate.getvalue())
+
+variantCurves = [
+    list(curvePoints),
+    Program.ParseCurveArgs(["/startwith", "1", "/interpolate", "4"]),
+]
+variantOutputs = [io.StringIO(), io.StringIO()]
+variantPairs = Program.TranslateVariants(
+    Program.ReadCommands(io.StringIO(templateText)), variantOutputs, 2.1,
+    1.0, -1.0, variantCurves,
+)
+for variant in range(len(variantCurves)):
+    # Each variant must be the same as if it were the only one.
+    alone = io.StringIO()
+    alonePairs = Program.TranslateGCode(
+        io.StringIO(templateText), alone, 2.1, 1.0, -1.0,
+        variantCurves[variant],
+    )
+    assertEqual(variantOutputs[variant].getvalue(), alone.getvalue())
+    assertEqual(variantPairs[variant], alonePairs)
+assert(variantOutputs[0].getvalue() != variantOutputs[1].getvalue())
+assertEqual(Program.ParseCurveArgs([]), [])
+
+bytesDir = tempfile.mkdtemp()
+try:
+    bytesText = (";FLAVOR:Marlin \u00b0C\nM104 S200\nT0\n" + templateText
+                 + "G91\nG1 E-1\nG90\n; no newline at the end")
+    bytesPath = os.path.join(bytesDir, "Template-bytes.gcode")
+    with open(bytesPath, 'wb') as stream:
+        stream.write(bytesText.encode("utf-8"))
+    textStats = []
+    textOutput = io.StringIO()
+    textPairs = Program.TranslateVariants(
+        Program.ReadCommands(io.StringIO(bytesText)), [textOutput], 2.1,
+        1.0, -1.0, [list(curvePoints)], stats=textStats,
+    )
+    with BytesTemplate(bytesPath) as bytesTemplate:
+        assert(bytesTemplate.Supported)
+        items = list(bytesTemplate.Commands())
+        assert(isinstance(items[0], RawLines))
+        assertEqual(items[0].LineCount, 4)
+        assertEqual(items[0].NumCommands, 1)
+        # ^ Only M104 is a command (";LAYER:0" is also in the span).
+        items = None
+        for writerOutput in [io.BytesIO(), io.StringIO()]:
+            bytesStats = []
+            bytesPairs = Program.TranslateVariants(
+                bytesTemplate.Commands(), [writerOutput], 2.1, 1.0, -1.0,
+                [list(curvePoints)], stats=bytesStats,
+            )
+            result = writerOutput.getvalue()
+            if isinstance(result, bytes):
+                result = result.decode("utf-8")
+            assertEqual(result, textOutput.getvalue())
+            assertEqual(bytesPairs, textPairs)
+            assertEqual(bytesStats, textStats)
+        assertEqual(bytesTemplate.CountLines(), bytesText.count("\n") + 1)
+        bytesMeasured = Program.MeasureCommands(bytesTemplate.Commands())
+        textMeasured = Program.MeasureGCode(io.StringIO(bytesText))
+        for axis in "XYZ":
+            assertMembersEqual(getattr(bytesMeasured, axis),
+                               getattr(textMeasured, axis), ["From", "To"])
+    with open(bytesPath, 'wb') as stream:
+        stream.write(b"G1 X1\r\nG1 X2\r\n")
+    with BytesTemplate(bytesPath) as bytesTemplate:
+        assertEqual(bytesTemplate.Supported, False)
+    with open(bytesPath, 'wb') as stream:
+        pass
+    with BytesTemplate(bytesPath) as bytesTemplate:
+        assertEqual(list(bytesTemplate.Commands()), [])
+        assertEqual(bytesTemplate.CountLines(), 0)
+finally:
+    shutil.rmtree(bytesDir)
+
+parallelDir = tempfile.mkdtemp()
+try:
+    parallelText = (templateText + "G91\nG1 E-1\nG1 E1\nG90\n"
+                    + templateText.replace("Z2.5", "Z3")
+                    + "G1 E-2\n; no newline at the end")
+    parallelPath = os.path.join(parallelDir, "Template-parallel.gcode")
+    with open(parallelPath, 'w') as stream:
+        stream.write(parallelText)
+    chunks = Program.FindChunks(parallelPath, 3)
+    assertEqual(chunks[0][:1], (0,))
+    assertEqual(chunks[-1][1], len(parallelText))
+    for start, end, line_index in chunks[1:]:
+        assertEqual(parallelText[start - 1], "\n")
+        assertEqual(line_index, parallelText[:start].count("\n"))
+    serialStats = []
+    serialOutputs = [io.StringIO(), io.StringIO()]
+    serialPairs = Program.TranslateVariants(
+        Program.ReadCommands(io.StringIO(parallelText)), serialOutputs, 2.1,
+        1.0, -1.0, variantCurves, stats=serialStats,
+    )
+    firmwareStats = []
+    firmwareOutputs = [io.StringIO(), io.StringIO()]
+    firmwarePairs = Program.TranslateVariants(
+        Program.ReadCommands(io.StringIO(parallelText)), firmwareOutputs,
+        2.1, 1.0, -1.0, variantCurves, stats=firmwareStats,
+        firmware_retraction=True,
+    )
+    assertEqual(firmwarePairs, serialPairs)
+    firmwareLines = firmwareOutputs[1].getvalue().splitlines()
+    assertEqual(firmwareLines.count("G10"), 3)
+    assertEqual(firmwareLines.count("G11"), 2)
+    # ^ The relative retraction (G91) is written the usual way, and
+    #   nothing unretracts after the last one.
+    assertEqual(len([line for line in firmwareLines
+                     if line.startswith("M207 ")]), 2)
+    # ^ one for each layer, since the last retraction is on the same
+    #   layer as the one before it (The first variant only needs one,
+    #   since its curve has the same length on both layers).
+    assertEqual(len([line for line in firmwareOutputs[0].getvalue()
+                     .splitlines() if line.startswith("M207 ")]), 1)
+    assertEqual(firmwareLines[firmwareLines.index("G11") + 1],
+                "G1 X11 Y9 E4 F2400")
+    # ^ The move after G11 gets F of the retraction that G10 replaced.
+    for variant in range(len(variantCurves)):
+        assertEqual(serialStats[variant]['characters']
+                    - firmwareStats[variant]['characters'],
+                    firmwareStats[variant]['characters_saved'])
+        assertEqual(serialStats[variant]['lines']
+                    - firmwareStats[variant]['lines'],
+                    firmwareStats[variant]['lines_saved'])
+    for chunkCount in [1, 3, 100]:
+        # ^ 100 is more than the number of lines, so every seam is
+        #   tested.
+        parallelStats = []
+        parallelOutputs = [io.BytesIO(), io.StringIO()]
+        parallelPairs = Program.TranslateParallel(
+            parallelPath, parallelOutputs, 2.1, 1.0, -1.0, variantCurves,
+            stats=parallelStats, workers=2, chunks=chunkCount,
+        )
+        assertEqual(parallelOutputs[0].getvalue().decode("utf-8"),
+                    serialOutputs[0].getvalue())
+        assertEqual(parallelOutputs[1].getvalue(),
+                    serialOutputs[1].getvalue())
+        assertEqual(parallelPairs, serialPairs)
+        assertEqual(parallelStats, serialStats)
+        parallelStats = []
+        parallelOutputs = [io.StringIO(), io.BytesIO()]
+        Program.TranslateParallel(
+            parallelPath, parallelOutputs, 2.1, 1.0, -1.0, variantCurves,
+            stats=parallelStats, workers=2, chunks=chunkCount,
+            firmware_retraction=True,
+        )
+        assertEqual(parallelOutputs[0].getvalue(),
+                    firmwareOutputs[0].getvalue())
+        assertEqual(parallelOutputs[1].getvalue().decode("utf-8"),
+                    firmwareOutputs[1].getvalue())
+        assertEqual(parallelStats, firmwareStats)
+finally:
+    shutil.rmtree(parallelDir)
+
+lineReader = LineReader(io.StringIO(templateText), batch_characters=10,
+                        max_batches=1)
+pipelinedLines = []
+while True:
+    line = lineReader.readline()
+    if not line:
+        break
+    pipelinedLines.append(line)
+lineReader.close()
+assertEqual(pipelinedLines, io.StringIO(templateText).readlines())
+lineReader = LineReader(io.StringIO(templateText * 100),
+                        batch_characters=10, max_batches=1)
+assertEqual(lineReader.readline(), ";LAYER:0\n")
+lineReader.close()
+# ^ must not wait for the thread to read the rest
+
+
+class FailingStream:
+    def write(self, data):
+        raise OSError("No space left on device")
+
+    def close(self):
+        pass
+
+
+failingWriter = ThreadedWriter(FailingStream())
+failingWriter.write(b"G1 X1\n")
+try:
+    failingWriter.close()
+    raise AssertionError("ThreadedWriter didn't raise the write error.")
+except OSError:
+    pass
+
+pipelineDir = tempfile.mkdtemp()
+try:
+    pipelinedPath = os.path.join(pipelineDir, "pipelined.gcode")
+    pipelinedReader = LineReader(io.StringIO(templateText))
+    pipelinedWriter = ThreadedWriter(open(pipelinedPath, 'wb'))
+    try:
+        pipelinedPairs = Program.TranslateGCode(
+            pipelinedReader, pipelinedWriter, 2.1, 1.0, -1.0,
+            list(curvePoints),
+        )
+    finally:
+        pipelinedReader.close()
+        pipelinedWriter.close()
+    with open(pipelinedPath, 'r') as stream:
+        assertEqual(stream.read(), separate.getvalue())
+    assertEqual(pipelinedPairs, separatePairs)
+finally:
+    shutil.rmtree(pipelineDir)
+
+syntheticText = io.StringIO()
+syntheticLines = TemplateGenerator(layers=30, towers=3, seed=7).Write(
+    syntheticText
+)
+syntheticText = syntheticText.getvalue()
+assertEqual(syntheticLines, syntheticText.count("\n"))
+sameSeed = io.StringIO()
+TemplateGenerator(layers=30, towers=3, seed=7).Write(sameSeed)
+assertEqual(sameSeed.getvalue(), syntheticText)
+otherSeed = io.StringIO()
+TemplateGenerator(layers=30, towers=3, seed=8).Write(otherSeed)
+assert(otherSeed.getvalue() != syntheticText)
+assertEqual(syntheticText.count("\n;LAYER:"), 30)
+syntheticHeader = Program.ReadHeaderExtents(io.StringIO(syntheticText))
+syntheticMeasured = Program.MeasureGCode(io.StringIO(syntheticText))
+assertEqual(syntheticHeader.Z.To, syntheticMeasured.Z.To)
+assertEqual(syntheticHeader.Z.To, 6.1)
+syntheticStats = []
+Program.TranslateVariants(
+    Program.ReadCommands(io.StringIO(syntheticText)), [io.StringIO()], 2.1,
+    0.0, 0.0, [list(curvePoints)], stats=syntheticStats,
+)
+assertEqual(syntheticStats[0]['retractions'], 3 * 21 - 1 + 2)
+# ^ one before each tower on the 21 layers from Z 2.1 (except the
+#   first, which is before moving up to 2.1) and 2 in the end G-code
+
+
+def countMessages(text):
+    lines = text.splitlines()
+    return (len([line for line in lines if line.startswith("M117 ")]),
+            len([line for line in lines if line.startswith("M118 ")]))
+
+
+templateMessages = countMessages(syntheticText)
+policyMessages = {}
+for policyName, policy in MessagePolicy.NAMES.items():
+    policyOutput = io.StringIO()
+    Program.TranslateVariants(
+        Program.ReadCommands(io.StringIO(syntheticText)), [policyOutput],
+        2.1, 0.0, 0.0,
+        [Program.ParseCurveArgs(["/startwith", "2", "/setat", "4",
+                                 "/interpolateto", "5", "3"])],
+        message_policy=policy,
+    )
+    messageCounts = countMessages(policyOutput.getvalue())
+    policyMessages[policyName] = (
+        messageCounts[0] - templateMessages[0],
+        messageCounts[1] - templateMessages[1],
+    )
+assertEqual(policyMessages["retraction"], (64, 21))
+assertEqual(policyMessages["layer"], (21, 21))
+# ^ The end G-code retracts at the same Z as the top layer.
+assertEqual(policyMessages["value"], (7, 7))
+# ^ 2 at first, the 5 layers between Z 4 and 5, then 3 above Z 5
+assertEqual(policyMessages["off"], (0, 0))
+assertEqual(MessagePolicy.Parse("Layer"), MessagePolicy.LayerChange)
+try:
+    MessagePolicy.Parse("sometimes")
+    raise AssertionError("Parse accepted an unknown policy.")
+except ValueError:
+    pass
+sizedText = io.StringIO()
+sizedGenerator = TemplateGenerator(target_bytes=200000)
+sizedGenerator.Write(sizedText)
+assert(abs(len(sizedText.getvalue()) - 200000) < 20000)
+
+batchDir = tempfile.mkdtemp()
+try:
+    for name in ["Template-b.gcode", "Template-a.gcode", "notes.txt"]:
+        with open(os.path.join(batchDir, name), 'w') as stream:
+            stream.write(templateText)
+    batchTemplates = Program.FindBatchTemplates(
+        os.path.join(batchDir, "*.gcode")
+    )
+    assertAllEqual([os.path.basename(path) for path in batchTemplates],
+                   ["Template-a.gcode", "Template-b.gcode"])
+    manifestPath = os.path.join(batchDir, "manifest.json")
+    with open(manifestPath, 'w') as stream:
+        json.dump(["Template-b.gcode", "*-b.gcode", "missing.gcode"],
+                  stream)
+    assertAllEqual(Program.FindBatchTemplates(manifestPath),
+                   [os.path.join(batchDir, "Template-b.gcode")])
+    # Run the worker in this process (A process pool would re-import
+    #   this script).
+    batchPath, batchResults, batchError = Program.RunBatchJob(
+        (batchTemplates[0], [["/startwith", "1", "/interpolate", "4"]],
+         None, {})
+    )
+    assertEqual(batchError, None)
+    assertEqual(len(batchResults), 1)
+    assertEqual(batchResults[0]['lines'], 13)
+    assertEqual(batchResults[0]['retractions'], 1)
+    assertEqual(os.path.dirname(batchResults[0]['path']), batchDir)
+    assert(os.path.isfile(batchResults[0]['path']))
+    assertEqual(batchResults[0]['bytes_read'], len(templateText))
+    assertEqual(batchResults[0]['bytes_written'],
+                os.path.getsize(batchResults[0]['path']))
+    batchPath, batchResults, batchError = Program.RunBatchJob(
+        (os.path.join(batchDir, "missing.gcode"), [[]], None, {})
+    )
+    assertEqual(batchResults, None)
+    assert(batchError.startswith("ValueError"))
+finally:
+    shutil.rmtree(batchDir)
+
+assertEqual(split_compression("a/Template.gcode.GZ"),
+            ("a/Template.gcode", ".GZ"))
+assertEqual(split_compression("Template.gcode"), ("Template.gcode", ""))
+assertEqual(Program.PairsFileName("RetractionTest.gcode.xz",
+                                  [(2.1, 2.0), (17.0, 3.0)]),
+            "RetractionTest (z=2.1,r=2 to z=17,r=3).gcode.xz")
+compressedDir = tempfile.mkdtemp()
+try:
+    plainPath = os.path.join(compressedDir, "Template.gcode")
+    with open(plainPath, 'w') as stream:
+        stream.write(templateText)
+    assertEqual(compression_of(plainPath), None)
+    with open(plainPath, 'r') as stream:
+        plainOutput = io.StringIO()
+        with contextlib.redirect_stdout(io.StringIO()):
+            Program.TranslateGCode(stream, plainOutput, 2.1, 0.0, 0.0,
+                                   list(curvePoints))
+    for dotExt in [".gz", ".xz"]:
+        compressedPath = plainPath + dotExt
+        with open_file(compressedPath, 'w') as stream:
+            stream.write(templateText)
+        with open(compressedPath, 'rb') as stream:
+            assert(stream.read() != templateText.encode("utf-8"))
+        renamedPath = os.path.join(compressedDir, "renamed.gcode")
+        shutil.copy(compressedPath, renamedPath)
+        assertEqual(compression_of(renamedPath), dotExt)
+        # ^ by the magic bytes
+        assertEqual(compression_of(renamedPath, detect=False), None)
+        outputPath = os.path.join(compressedDir, "output.gcode" + dotExt)
+        with open_file(renamedPath, 'r') as reader, \
+                open_file(outputPath, 'wb') as writer:
+            with contextlib.redirect_stdout(io.StringIO()):
+                Program.TranslateGCode(reader, writer, 2.1, 0.0, 0.0,
+                                       list(curvePoints))
+        with open_file(outputPath, 'r') as stream:
+            assertEqual(stream.read(), plainOutput.getvalue())
+        compressedAnalysis = io.StringIO()
+        with contextlib.redirect_stdout(compressedAnalysis):
+            Program.AnalyzeFile(compressedPath)
+        plainAnalysis = io.StringIO()
+        with contextlib.redirect_stdout(plainAnalysis):
+            Program.AnalyzeFile(plainPath)
+        assertEqual(compressedAnalysis.getvalue(),
+                    plainAnalysis.getvalue())
+    try:
+        open_file(plainPath, 'a')
+        raise AssertionError("Appending should not be supported.")
+    except ValueError:
+        pass
+finally:
+    shutil.rmtree(compressedDir)
+
+
+heatshrinkData = (templateText * 20 + "a" * 100 + "\u00b0C").encode("utf-8")
+for compression, parameters in Heatshrink.PARAMETERS.items():
+    heatshrinkPacked = Heatshrink.Compress(heatshrinkData, *parameters)
+    assert(len(heatshrinkPacked) < len(heatshrinkData) / 4)
+    assertEqual(Heatshrink.Decompress(heatshrinkPacked, *parameters),
+                heatshrinkData)
+    assertEqual(Block.Decompress(Block.Compress(b"G1\n", compression),
+                                 compression), b"G1\n")
+assertEqual(Heatshrink.Decompress(Heatshrink.Compress(b"", 12, 4), 12, 4),
+            b"")
+for meatPackText in [templateText, templateText + "G1 X1",
+                     templateText + "G1 X12", "\n\n; \u00b0C\n", ""]:
+    meatPackData = meatPackText.encode("utf-8")
+    meatPacked = MeatPack.Pack(meatPackData)
+    assertEqual(MeatPack.Unpack(meatPacked), meatPackData)
+assert(len(MeatPack.Pack(templateText.encode("utf-8")))
+       < len(templateText) * 0.8)
+noSpacesPacked = bytes([
+    MeatPack.SIGNAL, MeatPack.SIGNAL, MeatPack.EnablePacking,
+    MeatPack.SIGNAL, MeatPack.SIGNAL, MeatPack.EnableNoSpaces,
+    0x1D, 0x1E, 0xB0, 0x5A, 0xBC,  # "G1", "X1", "0E", ".5", "\n"
+])
+assertEqual(MeatPack.Unpack(noSpacesPacked), b"G1 X10 E.5\n")
+assertEqual(MeatPack.AddSpaces(b"G1X10E.5 ;a B\nM104S200"),
+            b"G1 X10 E.5 ;a B\nM104 S200")
+try:
+    MeatPack.Pack(b"G1\xff\n")
+    raise AssertionError("Packing 0xFF should fail.")
+except ValueError:
+    pass
+
+# Reference vectors (not made by retractiontower.bgcode), so that a
+#   mistake made the same way by both the encoder and decoder fails:
+referenceText = b"G1 X10\nM104 S200\n"
+referenceMeatPack = bytes.fromhex(
+    "fffffb"  # signal, signal, enable packing
+    "1d" "eb" "01"  # "G1", " X", "10" (the first is in the low 4 bits)
+    "bc"  # "\n" (which makes the decoder ignore the " " after it)
+    "1f4d"  # "M" (not in the table, so it follows in full), "1"
+    "40" "fb53" "02"  # "04", " S" ("S" follows), "20"
+    "c0"  # "0\n"
+)
+# ^ from the table in Marlin's and Prusa's MeatPack decoder
+assertEqual(MeatPack.Unpack(referenceMeatPack), referenceText)
+assertEqual(MeatPack.Pack(referenceText), referenceMeatPack)
+referenceHeatshrinkText = b"G1 X10 Y10\nG1 X10 Y20\nG1 X20 Y20\n"
+referenceHeatshrink = {
+    (11, 4): bytes.fromhex("a3cc6415898cc2415998cc214014f3200a59900528"),
+    (12, 4): bytes.fromhex("a3cc6415898cc2415998cc21400a799002966400a5"),
+}
+# ^ from heatshrink's own encoder (via the heatshrink2 package)
+for parameters, referencePacked in referenceHeatshrink.items():
+    assertEqual(Heatshrink.Decompress(referencePacked, *parameters),
+                referenceHeatshrinkText)
+    assertEqual(Heatshrink.Compress(referenceHeatshrinkText, *parameters),
+                referencePacked)
+referenceGCodeBlock = bytes.fromhex(
+    "0100" "0300"  # G-code, Heatshrink12_4
+    "0e000000" "10000000"  # uncompressed and compressed size
+    "0200"  # MeatPackComments
+    "ffffff71df5c07791fa6d03f75381700"  # referenceMeatPack, compressed
+    "6a8b4390"  # the CRC32 of all of the above
+)
+referenceMetadataBlock = (
+    bytes.fromhex("0300" "0000" "12000000" "0000")  # printer, INI
+    + b"printer_model=MK4\n"
+    + bytes.fromhex("ddf36497")
+)
+referenceBGCode = (b"GCDE" + bytes.fromhex("01000000" "0100")
+                   + referenceMetadataBlock + referenceGCodeBlock)
+# ^ See the specification linked in retractiontower/bgcode.py.
+referenceBlock = Block.Read(io.BytesIO(referenceGCodeBlock), 1)
+assertEqual(referenceBlock.Data, referenceMeatPack)
+referenceWritten = io.BytesIO()
+referenceBlock.Write(referenceWritten, Compression.Heatshrink12_4, 1)
+assertEqual(referenceWritten.getvalue(), referenceGCodeBlock)
+referenceWritten = io.BytesIO()
+Block.Read(io.BytesIO(referenceMetadataBlock), 1).Write(
+    referenceWritten, Compression.NoCompression, 1,
+)
+assertEqual(referenceWritten.getvalue(), referenceMetadataBlock)
+
+try:
+    import heatshrink2
+except ImportError:
+    heatshrink2 = None
+    print("WARNING: heatshrink2 is not installed so Heatshrink was only"
+          " compared to the reference vectors.")
+if heatshrink2 is not None:
+    for parameters in Heatshrink.PARAMETERS.values():
+        referencePacked = heatshrink2.compress(
+            heatshrinkData,
+            window_sz2=parameters[0],
+            lookahead_sz2=parameters[1],
+        )
+        assertEqual(Heatshrink.Compress(heatshrinkData, *parameters),
+                    referencePacked)
+
+bgcodeDir = tempfile.mkdtemp()
+try:
+    bgcodePath = os.path.join(bgcodeDir, "Template.bgcode")
+    for bundledPath in sorted(glob.glob(os.path.join(
+            TESTS_DATA_DIR, "RetractionTestTemplate-*.gcode"))):
+        with open(bundledPath, 'rb') as stream:
+            bundledData = stream.read()
+        with open_bgcode(bgcodePath, 'wb') as stream:
+            stream.write(bundledData)
+        assert(os.path.getsize(bgcodePath) < len(bundledData) / 3)
+        with open_bgcode(bgcodePath, 'rb') as stream:
+            assertEqual(stream.read(), bundledData)
+    assertEqual(compression_of(bgcodePath), ".bgcode")
+    referencePath = os.path.join(bgcodeDir, "reference.bgcode")
+    with open(referencePath, 'wb') as stream:
+        stream.write(referenceBGCode)
+    with open_bgcode(referencePath, 'rb') as stream:
+        assertEqual(stream.read(), referenceText)
+    referenceCopy = os.path.join(bgcodeDir, "reference-copy.bgcode")
+    with open_bgcode(referenceCopy, 'wb', like=referencePath) as stream:
+        stream.write(referenceText)
+    with open(referenceCopy, 'rb') as stream:
+        referenceCopied = stream.read()
+    assert(referenceCopied.startswith(referenceBGCode[:10]))
+    assert(referenceCopied.endswith(referenceGCodeBlock))
+    # ^ The metadata is written with Deflate (BGCodeWriter), but the
+    #   header and the G-code are the same as in the reference file.
+    assertEqual(split_compression(bgcodePath),
+                (os.path.join(bgcodeDir, "Template"), ".bgcode"))
+    with open(bgcodePath, 'rb') as stream:
+        corrupted = bytearray(stream.read())
+    corrupted[len(corrupted) // 2] ^= 0x01
+    with open(bgcodePath, 'wb') as stream:
+        stream.write(corrupted)
+    try:
+        with open_bgcode(bgcodePath, 'r') as stream:
+            stream.read()
+        raise AssertionError("A bad checksum should fail.")
+    except ValueError:
+        pass
+
+    # bgcode in, bgcode out, with the metadata and thumbnail kept
+    bgcodeMetadata = BGCodeFile.DefaultMetadata()
+    bgcodeMetadata[1].Data = b"printer_model=MK4\n"
+    bgcodeMetadata.insert(2, Block(BlockType.Thumbnail,
+                                   b"\x00\x00\x10\x00\x10\x00",
+                                   b"\x89PNG not really"))
+    templateBGCode = os.path.join(bgcodeDir, "Template-tower.bgcode")
+    with BGCodeWriter(templateBGCode, metadata=bgcodeMetadata,
+                      compression=Compression.Deflate) as stream:
+        stream.write(templateText.encode("utf-8"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        assertEqual(Program.Main([templateBGCode, "/startwith", "1"]), 0)
+        plainTemplate = os.path.join(bgcodeDir, "Template-plain.gcode")
+        with open(plainTemplate, 'w') as stream:
+            stream.write(templateText)
+        assertEqual(Program.Main([plainTemplate, "/startwith", "1"]), 0)
+    bgcodeOutputs = glob.glob(os.path.join(bgcodeDir,
+                                           "RetractionTest-tower*.bgcode"))
+    plainOutputs = glob.glob(os.path.join(bgcodeDir,
+                                          "RetractionTest-plain*.gcode"))
+    assertEqual(len(bgcodeOutputs), 1)
+    with open_bgcode(bgcodeOutputs[0], 'r') as stream, \
+            open(plainOutputs[0], 'r') as plain:
+        assertEqual(stream.read(), plain.read())
+    assertAllEqual([(block.Type, block.Parameters, block.Data)
+                    for block in BGCodeFile.ReadMetadata(bgcodeOutputs[0])],
+                   [(block.Type, block.Parameters, block.Data)
+                    for block in bgcodeMetadata])
+finally:
+    shutil.rmtree(bgcodeDir)
+
+compactor = Compactor(decimals=3)
+compactLines = [compactor.Compact(line) for line in [
+    ";LAYER:0",
+    "G1 F1800 X10.0000 Y20.12345 E0.5 ;TYPE:WALL-OUTER",
+    "G1 F1800 X10 Y21 E0.9866220735785953",
+    "G1 X10 Y21",
+    "M117 dE 2.000 at Z 2.1",
+    "G91",
+    "G1 Z0.2 E-1.23456",
+    "G1 X0",
+    "G90",
+    "G1 X10 Y21 Z3",
+    "G28 X",
+    "G1 X10 Y21 F1800",
+    "",
+]]
+assertAllEqual(compactLines, [
+    None,
+    "G1 F1800 X10 Y20.123 E0.5",
+    "G1 Y21 E0.987",
+    None,
+    "M117 dE 2.000 at Z 2.1",
+    "G91",
+    "G1 Z0.2 E-1.23456",
+    None,
+    "G90",
+    "G1 Z3",
+    # ^ X and Y are still known but Z isn't (after the relative move).
+    "G28 X",
+    "G1 X10 Y21 F1800",
+    # ^ Homing could change the position and speed.
+    None,
+])
+compactText = (templateText.replace("G1 X20 Y20 E2", "G1 F600 X20 Y20 E2")
+               + "G1 F600 X10.00001 Y10 E4.0000001\nG1 E4.5")
+compactOutput = io.BytesIO()
+compactWriter = CompactWriter(compactOutput, decimals=3, verify=True)
+compactData = compactText.encode("utf-8")
+for start in range(0, len(compactData), 7):
+    # ^ The lines are split between writes.
+    compactWriter.write(memoryview(compactData)[start:start + 7])
+compactOutput.close = lambda: None
+# ^ so the output can be checked after closing compactWriter
+compactWriter.close()
+compactResult = compactOutput.getvalue().decode("utf-8")
+assertEqual(compactResult.splitlines()[-2:], ["G1 F600 E4", "G1 E4.5"])
+assert(not compactResult.endswith("\n"))
+assertEqual(compactWriter.LinesIn, compactText.count("\n") + 1)
+assertEqual(compactWriter.CharactersIn, len(compactText))
+assertEqual(compactWriter.CharactersOut, len(compactResult))
+assertEqual(Toolpath.Compare(io.StringIO(compactText),
+                             io.StringIO(compactResult), decimals=3),
+            compactWriter.VerifiedEvents)
+try:
+    Toolpath.Compare(io.StringIO(compactText),
+                     io.StringIO(compactResult.replace("F600", "F601")),
+                     decimals=3)
+    raise AssertionError("Toolpath.Compare missed a different speed.")
+except ValueError:
+    pass
+brokenWriter = CompactWriter(io.BytesIO(), verify=True)
+brokenWriter.write(b"G1 F1800 X1\n")
+brokenWriter._compactor._feedrate = 600.0
+# ^ as if Compactor had a bug that lost track of the speed
+try:
+    brokenWriter.write(b"G1 F600 X2\n")
+    raise AssertionError("CompactWriter didn't verify the toolpath.")
+except ValueError:
+    pass
+roundingWriter = CompactWriter(io.BytesIO(), decimals=3, verify=True)
+roundingWriter._compactor._spec = ".1f"
+# ^ as if Compactor rounded to fewer places than it says
+try:
+    roundingWriter.write(b"G1 X10 Y10\nG1 X10.04 Y10\n")
+    raise AssertionError("CompactWriter missed a move lost to rounding.")
+except ValueError:
+    pass
+assertEqual(Toolpath.Compare(["G1 X10 Y10", "G1 X10.0004", "G1 X20 E1"],
+                             ["G1 X10 Y10", "G1 X20 E1"], decimals=3), 2)
+# ^ The second move is within the rounding of the first.
+try:
+    Toolpath.Compare(["G1 X10 Y10", "G1 X10.004", "G1 X20 E1"],
+                     ["G1 X10 Y10", "G1 X20 E1"], decimals=3)
+    raise AssertionError("Toolpath.Compare missed a move.")
+except ValueError:
+    pass
+assertEqual(Toolpath.Parse("G1 X-1.5 E.25 T"),
+            ("G1", [('X', -1.5), ('E', 0.25), ('T', None)]))
+assertEqual(Toolpath.Parse("G1 X1,5"), (None, None))
+
+compactDir = tempfile.mkdtemp()
+try:
+    compactTemplate = os.path.join(compactDir, "Template-compact.gcode")
+    with open(compactTemplate, 'w') as stream:
+        stream.write(templateText)
+    compactPaths = []
+    for options in [[], ["/compact-decimals", "3", "/verify-compact"]]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            assertEqual(Program.Main([compactTemplate, "/startwith", "1"]
+                                     + options), 0)
+        outputPath = glob.glob(os.path.join(
+            compactDir, "RetractionTest-compact*.gcode"))[0]
+        compactPaths.append(outputPath + ".{}".format(len(options)))
+        shutil.move(outputPath, compactPaths[-1])
+    assert(os.path.getsize(compactPaths[1])
+           < os.path.getsize(compactPaths[0]))
+    with open(compactPaths[0], 'r') as full, \
+            open(compactPaths[1], 'r') as compacted:
+        assert(Toolpath.Compare(full, compacted, decimals=3) > 0)
+finally:
+    shutil.rmtree(compactDir)
+
+
+class FakeTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+progressInfos = []
+progressStream = io.StringIO()
+progress = Progress(total_lines=11, stream=progressStream, interval=0,
+                    callback=progressInfos.append)
+assert(not progress.Drawing)
+with contextlib.redirect_stdout(io.StringIO()):
+    Program.TranslateGCode(io.StringIO(templateText), io.StringIO(), 2.1,
+                           0.0, 0.0, list(curvePoints), progress=progress)
+assertAllEqual([info['lines'] for info in progressInfos], [2, 7, 11])
+# ^ at each new Z then when done
+assertEqual(progressInfos[0]['fraction'], 2 / 11)
+assertEqual(progressInfos[-1]['done'], True)
+assertEqual(progressInfos[-1]['fraction'], 1.0)
+assertEqual(progressInfos[-1]['eta_seconds'], 0.0)
+assertEqual(progressStream.getvalue(), "")
+terminal = FakeTerminal()
+progress = Progress(total_bytes=1000, stream=terminal, interval=0)
+progress.Update(10, position=250)
+assert(terminal.getvalue().startswith("\r 25% 10 lines"))
+progress.Finish(40)
+assert(terminal.getvalue().endswith("\r"))
+assertEqual(terminal.getvalue().split("\r")[-2].strip(), "")
+# ^ The status line is erased.
+assert(not Progress.IsNeeded(stream=io.StringIO()))
+assert(Progress.IsNeeded(stream=io.StringIO(), callback=print))
+assertEqual(Progress.FormatSeconds(3725), "1:02:05")
+
+tracer = Tracer()
+tracedCommands = list(tracer.LayerSpans(
+    Program.ReadCommands(io.StringIO(templateText))
+))
+assertEqual(len(tracedCommands), 11)
+layerEvents = [event for event in tracer.Events
+               if event.get('cat') == "layer"]
+assertAllEqual([event['name'] for event in layerEvents],
+               ["start", "layer 0", "layer 1"])
+assertAllEqual([event['args']['lines'] for event in layerEvents],
+               [0, 5, 6])
+
+traceDir = tempfile.mkdtemp()
+try:
+    tracedTemplate = os.path.join(traceDir, "Template.gcode")
+    with open(tracedTemplate, 'w') as stream:
+        stream.write(templateText)
+    tracer = Tracer()
+    with BytesTemplate(tracedTemplate) as rawTemplate:
+        list(tracer.LayerSpans(rawTemplate.Commands()))
+    assertAllEqual([event['args']['lines'] for event in tracer.Events
+                    if event.get('cat') == "layer"],
+                   [0, 5, 6])
+    tracePath = os.path.join(traceDir, "trace.json")
+    metricsPath = os.path.join(traceDir, "metrics.json")
+    diagnostics = io.StringIO()
+    with contextlib.redirect_stdout(io.StringIO()), \
+            contextlib.redirect_stderr(diagnostics):
+        assertEqual(Program.Main([tracedTemplate, "/trace", tracePath,
+                                  "/profile", "/startwith", "1",
+                                  "/metrics", metricsPath]), 0)
+    with open(metricsPath, 'r') as stream:
+        metrics = json.load(stream)
+    assertEqual(metrics['failures'], [])
+    assertEqual(len(metrics['results']), 1)
+    runMetrics = metrics['results'][0]
+    assertEqual(runMetrics['lines'], 13)
+    assertEqual(runMetrics['retractions'], 1)
+    assertEqual(runMetrics['bytes_read'], len(templateText))
+    assertEqual(runMetrics['bytes_written'],
+                os.path.getsize(os.path.join(traceDir, runMetrics['path'])))
+    assertEqual(runMetrics['pairs'][0], [2.5, 1.0])
+    assert(runMetrics['seconds'] >= runMetrics['write_seconds'])
+    assertEqual(Program.tracer, None)
+    assert("tottime" in diagnostics.getvalue())
+    with open(tracePath, 'r') as stream:
+        traceEvents = json.load(stream)['traceEvents']
+    traceNames = [event['name'] for event in traceEvents]
+    for name in ["Main", "CalculateExtents", "PrintChart", "Translate",
+                 "layer 0", "layer 1"]:
+        assert(name in traceNames), name
+finally:
+    shutil.rmtree(traceDir)
+try:
+    Program.ParseCurveArgs(["/interpolate", "4"])
+    raise AssertionError("/interpolate before /startwith should fail.")
+except ValueError:
+    pass
+
+assertEqual(Program.ReadHeaderExtents(io.StringIO(templateText)), None)
+with open(TEMPLATE_PATH, 'r') as stream:
+    headerExtents = Program.ReadHeaderExtents(stream)
+assertEqual(headerExtents.X.From, 170.9)
+assertEqual(headerExtents.X.To, 219.5)
+assertEqual(headerExtents.Y.From, 178.4)
+assertEqual(headerExtents.Y.To, 212.0)
+assertEqual(headerExtents.Z.From, 0.3)
+assertEqual(headerExtents.Z.To, 17.0)
+assertEqual(
+    Program.ReadHeaderExtents(io.StringIO(";MINX:1\n" + ";\n" * 5000
+                                          + ";MINY:1\n")),
+    None,
+)
+# ^ Only the start of the file is checked.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    print("WARNING: NumPy is not installed so GCodeColumns was not tested.")
+
+if numpy is not None:
+    relativeText = templateText + "G91\nG1 E-1\nG1 E1\nG90\nG1 E3\n"
+    columns = GCodeColumns.Load(io.StringIO(relativeText))
+    assertEqual(columns.LineCount, 16)
+    assertAllEqual(list(columns.Code), [1, 0, 1, 1, 1, 1, 1, 1, 1,
+                                        91, 1, 1, 90, 1])
+    assert(numpy.isnan(columns.E[1]))
+    assertEqual(sorted(columns.Retractions(2.1).items()),
+                [(9, (2.5, 3.0, False)), (12, (2.5, 4.0, True))])
+    columnsOutput = io.StringIO()
+    Program.TranslateGCode(io.StringIO(relativeText), columnsOutput, 2.1,
+                           1.0, -1.0, list(curvePoints),
+                           retractions=columns.Retractions(2.1))
+    loopOutput = io.StringIO()
+    Program.TranslateGCode(io.StringIO(relativeText), loopOutput, 2.1,
+                           1.0, -1.0, list(curvePoints))
+    assertEqual(columnsOutput.getvalue(), loopOutput.getvalue())
+
+    for name in sorted(os.listdir(TESTS_DATA_DIR)):
+        if not name.endswith(".gcode"):
+            continue
+        path = os.path.join(TESTS_DATA_DIR, name)
+        with open(path, 'r') as stream:
+            measured = Program.MeasureGCode(stream)
+        with open(path, 'r') as stream:
+            vectorized = GCodeColumns.Load(stream).Extents()
+        for axis in "XYZ":
+            assertMembersEqual(getattr(measured, axis),
+                               getattr(vectorized, axis), ["From", "To"],
+                               tbs="measuring {} of {}".format(axis, name))
+
+    cacheDir = tempfile.mkdtemp()
+    try:
+        cache = TemplateCache(cacheDir)
+        cacheKey = TemplateCache.Key(TEMPLATE_PATH)
+        assertEqual(cache.Load(cacheKey), None)
+        parsed = cache.GetColumns(TEMPLATE_PATH, firstTowerZ=2.1)
+        cached = cache.Load(cacheKey)
+        assertEqual(cached.LineCount, parsed.LineCount)
+        for member in ["Line", "Code"] + list(GCodeColumns.PARAMS):
+            assert(numpy.array_equal(getattr(cached, member),
+                                     getattr(parsed, member),
+                                     equal_nan=True))
+        for axis in "XYZ":
+            assertMembersEqual(getattr(cached.Extents(), axis),
+                               getattr(parsed.Extents(), axis),
+                               ["From", "To"])
+        assertEqual(cached.Retractions(2.1), parsed.Retractions(2.1))
+        assert(cached._retractions.get(2.1) is not None)
+        # ^ The retractions must be loaded, not calculated again.
+
+        cachedOutput = io.StringIO()
+        with contextlib.redirect_stdout(cachedOutput):
+            Program.AnalyzeFile(TEMPLATE_PATH, cache=cache)
+        loopOutput = io.StringIO()
+        with contextlib.redirect_stdout(loopOutput):
+            Program.AnalyzeFile(TEMPLATE_PATH)
+        assertEqual(cachedOutput.getvalue(), loopOutput.getvalue())
+
+        # Only the most recently used entry fits:
+        otherPath = os.path.join(cacheDir, "other.gcode")
+        with open(otherPath, 'w') as stream:
+            stream.write(relativeText)
+        entryPath = os.path.join(cacheDir, cacheKey + ".npz")
+        os.utime(entryPath, (time.time() - 60, time.time() - 60))
+        cache.MaxBytes = os.path.getsize(entryPath)
+        cache.GetColumns(otherPath)
+        assert(not os.path.isfile(entryPath))
+        assert(cache.Load(TemplateCache.Key(otherPath)) is not None)
+
+        # The header has the extents, so the cache is only used when
+        #   every line must be measured anyway:
+        headerCache = TemplateCache(os.path.join(cacheDir, "header"))
+        Program.set_template(TEMPLATE_PATH)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert(Program.CalculateExtents(cache=headerCache))
+        assertEqual(headerCache.Load(cacheKey), None)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            # ^ The header of TEMPLATE_PATH has a different MINZ.
+            assert(Program.CalculateExtents(verify=True, cache=headerCache))
+        assert(headerCache.Load(cacheKey) is not None)
+
+        # /verify-extents still compares the header to the columns:
+        wrongHeaderPath = os.path.join(cacheDir, "wrong-header.gcode")
+        with open(wrongHeaderPath, 'w') as stream:
+            stream.write(";MINX:0\n;MINY:10\n;MINZ:0.3\n;MAXX:20\n"
+                         ";MAXY:20\n;MAXZ:2.5\n" + templateText)
+            # ^ X is really from 10 to 20.
+        Program.set_template(wrongHeaderPath)
+        for columnar in [False, True]:
+            verifyErrors = io.StringIO()
+            with contextlib.redirect_stdout(io.StringIO()), \
+                    contextlib.redirect_stderr(verifyErrors):
+                assert(Program.CalculateExtents(verify=True,
+                                                columnar=columnar,
+                                                cache=headerCache))
+            assert(Program._columns is not None)
+            assertEqual(verifyErrors.getvalue(),
+                        "Warning: The header says X is from 0.0 to 20.0"
+                        " but the G-code is from 10.0 to 20.0.\n")
+    finally:
+        shutil.rmtree(cacheDir)
+
 print("All tests passed.")